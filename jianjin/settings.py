@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'words.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +70,43 @@ DATABASES = {
     'default': dj_database_url.config()
 }
 
+# Used for caching API responses (see words/cache.py). Each process has its own local memory
+# cache unless REDIS_URL is set; use Redis when running more than one process.
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+WORDS_CACHE_TIMEOUT = int(os.environ.get('WORDS_CACHE_TIMEOUT', 60))
+
+# Per-request query counts and timings (see words/profiling.py), logged to the console
+WORDS_PROFILING = os.environ.get('WORDS_PROFILING', None) == '1'
+WORDS_PROFILING_REPEAT_THRESHOLD = int(os.environ.get('WORDS_PROFILING_REPEAT_THRESHOLD', 10))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'words.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 # Internationalization
 
 LANGUAGE_CODE = 'en-us'
@@ -50,9 +50,42 @@ jianjinControllers.constant('extract_examples', function(word) {
   return result;
 });
 
-jianjinControllers.factory('load_tags', function(handle_error) {
+// Maximum number of responses kept by conditional_get
+jianjinControllers.constant('conditional_get_size', 50);
+
+jianjinControllers.factory('conditional_get', function($http, $q, conditional_get_size) {
+  // Keep recent responses along with their ETags, so that the server can tell us to reuse
+  // them (with HTTP 304) instead of sending the same data again
+  var responses = {};
+  var urls = [];
+  return function(url) {
+    var cached = responses[url];
+    var config = cached ? {"headers": {"If-None-Match": cached.etag}} : {};
+    return $http.get(url, config).then(function(response) {
+      var etag = response.headers('ETag');
+      if (!(url in responses)) {
+        urls.push(url);
+      }
+      responses[url] = {"etag": etag, "response": response};
+      if (!etag) {
+        delete responses[url];
+      }
+      while (urls.length > conditional_get_size) {
+        delete responses[urls.shift()];
+      }
+      return response;
+    }, function(response) {
+      if (response.status == 304 && cached) {
+        return cached.response;
+      }
+      return $q.reject(response);
+    });
+  };
+});
+
+jianjinControllers.factory('load_tags', function(handle_error, conditional_get) {
   return function($scope, $http) {
-    $http.get('/words/tags/').then(function(response) {
+    conditional_get('/words/tags/').then(function(response) {
       var data = response.data;
       $scope.all_tags = data.map(function(t) { return t.tag });
     }).catch(handle_error($scope));
@@ -88,18 +121,19 @@ jianjinControllers.factory('decrease_confidence', function(change_confidence) {
   };
 });
 
-jianjinControllers.controller('BrowseListCtrl', function ($scope, $http, $routeParams, load_tags, handle_error) {
+jianjinControllers.controller('BrowseListCtrl', function ($scope, $http, $routeParams, load_tags, handle_error, conditional_get) {
   $scope.tag = $routeParams.tag;
   $scope.params = {"words_per_page": 10, "order": "date_added"};
   $scope.available_orders = ["date_added", "last_modified", "word", "pinyin", "confidence"];
 
   $scope.make_url = function() {
-    return ($scope.tag ? '/words/wordsbytag/' + $scope.tag + '/' : '/words/words/') + "?page_size=" + $scope.params.words_per_page + "&order=" + $scope.params.order;
+    // Empty cursor asks for the first page of cursor-based pagination
+    return ($scope.tag ? '/words/wordsbytag/' + $scope.tag + '/' : '/words/words/') + "?page_size=" + $scope.params.words_per_page + "&order=" + $scope.params.order + "&cursor=";
   };
 
   $scope.load_words = function(url) {
     $scope.loading = true;
-    $http.get(url).then(function(response) {
+    conditional_get(url).then(function(response) {
       var data = response.data;
       $scope.count = data['count'];
       $scope.page = data['page'];
@@ -138,7 +172,7 @@ jianjinControllers.controller('BrowseListCtrl', function ($scope, $http, $routeP
 });
 
 jianjinControllers.wordControllerGenerator = function(is_new) {
-  return function ($scope, $http, $routeParams, $location, handle_error, increase_confidence, decrease_confidence, get_word_url) {
+  return function ($scope, $http, $routeParams, $location, handle_error, increase_confidence, decrease_confidence, get_word_url, conditional_get) {
     $scope.word_id = $routeParams.word_id;
     $scope.increase_confidence = function() { increase_confidence($scope) };
     $scope.decrease_confidence = function() { decrease_confidence($scope) };
@@ -153,7 +187,7 @@ jianjinControllers.wordControllerGenerator = function(is_new) {
 
     $scope.load_common_tags = function() {
       if (!$scope.common_tags) {
-        $http.get("/words/commontags/").then(function(response) {
+        conditional_get("/words/commontags/").then(function(response) {
           var data = response.data;
           $scope.common_tags = data.map(function(t) { return t["tag"] });
         }).catch(handle_error($scope));
@@ -259,6 +293,16 @@ jianjinControllers.wordControllerGenerator = function(is_new) {
       $scope.word.related_words.push({"word": "", "new": true});
     };
 
+    $scope.related_suggestions = [];
+    $scope.suggest_related = function(related_word) {
+      if (!related_word.word) {
+        return;
+      }
+      $http.get("/words/suggest/", {params: {q: related_word.word}}).then(function(response) {
+        $scope.related_suggestions = response.data;
+      });
+    };
+
     $scope.remove_related_word = function(related_word) {
       $scope.word.related_words = $scope.word.related_words.filter(function(w) { return w !== related_word });
     };
@@ -295,7 +339,7 @@ jianjinControllers.wordControllerGenerator = function(is_new) {
     }
     else {
       $scope.loading = true;
-      $http.get(get_word_url($routeParams.word_id)).then(function(response) {
+      conditional_get(get_word_url($routeParams.word_id)).then(function(response) {
         var data = response.data;
         $scope.word = data;
         $scope.loading = false;
@@ -312,8 +356,13 @@ jianjinControllers.controller('BrowseWordCtrl', jianjinControllers.wordControlle
 
 jianjinControllers.controller('NewWordCtrl', jianjinControllers.wordControllerGenerator(true));
 
-jianjinControllers.controller('FlashcardCtrl', function($scope, $http, $routeParams, load_tags, handle_error, extract_examples, increase_confidence, decrease_confidence) {
+jianjinControllers.constant('flashcard_batch_size', 20);
+
+jianjinControllers.controller('FlashcardCtrl', function($scope, $http, $routeParams, load_tags, handle_error, extract_examples, increase_confidence, decrease_confidence, flashcard_batch_size) {
   $scope.tag = $routeParams.tag;
+  // Flashcards are fetched a batch at a time; the same word may come up more than once
+  $scope.deck = [];
+  $scope.confidences = {};
 
   $scope.reset = function() {
     $scope.show_pinyin_hint = false;
@@ -323,12 +372,24 @@ jianjinControllers.controller('FlashcardCtrl', function($scope, $http, $routePar
     $scope.examples = [];
   };
 
+  $scope.show_flashcard = function(word) {
+    // Later copies of a word in the deck may be out of date if its confidence was changed
+    if (word.id in $scope.confidences) {
+      word.confidence = $scope.confidences[word.id];
+    }
+    $scope.word = word;
+    $scope.examples = extract_examples(word);
+  };
+
   $scope.load_flashcard = function() {
+    if ($scope.deck.length) {
+      $scope.show_flashcard($scope.deck.shift());
+      return;
+    }
     $scope.loading = true;
-    $http.get('/words/flashcard' + ($scope.tag ? '/' + $scope.tag : '') + '/').then(function(response) {
-      var data = response.data;
-      $scope.word = data;
-      $scope.examples = extract_examples(data);
+    $http.get('/words/flashcard/batch' + ($scope.tag ? '/' + $scope.tag : '') + '/?n=' + flashcard_batch_size).then(function(response) {
+      $scope.deck = response.data;
+      $scope.show_flashcard($scope.deck.shift());
       $scope.loading = false;
     }).catch(handle_error($scope));
   };
@@ -348,6 +409,9 @@ jianjinControllers.controller('FlashcardCtrl', function($scope, $http, $routePar
   };
 
   $scope.next_flashcard = function() {
+    if ($scope.word) {
+      $scope.confidences[$scope.word.id] = $scope.word.confidence;
+    }
     $scope.reset();
     $scope.load_flashcard();
   };
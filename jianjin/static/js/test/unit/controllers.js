@@ -15,4 +15,28 @@ describe('controllers', function() {
     ]};
     expect(extract_examples(word)).toEqual([s1, s2, s3]);
   }));
+
+  it('should reuse responses which have not been modified', inject(function(conditional_get, $httpBackend) {
+    var results = [];
+    var record = function(response) { results.push(response.data); };
+
+    $httpBackend.expectGET('/words/tags/', function(headers) {
+      return !('If-None-Match' in headers);
+    }).respond(200, [{"tag": "wibble"}], {"ETag": '"v1"'});
+    conditional_get('/words/tags/').then(record);
+    $httpBackend.flush();
+
+    $httpBackend.expectGET('/words/tags/', function(headers) {
+      return headers['If-None-Match'] == '"v1"';
+    }).respond(304, '');
+    conditional_get('/words/tags/').then(record);
+    $httpBackend.flush();
+
+    $httpBackend.expectGET('/words/tags/').respond(200, [{"tag": "wobble"}], {"ETag": '"v2"'});
+    conditional_get('/words/tags/').then(record);
+    $httpBackend.flush();
+
+    expect(results).toEqual([[{"tag": "wibble"}], [{"tag": "wibble"}], [{"tag": "wobble"}]]);
+    $httpBackend.verifyNoOutstandingExpectation();
+  }));
 });
@@ -1,25 +1,88 @@
 from django.contrib import admin
+from django.utils import timezone
+from words import cache, search
 from words.models import Word, Definition, ExampleSentence, Tag, ComparisonGroup, ComparisonExample
 
+class CacheInvalidatingAdmin(admin.ModelAdmin):
+    """
+    Admin for models which are part of words, which marks the affected words as modified and
+    discards their users' cached data whenever anything is changed
+    """
+    def affected_words(self, queryset):
+        """List of (word ID, user ID) for the words which include the objects in a query set"""
+        return list(queryset.values_list('id', 'user_id'))
+
+    def words_changed(self, affected):
+        # Deleted words are simply not updated
+        word_ids = [word_id for (word_id, _) in affected]
+        Word.objects.filter(id__in=word_ids).update(last_modified=timezone.now())
+        search.index_words(word_ids)
+        for user_id in set([user_id for (_, user_id) in affected]):
+            cache.invalidate_user(user_id)
+
+    def save_related(self, request, form, formsets, change):
+        # Runs after save_model, once the inlines have been saved as well
+        super().save_related(request, form, formsets, change)
+        self.words_changed(self.affected_words(self.model.objects.filter(pk=form.instance.pk)))
+
+    def delete_model(self, request, obj):
+        affected = self.affected_words(self.model.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+        self.words_changed(affected)
+
+    def delete_queryset(self, request, queryset):
+        affected = self.affected_words(queryset)
+        super().delete_queryset(request, queryset)
+        self.words_changed(affected)
+
 class ExampleSentenceInline(admin.StackedInline):
     model = ExampleSentence
     extra = 3
 
-class DefinitionAdmin(admin.ModelAdmin):
+class DefinitionAdmin(CacheInvalidatingAdmin):
     inlines = [ExampleSentenceInline]
 
+    def affected_words(self, queryset):
+        return list(queryset.values_list('word_id', 'word__user_id'))
+
 class DefinitionLinkInline(admin.TabularInline):
     model = Definition
     fields = ('definition', 'part_of_speech', 'changeform_link')
     readonly_fields = ('changeform_link',)
     extra = 3
 
-class WordAdmin(admin.ModelAdmin):
+class WordAdmin(CacheInvalidatingAdmin):
     inlines = [DefinitionLinkInline]
 
+class TagAdmin(admin.ModelAdmin):
+    """
+    Tags are shared between users, so any change can affect everyone's cached data. The words
+    with the tags are marked as modified as well, so that clients' ETags change.
+    """
+    def tags_changed(self, word_ids):
+        Word.objects.filter(id__in=word_ids).update(last_modified=timezone.now())
+        cache.invalidate_all()
+
+    def tagged_words(self, tags):
+        return list(Word.objects.filter(tags__in=tags).values_list('id', flat=True).distinct())
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.tags_changed(self.tagged_words([obj]))
+
+    def delete_model(self, request, obj):
+        word_ids = self.tagged_words([obj])
+        super().delete_model(request, obj)
+        self.tags_changed(word_ids)
+
+    def delete_queryset(self, request, queryset):
+        word_ids = self.tagged_words(queryset)
+        super().delete_queryset(request, queryset)
+        self.tags_changed(word_ids)
+
 admin.site.register(Definition, DefinitionAdmin)
 admin.site.register(Word, WordAdmin)
-admin.site.register(Tag)
+admin.site.register(Tag, TagAdmin)
 
 class ComparisonInline(admin.StackedInline):
     model = ComparisonExample
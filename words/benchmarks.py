@@ -0,0 +1,132 @@
+"""
+Support for performance benchmarks: generation of synthetic vocabulary data, and
+measurement of the latency, queries and memory allocations of API requests.
+"""
+from collections import Counter
+from datetime import timedelta
+import math
+import random
+import statistics
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .models import (Definition, ExampleSentence, Tag, Word, adjust_tag_usage, bulk_create_with_ids,
+                     create_review_states, index_word_grams, set_pinyin_forms)
+
+INITIALS = ['b', 'p', 'm', 'f', 'd', 't', 'n', 'l', 'g', 'k', 'h', 'j', 'q', 'x',
+            'zh', 'ch', 'sh', 'r', 'z', 'c', 's', 'y', 'w', '']
+FINALS = ['a', 'o', 'e', 'ai', 'ei', 'ao', 'ou', 'an', 'en', 'ang', 'eng', 'ong',
+          'i', 'ia', 'ie', 'iao', 'iu', 'ian', 'in', 'ing', 'u', 'uo', 'ui', 'uan', 'un', 'v']
+ENGLISH = ['to', 'be', 'have', 'do', 'say', 'go', 'get', 'make', 'know', 'think', 'take',
+           'see', 'come', 'want', 'look', 'use', 'find', 'give', 'tell', 'work', 'call',
+           'try', 'ask', 'need', 'feel', 'become', 'leave', 'put', 'mean', 'keep', 'let',
+           'begin', 'seem', 'help', 'talk', 'turn', 'start', 'show', 'hear', 'play', 'run',
+           'move', 'like', 'live', 'believe', 'hold', 'bring', 'happen', 'write', 'provide',
+           'sit', 'stand', 'lose', 'pay', 'meet', 'include', 'continue', 'set', 'learn',
+           'change', 'lead', 'understand', 'watch', 'follow', 'stop', 'create', 'speak',
+           'read', 'allow', 'add', 'spend', 'grow', 'open', 'walk', 'win', 'offer',
+           'remember', 'love', 'consider', 'appear', 'buy', 'wait', 'serve', 'die', 'send',
+           'expect', 'build', 'stay', 'fall', 'cut', 'reach', 'kill', 'remain', 'suggest']
+
+def random_hanzi(r, length):
+    """Random string of common CJK characters"""
+    return ''.join([chr(r.randint(0x4e00, 0x9fa5)) for _ in range(length)])
+
+def random_pinyin(r, syllables):
+    """Random string of numbered pinyin syllables"""
+    return ''.join(['{0}{1}{2}'.format(r.choice(INITIALS), r.choice(FINALS), r.randint(1, 4))
+                    for _ in range(syllables)])
+
+def random_english(r, length):
+    """Random string of English words"""
+    return ' '.join([r.choice(ENGLISH) for _ in range(length)])
+
+def _word_ids(user):
+    """IDs of all a user's words in creation order (bulk_create does not set them on SQLite)"""
+    return list(Word.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+
+def random_sentence(r, syllables):
+    """Random (sentence, pinyin, translation) for an example sentence"""
+    return (random_hanzi(r, syllables) + '。', random_pinyin(r, syllables) + '.',
+            random_english(r, r.randint(3, 8)).capitalize() + '.')
+
+def seed_words(users, words_per_user, tags_per_user=20, seed=0, prefix='bench'):
+    """
+    Create users with synthetic vocabularies, each word having one or two definitions with
+    up to two example sentences each, some tags and up to two related words.
+    Return the list of users created.
+    """
+    r = random.Random(seed)
+    now = timezone.now()
+    tags = Tag.objects.bulk_create([Tag(tag='{0}{1}'.format(prefix, i)) for i in range(tags_per_user)])
+    tags = list(Tag.objects.filter(tag__in=[t.tag for t in tags]))
+    tag_through = Word.tags.through
+    related_through = Word.related_words.through
+    result = []
+    for user_num in range(users):
+        user = User.objects.create_user('{0}{1}'.format(prefix, user_num))
+        result.append(user)
+        words = []
+        for _ in range(words_per_user):
+            length = r.randint(1, 4)
+            word = Word(word=random_hanzi(r, length), pinyin=random_pinyin(r, length),
+                        user=user, confidence=r.randint(-3, 10))
+            set_pinyin_forms(word)
+            words.append(word)
+        Word.objects.bulk_create(words)
+        word_ids = _word_ids(user)
+        # auto_now_add and auto_now always use the current time, so spread the words out afterwards
+        for (word_id, word) in zip(word_ids, words):
+            word.id = word_id
+            word.date_added = now - timedelta(seconds=r.randint(0, 3 * 365 * 24 * 3600))
+            word.last_modified = word.date_added
+        Word.objects.bulk_update(words, ['date_added', 'last_modified'], batch_size=500)
+        create_review_states(words)
+
+        with transaction.atomic():
+            definitions = bulk_create_with_ids(Definition, [
+                Definition(word_id=word_id, definition=random_english(r, 3),
+                           part_of_speech=r.choice(['N', 'V', 'ADJ']))
+                for word_id in word_ids for _ in range(r.randint(1, 2))])
+        sentences = []
+        for definition in definitions:
+            for _ in range(r.randint(0, 2)):
+                (sentence, sentence_pinyin, translation) = random_sentence(r, r.randint(4, 12))
+                sentences.append(ExampleSentence(definition_id=definition.id, sentence=sentence,
+                                                 pinyin=sentence_pinyin, translation=translation))
+                set_pinyin_forms(sentences[-1])
+        ExampleSentence.objects.bulk_create(sentences, batch_size=500)
+
+        links = [tag_through(word_id=word_id, tag_id=tag.id)
+                 for word_id in word_ids
+                 for tag in r.sample(tags, r.randint(0, 3))]
+        tag_through.objects.bulk_create(links)
+        adjust_tag_usage(Counter([(user.id, link.tag_id) for link in links]))
+
+        # Related words are symmetrical, so need a row in each direction
+        related = set()
+        for word_id in word_ids:
+            for other_id in r.sample(word_ids, min(len(word_ids), r.randint(0, 2))):
+                if other_id != word_id:
+                    related.update([(word_id, other_id), (other_id, word_id)])
+        related_through.objects.bulk_create([related_through(from_word_id=from_id, to_word_id=to_id)
+                                             for (from_id, to_id) in sorted(related)], batch_size=500)
+
+        index_word_grams(word_ids)
+        search.index_words(word_ids)
+    return result
+
+def percentile(values, fraction):
+    """Value below which a fraction of some values fall, by the nearest-rank method"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def summarize(timings, query_counts, allocations):
+    """Map of summary statistics for the timings (in ms), query counts and peak allocations (in bytes) of requests"""
+    return {'requests': len(timings),
+            'p50': percentile(timings, 0.5), 'p99': percentile(timings, 0.99),
+            'queries': statistics.mean(query_counts), 'max_queries': max(query_counts),
+            'allocated': statistics.mean(allocations), 'max_allocated': max(allocations)}
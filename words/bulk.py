@@ -0,0 +1,249 @@
+"""
+Bulk import and export of whole vocabularies (e.g. HSK word lists).
+
+Words are exported as JSON lines, one word per line in the format produced by
+WordSerializer.serialize.
+
+Words are imported from the same format, or from CSV with a header row (see CSV_COLUMNS).
+Rows are validated one by one and any which fail are reported and skipped; the rest are
+inserted in chunks using bulk inserts, all inside a single transaction.
+"""
+from collections import Counter
+import csv
+import itertools
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import cache, search
+from .models import (Definition, ExampleSentence, Tag, Word, adjust_tag_usage, bulk_create_with_ids,
+                     create_review_states, get_or_create_tags, index_word_grams, set_pinyin_forms)
+from .serializers import WordSerializer
+
+CHUNK_SIZE = 500
+
+CSV_COLUMNS = ['word', 'pinyin', 'definition', 'part_of_speech', 'notes', 'tags', 'confidence',
+               'sentence', 'sentence_pinyin', 'translation']
+
+class ImportRowError(Exception):
+    """Raised for an input row which cannot be imported"""
+
+class _WordRow:
+    """A validated input row, holding unsaved model objects"""
+    def __init__(self, line, word, definitions, tag_names, related_names):
+        self.line = line
+        self.word = word
+        # List of (definition, list of example sentences)
+        self.definitions = definitions
+        self.tag_names = tag_names
+        self.related_names = related_names
+
+def decode_lines(byte_lines):
+    """Decode lines of UTF-8 text, ignoring any byte order mark at the start"""
+    for (line_num, line) in enumerate(byte_lines):
+        line = line.decode('utf-8')
+        yield line[1:] if line_num == 0 and line.startswith('\ufeff') else line
+
+def read_json_lines(lines):
+    """Read word maps from JSON lines, yielding (line number, word map) pairs"""
+    for (line_num, line) in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield (line_num, json.loads(line))
+        except ValueError as e:
+            yield (line_num, ImportRowError("Invalid JSON: {0}".format(e)))
+
+def read_csv(lines):
+    """
+    Read word maps from CSV with a header row, yielding (line number, word map) pairs.
+    Only the 'word' column is required; tags are separated by spaces.
+    """
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None:
+        return
+    unknown_columns = set(reader.fieldnames) - set(CSV_COLUMNS)
+    if unknown_columns or 'word' not in reader.fieldnames:
+        yield (1, ImportRowError("CSV header must include 'word' and may only include {0}".format(", ".join(CSV_COLUMNS))))
+        return
+    for row in reader:
+        row = {k: (v or '').strip() for (k, v) in row.items() if k is not None}
+        word_map = {'word': row['word'],
+                    'pinyin': row.get('pinyin', ''),
+                    'notes': row.get('notes', ''),
+                    'tags': [{'tag': t} for t in row.get('tags', '').split()]}
+        if row.get('confidence'):
+            word_map['confidence'] = row['confidence']
+        if row.get('definition'):
+            definition = {'definition': row['definition'],
+                          'part_of_speech': row.get('part_of_speech') or ' ',
+                          'example_sentences': []}
+            if row.get('sentence'):
+                definition['example_sentences'].append({'sentence': row['sentence'],
+                                                        'pinyin': row.get('sentence_pinyin', ''),
+                                                        'translation': row.get('translation', '')})
+            word_map['definitions'] = [definition]
+        yield (reader.line_num, word_map)
+
+def _get(word_map, key, expected_type, default):
+    """Get a value of a particular type from an input map"""
+    value = word_map.get(key, default)
+    if not isinstance(value, expected_type):
+        raise ImportRowError("'{0}' must be a {1}".format(key, expected_type.__name__))
+    return value
+
+def _validate_row(line, word_map, user):
+    """Turn an input word map into a _WordRow, raising exceptions if it is invalid"""
+    if isinstance(word_map, Exception):
+        raise word_map
+    if not isinstance(word_map, dict):
+        raise ImportRowError("Each word must be a JSON object")
+    try:
+        confidence = int(word_map.get('confidence', 0))
+    except (TypeError, ValueError):
+        raise ImportRowError("'confidence' must be a number")
+    word = Word(user=user, word=word_map.get('word', ''), pinyin=word_map.get('pinyin', ''),
+                notes=word_map.get('notes', ''), confidence=confidence)
+    set_pinyin_forms(word)
+    word.full_clean(exclude=['user'])
+
+    definitions = []
+    for def_map in _get(word_map, 'definitions', list, []):
+        if not isinstance(def_map, dict):
+            raise ImportRowError("Each definition must be a JSON object")
+        definition = Definition(definition=def_map.get('definition', ''),
+                                part_of_speech=def_map.get('part_of_speech', ' '))
+        definition.full_clean(exclude=['word'])
+        sentences = []
+        for sentence_map in _get(def_map, 'example_sentences', list, []):
+            if not isinstance(sentence_map, dict):
+                raise ImportRowError("Each example sentence must be a JSON object")
+            sentence = ExampleSentence(sentence=sentence_map.get('sentence', ''),
+                                       pinyin=sentence_map.get('pinyin', ''),
+                                       translation=sentence_map.get('translation', ''))
+            set_pinyin_forms(sentence)
+            sentence.full_clean(exclude=['definition'])
+            sentences.append(sentence)
+        definitions.append((definition, sentences))
+
+    tag_names = set()
+    for tag_map in _get(word_map, 'tags', list, []):
+        tag_name = str(tag_map.get('tag', '') if isinstance(tag_map, dict) else tag_map).strip().lower()
+        if tag_name:
+            Tag(tag=tag_name).full_clean(validate_unique=False)
+            tag_names.add(tag_name)
+
+    related_names = set()
+    for related_map in _get(word_map, 'related_words', list, []):
+        if not isinstance(related_map, dict) or not related_map.get('word'):
+            raise ImportRowError("Must specify 'word' for related_words")
+        Word(word=related_map['word']).clean_fields(exclude=['pinyin', 'user'])
+        related_names.add(related_map['word'])
+
+    return _WordRow(line, word, definitions, tag_names, related_names)
+
+def _import_chunk(rows, user):
+    """Insert a chunk of validated rows"""
+    bulk_create_with_ids(Word, [row.word for row in rows])
+
+    definitions = []
+    for row in rows:
+        for (definition, _) in row.definitions:
+            definition.word = row.word
+            definitions.append(definition)
+    bulk_create_with_ids(Definition, definitions)
+    sentences = []
+    for row in rows:
+        for (definition, def_sentences) in row.definitions:
+            for sentence in def_sentences:
+                sentence.definition = definition
+                sentences.append(sentence)
+    ExampleSentence.objects.bulk_create(sentences)
+
+    tags = get_or_create_tags(set(itertools.chain(*[row.tag_names for row in rows])))
+    tag_through = Word.tags.through
+    tag_through.objects.bulk_create([tag_through(word_id=row.word.id, tag_id=tags[tag_name].id)
+                                     for row in rows for tag_name in row.tag_names])
+    adjust_tag_usage(Counter([(user.id, tags[tag_name].id) for row in rows for tag_name in row.tag_names]))
+
+    create_review_states([row.word for row in rows])
+    index_word_grams([row.word.id for row in rows])
+    search.index_words([row.word.id for row in rows])
+
+def _link_related_words(links, user, chunk_size):
+    """
+    Relate imported words to other words, given (word ID, set of related words' text) pairs.
+    This happens after every chunk has been inserted, so that a related word later in the
+    input is linked to rather than getting a placeholder.
+    """
+    links = iter(links)
+    while True:
+        chunk = list(itertools.islice(links, chunk_size))
+        if not chunk:
+            break
+        related_names = set(itertools.chain(*[names for (_, names) in chunk]))
+        related = {}
+        for (word_id, word_text) in (Word.objects.filter(user=user, word__in=related_names).order_by('id')
+                                     .values_list('id', 'word')):
+            related.setdefault(word_text, word_id)
+        # As with WordSerializer, related words which do not exist yet get placeholders
+        placeholders = [Word(user=user, word=w) for w in related_names if w not in related]
+        bulk_create_with_ids(Word, placeholders)
+        related.update({w.word: w.id for w in placeholders})
+        related_through = Word.related_words.through
+        # The relationship is symmetrical, so needs a row in each direction
+        related_through.objects.bulk_create(
+            [related_through(from_word_id=from_id, to_word_id=to_id)
+             for (word_id, names) in chunk for related_name in names
+             for (from_id, to_id) in [(word_id, related[related_name]), (related[related_name], word_id)]
+             if from_id != to_id],
+            ignore_conflicts=True)
+        create_review_states(placeholders)
+        index_word_grams([w.id for w in placeholders])
+
+def import_words(user, word_maps, chunk_size=CHUNK_SIZE):
+    """
+    Import words for a user from (line number, word map) pairs such as those generated by
+    read_json_lines and read_csv.
+
+    Return a map containing the number of words created and a list of per-row errors.
+    """
+    created = 0
+    errors = []
+    links = []
+    with transaction.atomic():
+        word_maps = iter(word_maps)
+        while True:
+            batch = list(itertools.islice(word_maps, chunk_size))
+            if not batch:
+                break
+            chunk = []
+            for (line, word_map) in batch:
+                try:
+                    chunk.append(_validate_row(line, word_map, user))
+                except (ImportRowError, ValidationError) as e:
+                    errors.append({'line': line, 'error': str(e)})
+            if chunk:
+                _import_chunk(chunk, user)
+                links.extend([(row.word.id, row.related_names) for row in chunk if row.related_names])
+                created += len(chunk)
+        _link_related_words(links, user, chunk_size)
+    cache.invalidate_user(user.id)
+    return {'created': created, 'errors': errors}
+
+def export_words(words, chunk_size=CHUNK_SIZE):
+    """
+    Generate JSON lines for every word in a query set.
+
+    Words are read through a database cursor a chunk at a time, and the related objects
+    for each chunk are loaded in bulk, so memory use does not depend on the number of words.
+    """
+    words = words.order_by('id').iterator(chunk_size=chunk_size)
+    serializer = WordSerializer()
+    while True:
+        chunk = list(itertools.islice(words, chunk_size))
+        if not chunk:
+            break
+        for word_map in serializer.serialize_many(chunk):
+            yield json.dumps(word_map, ensure_ascii=False) + '\n'
@@ -0,0 +1,71 @@
+"""
+Per-user cache for API responses which are requested on almost every page load,
+such as tag lists and the first pages of words.
+
+Cached values are never invalidated individually. Instead, every key includes a version
+number for the user (and a global one, for changes such as renaming a tag which can affect
+everyone), and any change to a user's words bumps their version, so that their old entries
+are simply never read again and expire in due course.
+
+The cache backend is whatever is configured as Django's default cache. Note that with a
+local memory cache, each process has its own cache and version numbers, so only sees its
+own writes: entries expire after WORDS_CACHE_TIMEOUT seconds to limit how stale they can get,
+but deployments with more than one process should configure a shared backend.
+"""
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import cache as backend
+
+DEFAULT_TIMEOUT = 60
+
+GLOBAL_VERSION_KEY = 'words:version'
+
+def _user_version_key(user_id):
+    return 'words:version:{0}'.format(user_id)
+
+def _new_version():
+    # Start somewhere random, so that if a version number is evicted from the cache,
+    # the new one does not collide with the old one and revive stale entries
+    return random.randrange(1 << 62)
+
+def _versions(keys):
+    """Get the current values of some version numbers, initialising any which are missing"""
+    versions = backend.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Another process may be initialising it at the same time, in which case use theirs
+            backend.add(key, _new_version(), None)
+            versions[key] = backend.get(key)
+    return [versions[key] for key in keys]
+
+def _bump(key):
+    try:
+        backend.incr(key)
+    except ValueError:
+        backend.set(key, _new_version(), None)
+
+def invalidate_user(user_id):
+    """Discard all cached entries for a user, after a change to any of their words"""
+    _bump(_user_version_key(user_id))
+
+def invalidate_all():
+    """Discard all cached entries for all users, after a change to shared data such as tags"""
+    _bump(GLOBAL_VERSION_KEY)
+
+def get_or_set(user_id, name, compute):
+    """
+    Get a cached value for a user, or call compute to calculate it and cache the result.
+    The name identifies the value among the user's cached values, e.g. by request URL.
+    """
+    # Read the versions before computing the value: if the user's words change while it is
+    # being computed, the version is bumped and the possibly stale result is never read
+    (global_version, user_version) = _versions([GLOBAL_VERSION_KEY, _user_version_key(user_id)])
+    key = 'words:{0}:{1}.{2}:{3}'.format(user_id, global_version, user_version,
+                                         hashlib.sha1(name.encode('utf-8')).hexdigest())
+    value = backend.get(key)
+    if value is None:
+        value = compute()
+        backend.set(key, value, getattr(settings, 'WORDS_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
@@ -0,0 +1,44 @@
+"""
+Neighbourhoods of words in the graph of related words, found by breadth-first search with
+one query per level of depth (related words are symmetrical, so following the links from
+one side is enough).
+"""
+from .models import Word
+
+MAX_DEPTH = 5
+MAX_NODES = 200
+
+def related_graph(word, depth, max_nodes=MAX_NODES):
+    """
+    Map of the nodes (words, with their distance from word) and edges (pairs of word IDs,
+    smaller first) of the subgraph of words related to word within depth links, stopping
+    at max_nodes words, in which case 'truncated' is true
+    """
+    if not 0 <= depth <= MAX_DEPTH:
+        raise ValueError("Depth must be between 0 and {0}, found {1}".format(MAX_DEPTH, depth))
+    links = Word.related_words.through.objects.filter(to_word__user=word.user_id)
+    depths = {word.id: 0}
+    edges = set()
+    frontier = [word.id]
+    truncated = False
+    for level in range(1, depth + 1):
+        if not frontier:
+            break
+        next_frontier = []
+        level_links = links.filter(from_word__in=frontier).order_by('from_word', 'to_word')
+        for (from_id, to_id) in level_links.values_list('from_word', 'to_word'):
+            if to_id not in depths:
+                if len(depths) >= max_nodes:
+                    truncated = True
+                    continue
+                depths[to_id] = level
+                next_frontier.append(to_id)
+            edges.add((min(from_id, to_id), max(from_id, to_id)))
+        frontier = next_frontier
+    if frontier and depth:
+        # Links among the words on the last level, which were not expanded
+        last = links.filter(from_word__in=frontier, to_word__in=frontier).values_list('from_word', 'to_word')
+        edges.update([(min(from_id, to_id), max(from_id, to_id)) for (from_id, to_id) in last])
+    words = Word.objects.filter(id__in=list(depths)).values('id', 'word', 'pinyin', 'pinyin_marks')
+    nodes = sorted([dict(w, depth=depths[w['id']]) for w in words], key=lambda n: (n['depth'], n['id']))
+    return {'nodes': nodes, 'edges': sorted(edges), 'truncated': truncated}
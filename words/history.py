@@ -0,0 +1,99 @@
+"""
+Rollups of the review log (ReviewEvent) into per-user, per-day totals (ReviewDay), and of
+words' confidence into per-user, per-tag distributions (TagConfidence).
+
+Events are logged with the time they happened, which for changes made offline can be days
+before they reach the server, so each rollup finds the events not rolled up yet (which are
+marked as such, rather than found by ID, since IDs need not be committed in order) and
+recomputes just the user days they fall on. Statistics are then read from ReviewDay alone,
+however long the log grows.
+
+Confidence distributions depend on the words' current state rather than on the log, so
+they are rebuilt in full with one grouped query over the tagged words each time.
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Q
+from django.utils import timezone
+
+from .models import ReviewDay, ReviewEvent, TagConfidence, Word
+
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH = date(1970, 1, 1)
+
+MAX_DAYS = 366
+
+# Number of days or events handled in each query, to keep the queries' parameters in bounds
+BATCH_SIZE = 500
+
+def _day_number():
+    return ExpressionWrapper(F('time') / SECONDS_PER_DAY, output_field=IntegerField())
+
+def _batches(items):
+    items = sorted(items)
+    return [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+
+def _rollup_days(days):
+    """Recompute the ReviewDay rows of the users with events on some days, returning the rows"""
+    # The time range lets the query use the time index
+    events = (ReviewEvent.objects.filter(time__gte=days[0] * SECONDS_PER_DAY, time__lt=(days[-1] + 1) * SECONDS_PER_DAY)
+              .annotate(day_number=_day_number()).filter(day_number__in=days).order_by())
+    totals = (events.values('user', 'day_number')
+              .annotate(events=Count('id'), words=Count('word', distinct=True),
+                        increases=Count('id', filter=Q(kind=ReviewEvent.CONFIDENCE, value__gt=F('previous'))),
+                        decreases=Count('id', filter=Q(kind=ReviewEvent.CONFIDENCE, value__lt=F('previous'))),
+                        reviews=Count('id', filter=Q(kind=ReviewEvent.REVIEW))))
+    rows = [ReviewDay(user_id=t['user'], day=EPOCH + timedelta(days=t['day_number']), events=t['events'],
+                      words=t['words'], increases=t['increases'], decreases=t['decreases'], reviews=t['reviews'])
+            for t in totals]
+    ReviewDay.objects.filter(day__in=[EPOCH + timedelta(days=d) for d in days]).delete()
+    ReviewDay.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return rows
+
+def rollup_reviews():
+    """Bring the per-day rollups up to date with the review log, returning the number of user days rolled up"""
+    with transaction.atomic():
+        pending = list(ReviewEvent.objects.filter(rolled_up=False).annotate(day_number=_day_number())
+                       .order_by().values_list('id', 'user', 'day_number'))
+        # Events committed while this runs are left for the next rollup, even if their days
+        # are recomputed now, since rolling up a day again gives the same result
+        touched = set([(user_id, day_number) for (_, user_id, day_number) in pending])
+        for days in _batches(set([day_number for (_, day_number) in touched])):
+            _rollup_days(days)
+        for event_ids in _batches([event_id for (event_id, _, _) in pending]):
+            ReviewEvent.objects.filter(id__in=event_ids).update(rolled_up=True)
+    return len(touched)
+
+def rollup_tag_confidence():
+    """Rebuild the per-tag confidence distributions of every user's words, returning the number of rows"""
+    with transaction.atomic():
+        TagConfidence.objects.all().delete()
+        totals = (Word.objects.filter(tags__isnull=False).order_by().values('user', 'tags', 'confidence')
+                  .annotate(count=Count('id')))
+        rows = [TagConfidence(user_id=t['user'], tag_id=t['tags'], confidence=t['confidence'], count=t['count'])
+                for t in totals.iterator()]
+        TagConfidence.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+def review_days(user_id, days, today=None):
+    """List of rolled-up totals for a user's reviews over the last number of days, oldest first"""
+    if not 0 < days <= MAX_DAYS:
+        raise ValueError("Number of days must be between 1 and {0}, found {1}".format(MAX_DAYS, days))
+    today = today or timezone.now().date()
+    rows = (ReviewDay.objects.filter(user=user_id, day__gt=today - timedelta(days=days))
+            .order_by('day').values('day', 'events', 'words', 'increases', 'decreases', 'reviews'))
+    return [dict(row, day=row['day'].isoformat()) for row in rows]
+
+def tag_confidence(user_id):
+    """
+    List of each of a user's tags with the number of their words at each confidence level,
+    as of the last rollup, in order of tag
+    """
+    result = []
+    rows = TagConfidence.objects.filter(user=user_id).order_by('tag__tag', 'confidence')
+    for (tag, confidence, count) in rows.values_list('tag__tag', 'confidence', 'count'):
+        if not result or result[-1]['tag'] != tag:
+            result.append({'tag': tag, 'confidence': []})
+        result[-1]['confidence'].append({'confidence': confidence, 'count': count})
+    return result
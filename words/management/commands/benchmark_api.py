@@ -0,0 +1,131 @@
+import json
+import random
+import time
+import tracemalloc
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from words import benchmarks, cache
+from words.models import Tag, Word
+from words.serializers import WordSerializer
+
+ORDERINGS = ['date_added', 'last_modified', 'word', 'pinyin', 'confidence']
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic vocabulary, then run scripted API request scenarios against it and "
+            "report latency percentiles, queries per request and memory allocated per request. "
+            "Everything is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help="Number of users to create")
+        parser.add_argument('--words', type=int, default=2000, help="Number of words per user")
+        parser.add_argument('--repeat', type=int, default=100, help="Number of requests in each scenario")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the data and the requests made")
+        parser.add_argument('--scenario', action='append', choices=sorted(self.scenarios()),
+                            help="Scenario to run (may be repeated; the default is all of them)")
+        parser.add_argument('--cold', action='store_true',
+                            help="Invalidate the user's cached data before every request")
+
+    def scenarios(self):
+        """Map of scenario name to a function making one (method, path, data) request at random"""
+        return {'list': self.list_request,
+                'flashcard': lambda r, u: ('get', '/words/flashcard/', None),
+                'flashcard_batch': lambda r, u: ('get', '/words/flashcard/batch/?n=20', None),
+                'save': self.save_request,
+                'tags': lambda r, u: ('get', '/words/tags/', None),
+                'commontags': lambda r, u: ('get', '/words/commontags/', None),
+                'search': self.search_request,
+                'suggest': self.suggest_request}
+
+    def handle(self, *args, **options):
+        names = options['scenario'] or sorted(self.scenarios())
+        # The test client's requests are for the host 'testserver'
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']), transaction.atomic():
+            self.stdout.write("Seeding {0} users with {1} words each...".format(options['users'],
+                                                                                 options['words']))
+            users = benchmarks.seed_words(options['users'], options['words'], seed=options['seed'])
+            self.word_ids = {user.id: list(Word.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+                             for user in users}
+            self.tag_names = sorted(Tag.objects.filter(word__user__in=users).values_list('tag', flat=True)
+                                    .distinct())
+            results = [(name, self.run_scenario(name, users, options)) for name in names]
+            transaction.set_rollback(True)
+
+        self.stdout.write("{0:<16} {1:>8} {2:>9} {3:>9} {4:>8} {5:>8} {6:>10} {7:>10}".format(
+            'Scenario', 'Requests', 'p50 ms', 'p99 ms', 'Queries', 'Max', 'Alloc KB', 'Max KB'))
+        for (name, summary) in results:
+            self.stdout.write(
+                "{0:<16} {requests:>8} {p50:>9.2f} {p99:>9.2f} {queries:>8.1f} {max_queries:>8} "
+                "{1:>10.1f} {2:>10.1f}".format(name, summary['allocated'] / 1024, summary['max_allocated'] / 1024,
+                                               **summary))
+
+    def run_scenario(self, name, users, options):
+        """Summary statistics for a scenario, as from benchmarks.summarize"""
+        r = random.Random(options['seed'])
+        clients = {}
+        for user in users:
+            clients[user.id] = Client()
+            clients[user.id].force_login(user)
+        # Choose the requests up front, so that both passes below make the same ones
+        make_request = self.scenarios()[name]
+        requests = [(user, make_request(r, user)) for user in [r.choice(users) for _ in range(options['repeat'])]]
+
+        # One request to warm up, then time without instrumentation, then count queries and
+        # allocations in a second pass, since both slow requests down
+        self.send(clients, requests[0], options['cold'])
+        timings = []
+        for request in requests:
+            start = time.perf_counter()
+            self.send(clients, request, options['cold'])
+            timings.append((time.perf_counter() - start) * 1000)
+        query_counts = []
+        allocations = []
+        for request in requests:
+            with CaptureQueriesContext(connection) as queries:
+                tracemalloc.start()
+                try:
+                    self.send(clients, request, options['cold'])
+                    allocations.append(tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+            query_counts.append(len(queries))
+        return benchmarks.summarize(timings, query_counts, allocations)
+
+    def send(self, clients, request, cold):
+        (user, (method, path, data)) = request
+        if cold:
+            cache.invalidate_user(user.id)
+        client = clients[user.id]
+        if data is None:
+            response = getattr(client, method)(path, secure=True)
+        else:
+            response = getattr(client, method)(path, data, content_type='application/json', secure=True)
+        if response.status_code >= 400:
+            raise CommandError("{0} {1} failed with status {2}: {3}".format(
+                method.upper(), path, response.status_code, response.content[:200]))
+
+    def list_request(self, r, user):
+        pages = max(1, (len(self.word_ids[user.id]) + 9) // 10)
+        return ('get', '/words/words/?order={0}&page={1}'.format(r.choice(ORDERINGS), r.randint(1, pages)), None)
+
+    def save_request(self, r, user):
+        # Serialize the word now rather than while timing, as the browser would already have it
+        word = WordSerializer().serialize_many(Word.objects.filter(id=r.choice(self.word_ids[user.id])))[0]
+        word['notes'] = benchmarks.random_english(r, 5)
+        word['tags'] = [{'tag': t} for t in r.sample(self.tag_names, r.randint(0, 3))]
+        return ('put', '/words/words/{0}/'.format(word['id']), json.dumps(word))
+
+    def search_request(self, r, user):
+        word = Word.objects.get(id=r.choice(self.word_ids[user.id]))
+        query = r.choice([word.word[:1], word.word, word.pinyin_plain[:3], benchmarks.random_english(r, 1)])
+        return ('get', '/words/search/{0}'.format(quote(query)), None)
+
+    def suggest_request(self, r, user):
+        word = Word.objects.get(id=r.choice(self.word_ids[user.id]))
+        prefix = r.choice([word.word[:1], word.pinyin_plain[:r.randint(1, 4)]])
+        return ('get', '/words/suggest/?' + urlencode({'q': prefix}), None)
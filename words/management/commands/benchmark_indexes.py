@@ -0,0 +1,74 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.aggregates import Count
+
+from words import benchmarks
+from words.models import Tag, Word
+
+ORDERINGS = [['-date_added', '-id'], ['-last_modified', '-id'], ['word', 'id'],
+             ['pinyin_plain', 'pinyin', 'id'], ['confidence', 'id']]
+
+# Created by migration 0002 on the auto-created Word.tags table
+TAG_WORDS_INDEX = 'words_word_tags_tag_word_idx'
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic vocabulary, then show query plans and timings for the most common "
+            "word queries both with and without the composite indexes on words. "
+            "Everything is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5, help="Number of users to create")
+        parser.add_argument('--words', type=int, default=5000, help="Number of words per user")
+        parser.add_argument('--repeat', type=int, default=20, help="Number of timed runs of each query")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write("Seeding {0} users with {1} words each...".format(options['users'], options['words']))
+            user = benchmarks.seed_words(options['users'], options['words'])[0]
+            with_indexes = self.measure(self.hot_queries(user, 'with'), options['repeat'])
+            with connection.cursor() as cursor:
+                for name in [i.name for i in Word._meta.indexes] + [TAG_WORDS_INDEX]:
+                    cursor.execute('DROP INDEX {0}'.format(connection.ops.quote_name(name)))
+            without_indexes = self.measure(self.hot_queries(user, 'without'), options['repeat'])
+            transaction.set_rollback(True)
+
+        for (label, (before_time, before_plan)) in without_indexes:
+            (after_time, after_plan) = dict(with_indexes)[label]
+            self.stdout.write("\n== {0} ==".format(label))
+            self.stdout.write("Without indexes: {0:.3f} ms".format(before_time))
+            self.stdout.write(self.indent(before_plan))
+            self.stdout.write("With indexes: {0:.3f} ms ({1:.1f}x)".format(after_time, before_time / after_time))
+            self.stdout.write(self.indent(after_plan))
+
+    def hot_queries(self, user, phase):
+        """List of (label, query set) for the queries the API runs most often"""
+        # SQLite caches prepared statements by their SQL, and does not re-plan a cached
+        # EXPLAIN after the indexes change, so make each phase's SQL distinct
+        words = Word.objects.filter(user=user).extra(where=["'{0}' = '{0}'".format(phase)])
+        sample_word = words.order_by('id')[len(words) // 2]
+        tag = Tag.objects.filter(word__user=user).order_by('id')[0]
+        queries = [("List words ordered by {0}".format(o[0].lstrip('-')), words.order_by(*o)[:10])
+                   for o in ORDERINGS]
+        queries.append(("Exact search", words.filter(word=sample_word.word)))
+        queries.append(("List words with tag", words.filter(tags=tag).order_by(*ORDERINGS[0])[:10]))
+        queries.append(("Count words per confidence",
+                        words.order_by().values_list('confidence').annotate(Count('id'))))
+        return queries
+
+    def measure(self, queries, repeat):
+        """List of (label, (median time in ms, query plan)) for each query"""
+        result = []
+        for (label, query) in queries:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(query.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            result.append((label, (statistics.median(timings), query.explain())))
+        return result
+
+    def indent(self, text):
+        return '\n'.join(['    ' + line for line in text.splitlines()])
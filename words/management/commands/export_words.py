@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from words import bulk
+from words.models import Word
+
+class Command(BaseCommand):
+    help = ("Export all of a user's words as JSON lines (one word per line, in the same format "
+            "as the words API), which can be loaded again with import_words")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="User whose words should be exported")
+        parser.add_argument('--output', help="File to write to (by default, standard output)")
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE,
+                            help="Number of words to read from the database at a time")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No such user '{0}'".format(options['username']))
+        lines = bulk.export_words(Word.objects.filter(user=user), options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from words import bulk
+
+class Command(BaseCommand):
+    help = ("Import words for a user from a file of JSON lines (one word per line, in the same "
+            "format as the words API) or CSV (with a header row using the columns {0})".format(
+                ", ".join(bulk.CSV_COLUMNS)))
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="User who will own the words")
+        parser.add_argument('filename', help="File to import")
+        parser.add_argument('--format', choices=['jsonl', 'csv'],
+                            help="Input format (by default, CSV if the filename ends with .csv)")
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE,
+                            help="Number of words to insert at a time")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No such user '{0}'".format(options['username']))
+        input_format = options['format'] or ('csv' if options['filename'].lower().endswith('.csv') else 'jsonl')
+        with open(options['filename'], 'rb') as f:
+            lines = bulk.decode_lines(f)
+            word_maps = bulk.read_csv(lines) if input_format == 'csv' else bulk.read_json_lines(lines)
+            result = bulk.import_words(user, word_maps, options['chunk_size'])
+        for error in result['errors']:
+            self.stderr.write("Line {0}: {1}".format(error['line'], error['error']))
+        self.stdout.write("Imported {0} words, rejected {1}".format(result['created'], len(result['errors'])))
@@ -0,0 +1,29 @@
+import itertools
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from words import bulk, search
+from words.models import Word, index_word_grams
+
+class Command(BaseCommand):
+    help = ("Rebuild the search indexes (the character n-gram index, and on databases other than "
+            "PostgreSQL the search term index) for all words, e.g. after changing words directly "
+            "in the database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=bulk.CHUNK_SIZE,
+                            help="Number of words to index at a time")
+
+    def handle(self, *args, **options):
+        word_ids = Word.objects.order_by('id').values_list('id', flat=True).iterator(options['chunk_size'])
+        indexed = 0
+        while True:
+            chunk = list(itertools.islice(word_ids, options['chunk_size']))
+            if not chunk:
+                break
+            with transaction.atomic():
+                index_word_grams(chunk)
+                search.index_words(chunk)
+            indexed += len(chunk)
+        self.stdout.write("Indexed {0} words".format(indexed))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from words import history
+
+class Command(BaseCommand):
+    help = ("Bring the per-user, per-day review statistics up to date with the review log, "
+            "and rebuild the per-tag confidence distributions. "
+            "Run this periodically, e.g. daily with Heroku Scheduler.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rolled up {0} user days".format(history.rollup_reviews()))
+        self.stdout.write("Rolled up {0} tag confidence levels".format(history.rollup_tag_confidence()))
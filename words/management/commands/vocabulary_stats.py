@@ -0,0 +1,26 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from words import stats
+
+class Command(BaseCommand):
+    help = ("Print vocabulary statistics (words per tag, per confidence level and added per week) "
+            "for every user with words, or for particular users, as one line of JSON per user")
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Users to report on (by default, all of them)")
+
+    def handle(self, *args, **options):
+        if options['usernames']:
+            users = dict(User.objects.filter(username__in=options['usernames']).values_list('id', 'username'))
+            missing = set(options['usernames']) - set(users.values())
+            if missing:
+                raise CommandError("No such user(s): {0}".format(", ".join(sorted(missing))))
+            all_stats = {user_id: stats.user_stats(user_id) for user_id in users}
+        else:
+            all_stats = stats.all_user_stats()
+            users = dict(User.objects.filter(id__in=list(all_stats)).values_list('id', 'username'))
+        for user_id in sorted(all_stats, key=lambda u: users[u]):
+            self.stdout.write(json.dumps(dict(user=users[user_id], **all_stats[user_id]), ensure_ascii=False))
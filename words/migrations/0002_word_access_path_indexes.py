@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'date_added', 'id'], name='word_user_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'last_modified', 'id'], name='word_user_last_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'word', 'id'], name='word_user_word_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'pinyin', 'id'], name='word_user_pinyin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'confidence', 'id'], name='word_user_confidence_idx'),
+        ),
+        # The auto-created tags table is only indexed by (word_id, tag_id) and by each
+        # column separately; this lets a tag's words be found, and then joined to the
+        # word table to filter by user, from the index alone
+        migrations.RunSQL(
+            'CREATE INDEX words_word_tags_tag_word_idx ON words_word_tags (tag_id, word_id)',
+            'DROP INDEX words_word_tags_tag_word_idx',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:23
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_tag_usage(apps, schema_editor):
+    """Fill in TagUsage from existing tagged words"""
+    Word = apps.get_model('words', 'Word')
+    TagUsage = apps.get_model('words', 'TagUsage')
+    usage = (Word.tags.through.objects.order_by().values('word__user', 'tag')
+             .annotate(count=Count('id')))
+    TagUsage.objects.bulk_create([TagUsage(user_id=u['word__user'], tag_id=u['tag'], count=u['count'])
+                                  for u in usage.iterator()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0002_word_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='words.Tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagusage',
+            index=models.Index(fields=['user', '-count', 'tag'], name='tagusage_user_count_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tagusage',
+            unique_together={('user', 'tag')},
+        ),
+        migrations.RunPython(count_tag_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Expression indexes for the queries in words.search on PostgreSQL, which must use the same expressions
+POSTGRES_INDEXES = [
+    ('word_word_trgm_idx', 'words_word USING gin (word gin_trgm_ops)'),
+    ('word_pinyin_trgm_idx',
+     "words_word USING gin ((regexp_replace(lower(pinyin), '[^a-z]', '', 'g')) gin_trgm_ops)"),
+    ('definition_fts_idx', "words_definition USING gin (to_tsvector('english', definition))"),
+    ('examplesentence_fts_idx', "words_examplesentence USING gin (to_tsvector('english', translation))"),
+]
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for (name, definition) in POSTGRES_INDEXES:
+        schema_editor.execute('CREATE INDEX {0} ON {1}'.format(name, definition))
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for (name, _) in POSTGRES_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0003_tag_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.PositiveSmallIntegerField(choices=[(1, 'pinyin'), (2, 'definition'), (3, 'example sentence translation')])),
+                ('term', models.CharField(max_length=50)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='words.Word')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['user', 'field', 'term'], name='searchterm_user_term_idx'),
+        ),
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+    ]
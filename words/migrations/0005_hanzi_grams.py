@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def text_grams(text):
+    """Copy of words.models.text_grams as it was when this migration was written"""
+    text = text.lower()
+    grams = set([c for c in text if not c.isspace()])
+    grams.update([a + b for (a, b) in zip(text, text[1:]) if not (a.isspace() or b.isspace())])
+    return grams
+
+
+def index_existing_text(apps, schema_editor):
+    """Fill in HanziGram from existing words, example sentences and comparison examples"""
+    HanziGram = apps.get_model('words', 'HanziGram')
+    sources = [('word', apps.get_model('words', 'Word'), 'word', 'user'),
+               ('sentence', apps.get_model('words', 'ExampleSentence'), 'sentence', 'definition__word__user'),
+               ('comparison_example', apps.get_model('words', 'ComparisonExample'), 'example', 'word__user')]
+    for (field, model, text_field, user_field) in sources:
+        rows = model.objects.values_list('id', text_field, user_field)
+        HanziGram.objects.bulk_create((HanziGram(user_id=user_id, gram=gram, **{field + '_id': row_id})
+                                       for (row_id, text, user_id) in rows.iterator()
+                                       for gram in text_grams(text)),
+                                      batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HanziGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2)),
+                ('comparison_example', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='words.ComparisonExample')),
+                ('sentence', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='words.ExampleSentence')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('word', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='words.Word')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='hanzigram',
+            index=models.Index(fields=['gram', 'user'], name='hanzigram_gram_user_idx'),
+        ),
+        migrations.RunPython(index_existing_text, migrations.RunPython.noop),
+    ]
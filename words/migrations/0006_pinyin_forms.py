@@ -0,0 +1,138 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:36
+
+import re
+
+from django.db import migrations, models
+
+# Copy of the conversions in words.pinyin as they were when this migration was written
+VOWELS = {
+    'a': 'āáǎà', 'A': 'ĀÁǍÀ',
+    'e': 'ēéěè', 'E': 'ĒÉĚÈ',
+    'i': 'īíǐì', 'I': 'ĪÍǏÌ',
+    'o': 'ōóǒò', 'O': 'ŌÓǑÒ',
+    'u': 'ūúǔù', 'U': 'ŪÚǓÙ',
+    'v': 'ǖǘǚǜ', 'V': 'ǕǗǙǛ',
+}
+MARKED = {(vowel, str(tone + 1)): marks[tone] for (vowel, marks) in VOWELS.items() for tone in range(4)}
+UNMARKED = dict([(marks[tone], vowel) for (vowel, marks) in VOWELS.items() for tone in range(4)] +
+                [('ü', 'v'), ('Ü', 'V')])
+PART_REGEX = re.compile('[^0-9]*[0-9]|[^0-9]+$')
+SYLLABLE_REGEX = re.compile('([a-zA-Z]+)([1-4])$')
+
+
+def pick_vowel(syllable):
+    first_i = -1
+    for (i, c) in enumerate(syllable):
+        if c in 'aeouvAEOUV':
+            return i
+        if c in 'iI' and first_i < 0:
+            first_i = i
+    return first_i
+
+
+def convert_part(part):
+    match = SYLLABLE_REGEX.search(part)
+    if not match:
+        return part
+    (syllable, tone) = match.groups()
+    vowel_index = pick_vowel(syllable)
+    if vowel_index < 0:
+        return part
+    return (part[:match.start()] + syllable[:vowel_index] + MARKED[(syllable[vowel_index], tone)] +
+            syllable[vowel_index + 1:])
+
+
+def to_marks(text):
+    return ''.join([convert_part(part) for part in PART_REGEX.findall(text)])
+
+
+def to_plain(text):
+    text = ''.join([UNMARKED.get(c, c) for c in text]).lower().replace('u:', 'v')
+    return re.sub('[^a-z]', '', text)
+
+# Trigram indexes for the queries in words.search on PostgreSQL; the one on toneless pinyin
+# replaces the expression index from migration 0004
+POSTGRES_INDEXES = [
+    ('word_pinyin_plain_trgm_idx', 'words_word USING gin (pinyin_plain gin_trgm_ops)'),
+    ('examplesentence_pinyin_plain_trgm_idx', 'words_examplesentence USING gin (pinyin_plain gin_trgm_ops)'),
+]
+OLD_POSTGRES_INDEX = ('word_pinyin_trgm_idx',
+                      "words_word USING gin ((regexp_replace(lower(pinyin), '[^a-z]', '', 'g')) gin_trgm_ops)")
+
+
+def fill_pinyin_forms(apps, schema_editor):
+    """Fill in the toneless and tone-marked pinyin of existing words and example sentences"""
+    for model in [apps.get_model('words', 'Word'), apps.get_model('words', 'ExampleSentence')]:
+        rows = []
+        for row in model.objects.only('id', 'pinyin').iterator():
+            row.pinyin_plain = to_plain(row.pinyin)
+            row.pinyin_marks = to_marks(row.pinyin)
+            rows.append(row)
+        model.objects.bulk_update(rows, ['pinyin_plain', 'pinyin_marks'], batch_size=500)
+
+
+def delete_pinyin_terms(apps, schema_editor):
+    """Pinyin is now searched using Word.pinyin_plain rather than SearchTerm"""
+    apps.get_model('words', 'SearchTerm').objects.filter(field=1).delete()
+
+
+def replace_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(OLD_POSTGRES_INDEX[0]))
+    for (name, definition) in POSTGRES_INDEXES:
+        schema_editor.execute('CREATE INDEX {0} ON {1}'.format(name, definition))
+
+
+def restore_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for (name, _) in POSTGRES_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS {0}'.format(name))
+    schema_editor.execute('CREATE INDEX {0} ON {1}'.format(*OLD_POSTGRES_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0005_hanzi_grams'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='word',
+            name='word_user_pinyin_idx',
+        ),
+        migrations.AddField(
+            model_name='examplesentence',
+            name='pinyin_marks',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='examplesentence',
+            name='pinyin_plain',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='pinyin_marks',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='word',
+            name='pinyin_plain',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='searchterm',
+            name='field',
+            field=models.PositiveSmallIntegerField(choices=[(2, 'definition'), (3, 'example sentence translation')]),
+        ),
+        migrations.RunPython(fill_pinyin_forms, migrations.RunPython.noop),
+        migrations.RunPython(delete_pinyin_terms, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='word',
+            index=models.Index(fields=['user', 'pinyin_plain', 'pinyin', 'id'], name='word_user_pinyin_plain_idx'),
+        ),
+        migrations.RunPython(replace_postgres_indexes, restore_postgres_indexes),
+    ]
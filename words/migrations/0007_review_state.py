@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_review_states(apps, schema_editor):
+    """Make every existing word due for review from when it was added"""
+    Word = apps.get_model('words', 'Word')
+    ReviewState = apps.get_model('words', 'ReviewState')
+    ReviewState.objects.bulk_create([ReviewState(word_id=word_id, user_id=user_id, due_at=date_added)
+                                     for (word_id, user_id, date_added)
+                                     in Word.objects.values_list('id', 'user', 'date_added').iterator()],
+                                    batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0006_pinyin_forms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewState',
+            fields=[
+                ('word', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_state', serialize=False, to='words.Word')),
+                ('repetitions', models.PositiveIntegerField(default=0)),
+                ('interval', models.FloatField(default=0)),
+                ('ease', models.FloatField(default=2.5)),
+                ('due_at', models.DateTimeField()),
+                ('last_reviewed', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='reviewstate',
+            index=models.Index(fields=['user', 'due_at', 'word'], name='reviewstate_user_due_idx'),
+        ),
+        migrations.RunPython(create_review_states, migrations.RunPython.noop),
+    ]
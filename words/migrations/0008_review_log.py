@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0007_review_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Confidence change'), (2, 'Review')])),
+                ('value', models.SmallIntegerField()),
+                ('previous', models.SmallIntegerField(blank=True, null=True)),
+                ('time', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('word', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='words.Word')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('events', models.PositiveIntegerField(default=0)),
+                ('words', models.PositiveIntegerField(default=0)),
+                ('increases', models.PositiveIntegerField(default=0)),
+                ('decreases', models.PositiveIntegerField(default=0)),
+                ('reviews', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='reviewevent',
+            index=models.Index(fields=['time'], name='reviewevent_time_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reviewday',
+            unique_together={('user', 'day')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0008_review_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reviewevent',
+            name='word',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='words.Word'),
+        ),
+        migrations.AddIndex(
+            model_name='reviewevent',
+            index=models.Index(fields=['user', 'time'], name='reviewevent_user_time_idx'),
+        ),
+    ]
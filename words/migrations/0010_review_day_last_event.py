@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0009_review_event_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reviewday',
+            name='last_event',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,53 @@
+import re
+
+from django.db import migrations
+
+# Copy of the indexing in words.search as it was when this migration was written
+DEFINITION = 2
+TRANSLATION = 3
+TERM_LENGTH = 50
+ENGLISH_STOP_WORDS = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from',
+                                'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+                                'was', 'with'])
+
+
+def english_terms(text):
+    return set([t[:TERM_LENGTH] for t in re.findall('[a-z0-9]+', text.lower())
+                if len(t) > 1 and t not in ENGLISH_STOP_WORDS])
+
+
+def word_terms(definitions, translations):
+    terms = set()
+    for definition in definitions:
+        terms.update([(DEFINITION, t) for t in english_terms(definition)])
+    for translation in translations:
+        terms.update([(TRANSLATION, t) for t in english_terms(translation)])
+    return terms
+
+
+def index_existing_words(apps, schema_editor):
+    """Rebuild SearchTerm for existing words, on databases which need it"""
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    Word = apps.get_model('words', 'Word')
+    SearchTerm = apps.get_model('words', 'SearchTerm')
+    SearchTerm.objects.all().delete()
+    words = Word.objects.prefetch_related('definitions__example_sentences')
+    SearchTerm.objects.bulk_create(
+        [SearchTerm(user_id=word.user_id, word_id=word.id, field=field, term=term)
+         for word in words
+         for (field, term) in word_terms([d.definition for d in word.definitions.all()],
+                                         [s.translation for d in word.definitions.all()
+                                          for s in d.example_sentences.all()])],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0010_review_day_last_event'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_existing_words, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:19
+
+from django.db import migrations, models
+
+
+def fill_confidence_changed_at(apps, schema_editor):
+    """Existing confidences were set no later than their words were last modified"""
+    Word = apps.get_model('words', 'Word')
+    Word.objects.update(confidence_changed_at=models.F('last_modified'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0011_search_terms_backfill'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='word',
+            name='confidence_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_confidence_changed_at, migrations.RunPython.noop),
+    ]
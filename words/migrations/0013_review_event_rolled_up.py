@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('words', '0012_word_confidence_changed_at'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='reviewday',
+            name='last_event',
+        ),
+        migrations.AddField(
+            model_name='reviewevent',
+            name='rolled_up',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='reviewevent',
+            index=models.Index(condition=models.Q(rolled_up=False), fields=['id'], name='reviewevent_pending_idx'),
+        ),
+    ]
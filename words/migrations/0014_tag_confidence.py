@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('words', '0013_review_event_rolled_up'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reviewevent',
+            name='time',
+            field=models.BigIntegerField(),
+        ),
+        migrations.CreateModel(
+            name='TagConfidence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('confidence', models.IntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='words.Tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'tag', 'confidence')},
+            },
+        ),
+    ]
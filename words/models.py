@@ -1,12 +1,41 @@
+from collections import Counter, defaultdict
 import re
 
-from django.db import models
+from django.db import connections, models
+from django.db.models import Count, Exists, F, Max, OuterRef
+from django.db.models.signals import m2m_changed, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
 from django import urls
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .pinyin import to_marks, to_plain
 
 TAG_REGEX = "[a-z0-9]+"
 
+def bulk_create_with_ids(model, objs):
+    """
+    Insert model objects in bulk like QuerySet.bulk_create, but make sure that the IDs of the
+    new objects are filled in, even on databases (such as SQLite) which cannot return them
+    from a bulk insert.
+
+    This relies on new IDs being allocated in increasing order, so it must be called
+    inside a transaction.
+    """
+    objs = list(objs)
+    if not objs or connections[model.objects.db].features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    last_id = model.objects.aggregate(Max('id'))['id__max'] or 0
+    model.objects.bulk_create(objs)
+    new_ids = list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+    if len(new_ids) != len(objs):
+        raise RuntimeError("Found {0} new {1} rows after inserting {2}".format(
+            len(new_ids), model._meta.model_name, len(objs)))
+    for (obj, new_id) in zip(objs, new_ids):
+        obj.id = new_id
+    return objs
+
 class Tag(models.Model):
     tag = models.CharField(max_length=20, unique=True)
 
@@ -20,20 +49,148 @@ class Tag(models.Model):
 class Word(models.Model):
     word = models.CharField(max_length=10)
     pinyin = models.CharField(max_length=50)
+    # Derived from pinyin whenever it is saved (see set_pinyin_forms)
+    pinyin_plain = models.CharField(max_length=50, blank=True, editable=False)
+    pinyin_marks = models.CharField(max_length=50, blank=True, editable=False)
     notes = models.TextField(blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
     last_modified = models.DateTimeField(auto_now=True)
     confidence = models.IntegerField(default=0)
+    # When the current confidence was chosen, which for changes made offline can be well before
+    # they were saved; offline changes older than this are ignored (see views.confidence_batch)
+    confidence_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
     related_words = models.ManyToManyField("self", blank=True)
 
+    class Meta:
+        # Words are almost always looked up per user, either in one of the orderings
+        # offered by the API (with ID as a tie-break) or by exact word
+        indexes = [
+            models.Index(fields=['user', 'date_added', 'id'], name='word_user_date_added_idx'),
+            models.Index(fields=['user', 'last_modified', 'id'], name='word_user_last_modified_idx'),
+            models.Index(fields=['user', 'word', 'id'], name='word_user_word_idx'),
+            models.Index(fields=['user', 'pinyin_plain', 'pinyin', 'id'], name='word_user_pinyin_plain_idx'),
+            models.Index(fields=['user', 'confidence', 'id'], name='word_user_confidence_idx'),
+        ]
+
     def __unicode__(self):
         return self.word
 
     def username(self):
         return self.user.username
 
+class TagUsage(models.Model):
+    """
+    Number of a user's words which have a particular tag, kept up to date as words are
+    tagged, untagged and deleted (see adjust_tag_usage), so that finding a user's tags and
+    their counts does not need to go through all their words.
+
+    Rows are left in place when their count drops to zero, as deleting them could lose
+    a concurrent increment.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [('user', 'tag')]
+        indexes = [
+            models.Index(fields=['user', '-count', 'tag'], name='tagusage_user_count_idx'),
+        ]
+
+def adjust_tag_usage(deltas):
+    """
+    Apply changes to tag usage counts, given as a map from (user ID, tag ID) to the change
+    in the number of that user's words with that tag.
+    """
+    deltas = {key: delta for (key, delta) in deltas.items() if delta}
+    # Another transaction may be creating the same rows, in which case use theirs
+    TagUsage.objects.bulk_create([TagUsage(user_id=user_id, tag_id=tag_id)
+                                  for ((user_id, tag_id), delta) in deltas.items() if delta > 0],
+                                 ignore_conflicts=True)
+    # Usually all the changes are +1 or -1 for a single user, so group the updates that way
+    groups = defaultdict(list)
+    for ((user_id, tag_id), delta) in deltas.items():
+        groups[(user_id, delta)].append(tag_id)
+    for ((user_id, delta), tag_ids) in groups.items():
+        TagUsage.objects.filter(user=user_id, tag__in=tag_ids).update(count=F('count') + delta)
+
+def _tag_links(instance, reverse, pk_set):
+    """
+    Query set of Word.tags rows involved in a change to the tags of a word (or the words
+    of a tag, if reverse is true), restricted to pk_set unless it is None.
+    """
+    links = Word.tags.through.objects.filter(**{'tag' if reverse else 'word': instance})
+    if pk_set is not None:
+        links = links.filter(**{'word__in' if reverse else 'tag__in': pk_set})
+    return links
+
+@receiver(m2m_changed, sender=Word.tags.through)
+def _word_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep TagUsage up to date when words are tagged or untagged"""
+    if action in ('pre_remove', 'pre_clear'):
+        # Only the rows which actually exist are removed, so count those beforehand
+        instance._removed_tag_links = Counter(_tag_links(instance, reverse, pk_set).values_list('word__user', 'tag'))
+    elif action in ('post_remove', 'post_clear'):
+        adjust_tag_usage({key: -count for (key, count) in instance.__dict__.pop('_removed_tag_links').items()})
+    elif action == 'post_add':
+        # Only the rows which did not already exist are in pk_set
+        if reverse:
+            users = Word.objects.filter(id__in=pk_set).values_list('user', flat=True)
+            adjust_tag_usage(Counter([(user_id, instance.id) for user_id in users]))
+        else:
+            adjust_tag_usage(Counter([(instance.user_id, tag_id) for tag_id in pk_set]))
+
+@receiver(pre_delete, sender=Word)
+def _word_deleted(sender, instance, **kwargs):
+    """Keep TagUsage up to date when words are deleted"""
+    tag_ids = Word.tags.through.objects.filter(word=instance).values_list('tag', flat=True)
+    adjust_tag_usage({(instance.user_id, tag_id): -1 for tag_id in tag_ids})
+
+class SearchTerm(models.Model):
+    """
+    Entry in the inverted index used to search words on databases without full-text search
+    (see words.search): a normalised English term appearing in a word.
+    """
+    DEFINITION = 2
+    TRANSLATION = 3
+    FIELD_CHOICES = (
+        (DEFINITION, 'definition'),
+        (TRANSLATION, 'example sentence translation'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    word = models.ForeignKey(Word, related_name='search_terms', on_delete=models.CASCADE)
+    field = models.PositiveSmallIntegerField(choices=FIELD_CHOICES)
+    term = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'field', 'term'], name='searchterm_user_term_idx'),
+        ]
+
+def get_or_create_tags(tag_names):
+    """
+    Map a set of (already validated) tag names to tags, creating any which do not exist yet,
+    in a fixed number of queries.
+    """
+    tags = {t.tag: t for t in Tag.objects.filter(tag__in=tag_names)}
+    missing = set(tag_names) - set(tags)
+    if missing:
+        # Another request may be creating the same tags at the same time: whichever insert
+        # loses the race is ignored, and the winner's rows are read back instead
+        Tag.objects.bulk_create([Tag(tag=t) for t in missing], ignore_conflicts=True)
+        tags.update({t.tag: t for t in Tag.objects.filter(tag__in=missing)})
+    return tags
+
+def delete_unused_tags(tag_ids):
+    """Delete any of the given tags which no longer have any words"""
+    if not tag_ids:
+        return
+    in_use = TagUsage.objects.filter(tag=OuterRef('pk'), count__gt=0)
+    Tag.objects.filter(id__in=tag_ids).annotate(in_use=Exists(in_use)).filter(in_use=False).delete()
+
 PART_CHOICES = (
     (' ', 'none'),
     ('N', 'noun'),
@@ -64,6 +221,9 @@ class ExampleSentence(models.Model):
     definition = models.ForeignKey(Definition, related_name='example_sentences', on_delete=models.CASCADE)
     sentence = models.TextField()
     pinyin = models.TextField()
+    # Derived from pinyin whenever it is saved (see set_pinyin_forms)
+    pinyin_plain = models.TextField(blank=True, editable=False)
+    pinyin_marks = models.TextField(blank=True, editable=False)
     translation = models.TextField()
 
     def __unicode__(self):
@@ -80,3 +240,225 @@ class ComparisonExample(models.Model):
     word = models.ForeignKey(Word, on_delete=models.CASCADE)
     example = models.TextField()
     explanation = models.TextField()
+
+# Fields of words and example sentences which are derived from their pinyin
+PINYIN_FORM_FIELDS = ['pinyin_plain', 'pinyin_marks']
+
+def set_pinyin_forms(instance):
+    """
+    Fill in the toneless and tone-marked forms of a word's or example sentence's pinyin.
+    This happens automatically on save(), but must be done explicitly for bulk writes.
+    """
+    instance.pinyin_plain = to_plain(instance.pinyin)
+    instance.pinyin_marks = to_marks(instance.pinyin)
+
+@receiver(pre_save, sender=Word)
+@receiver(pre_save, sender=ExampleSentence)
+def _pinyin_saved(sender, instance, **kwargs):
+    set_pinyin_forms(instance)
+
+class HanziGram(models.Model):
+    """
+    Posting in the character n-gram index of words, example sentences and comparison examples:
+    a character or pair of adjacent characters (see text_grams) which appears in one of them.
+    Exactly one of word, sentence and comparison_example is set.
+
+    Chinese is written without spaces, so finding text within these needs substring matches,
+    which the database can only answer by scanning every row. Instead, the rows containing
+    every pair of characters in the text are found from the index, and only those are checked
+    (see filter_containing).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    word = models.ForeignKey(Word, null=True, related_name='+', on_delete=models.CASCADE)
+    sentence = models.ForeignKey(ExampleSentence, null=True, related_name='+', on_delete=models.CASCADE)
+    comparison_example = models.ForeignKey(ComparisonExample, null=True, related_name='+',
+                                           on_delete=models.CASCADE)
+    gram = models.CharField(max_length=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gram', 'user'], name='hanzigram_gram_user_idx'),
+        ]
+
+# For each indexed model, the HanziGram field referring to it, and its text and user fields
+GRAM_SOURCES = {
+    Word: ('word', 'word', 'user'),
+    ExampleSentence: ('sentence', 'sentence', 'definition__word__user'),
+    ComparisonExample: ('comparison_example', 'example', 'word__user'),
+}
+
+def text_grams(text):
+    """Set of the characters and pairs of adjacent characters in some text, ignoring spaces and case"""
+    text = text.lower()
+    grams = set([c for c in text if not c.isspace()])
+    grams.update([a + b for (a, b) in zip(text, text[1:]) if not (a.isspace() or b.isspace())])
+    return grams
+
+def _query_grams(text):
+    """Set of grams which must appear in any text containing the given text"""
+    grams = text_grams(text)
+    return set([g for g in grams if len(g) == 2]) or grams
+
+def index_grams(queryset):
+    """Bring the n-gram index up to date for a query set of words, sentences or comparison examples"""
+    (field, text_field, user_field) = GRAM_SOURCES[queryset.model]
+    rows = list(queryset.values_list('id', text_field, user_field))
+    HanziGram.objects.filter(**{field + '__in': [row_id for (row_id, _, _) in rows]}).delete()
+    HanziGram.objects.bulk_create([HanziGram(user_id=user_id, gram=gram, **{field + '_id': row_id})
+                                   for (row_id, text, user_id) in rows for gram in text_grams(text)],
+                                  batch_size=500)
+
+def index_word_grams(word_ids):
+    """
+    Bring the n-gram index up to date for some words and their sentences and comparison
+    examples, after changes which bypass save() (such as bulk inserts)
+    """
+    index_grams(Word.objects.filter(id__in=word_ids))
+    index_grams(ExampleSentence.objects.filter(definition__word__in=word_ids))
+    index_grams(ComparisonExample.objects.filter(word__in=word_ids))
+
+def filter_containing(queryset, text, user_id=None):
+    """
+    Filter a query set of words, example sentences or comparison examples down to those
+    whose text contains some text, using the n-gram index rather than scanning every row.
+    If the query set is for a single user, passing their ID narrows down the index search.
+    """
+    (field, text_field, _) = GRAM_SOURCES[queryset.model]
+    grams = _query_grams(text)
+    contains = {text_field + '__contains': text}
+    if not grams:
+        return queryset.filter(**contains)
+    postings = HanziGram.objects.filter(gram__in=grams, **{field + '__isnull': False})
+    if user_id is not None:
+        postings = postings.filter(user=user_id)
+    # Intersect the posting lists: rows with every gram. Pairs of characters in the text may
+    # appear in a different order or apart from each other, so the rows are still checked.
+    matching = (postings.order_by().values(field).annotate(grams=Count('id'))
+                .filter(grams=len(grams)).values(field))
+    return queryset.filter(id__in=matching, **contains)
+
+@receiver(post_init, sender=Word)
+@receiver(post_init, sender=ExampleSentence)
+@receiver(post_init, sender=ComparisonExample)
+def _text_loaded(sender, instance, **kwargs):
+    """Remember the indexed text as loaded, unless it was deferred, to tell whether saves change it"""
+    instance._indexed_text = instance.__dict__.get(GRAM_SOURCES[sender][1])
+
+@receiver(post_save, sender=Word)
+@receiver(post_save, sender=ExampleSentence)
+@receiver(post_save, sender=ComparisonExample)
+def _text_saved(sender, instance, raw, created, update_fields, **kwargs):
+    """Keep the n-gram index up to date when indexed text is saved (deletions cascade)"""
+    text_field = GRAM_SOURCES[sender][1]
+    if raw or (update_fields is not None and text_field not in update_fields):
+        return
+    text = getattr(instance, text_field)
+    if not created and text == instance._indexed_text:
+        return
+    index_grams(sender.objects.filter(pk=instance.pk))
+    instance._indexed_text = text
+
+class ReviewState(models.Model):
+    """
+    Spaced repetition state of a word (see scheduling.py): how many times in a row it has been
+    recalled, the current interval between reviews and ease factor, and when it is next due.
+    The user is copied from the word so that a user's due words can be read straight off
+    an index in due order.
+    """
+    word = models.OneToOneField(Word, on_delete=models.CASCADE, primary_key=True, related_name='review_state')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    repetitions = models.PositiveIntegerField(default=0)
+    interval = models.FloatField(default=0)
+    ease = models.FloatField(default=2.5)
+    due_at = models.DateTimeField()
+    last_reviewed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'due_at', 'word'], name='reviewstate_user_due_idx'),
+        ]
+
+def create_review_states(words):
+    """
+    Create review states for new words, due as soon as they are added. This happens
+    automatically on save(), but must be done explicitly for bulk inserts.
+    """
+    ReviewState.objects.bulk_create([ReviewState(word_id=word.id, user_id=word.user_id, due_at=word.date_added)
+                                     for word in words], ignore_conflicts=True)
+
+@receiver(post_save, sender=Word)
+def _word_created(sender, instance, created, **kwargs):
+    # Also for raw saves, so that words loaded from fixtures and backups can be reviewed
+    if created:
+        create_review_states([instance])
+
+class ReviewEvent(models.Model):
+    """
+    Append-only log of confidence changes and spaced repetition reviews, for analysing how
+    words are learned over time. Rows are kept small (times are seconds since the epoch), and
+    statistics are read from the ReviewDay rollups rather than from here (see history.py).
+    """
+    CONFIDENCE = 1
+    REVIEW = 2
+    KIND_CHOICES = [(CONFIDENCE, 'Confidence change'), (REVIEW, 'Review')]
+
+    # The (user, time) index covers the user, for deleting users
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    word = models.ForeignKey(Word, on_delete=models.CASCADE)
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    # The new confidence, or the review grade
+    value = models.SmallIntegerField()
+    # The confidence before the change
+    previous = models.SmallIntegerField(null=True, blank=True)
+    time = models.BigIntegerField()
+    # Whether the event has been included in the ReviewDay rollups
+    rolled_up = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['time'], name='reviewevent_time_idx'),
+            models.Index(fields=['user', 'time'], name='reviewevent_user_time_idx'),
+            # Only the events which have not been rolled up yet, which are few
+            models.Index(fields=['id'], name='reviewevent_pending_idx', condition=models.Q(rolled_up=False)),
+        ]
+
+def _small(value):
+    """Clamp a value to the range of a SmallIntegerField"""
+    return max(-32768, min(32767, value))
+
+def log_review_events(kind, changes):
+    """
+    Append events to the review log in one insert, given (user ID, word ID, new value,
+    previous confidence or None, time or None for now) for each
+    """
+    now = timezone.now()
+    ReviewEvent.objects.bulk_create([
+        ReviewEvent(user_id=user_id, word_id=word_id, kind=kind, value=_small(value),
+                    previous=None if previous is None else _small(previous), time=int((time or now).timestamp()))
+        for (user_id, word_id, value, previous, time) in changes])
+
+class ReviewDay(models.Model):
+    """Rollup of a user's review log for one day (in UTC), made by history.rollup_reviews"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    events = models.PositiveIntegerField(default=0)
+    words = models.PositiveIntegerField(default=0)
+    increases = models.PositiveIntegerField(default=0)
+    decreases = models.PositiveIntegerField(default=0)
+    reviews = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('user', 'day')]
+
+class TagConfidence(models.Model):
+    """
+    Rollup of the number of a user's words with a tag at one confidence level, made by
+    history.rollup_tag_confidence
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    confidence = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('user', 'tag', 'confidence')]
@@ -0,0 +1,70 @@
+"""
+Conversion of pinyin as it is stored, with tone numbers (e.g. 'ni3hao3'), to tone marks
+('nǐhǎo') for display, and to a plain toneless form ('nihao') for sorting and searching.
+
+to_marks gives the same results as the pinyin filter in static/js/pinyin.js, so text rendered
+by the server matches text rendered in the browser while it is being edited.
+"""
+import functools
+import re
+
+# Each vowel with tone marks for tones 1 to 4 (v stands for ü)
+VOWELS = {
+    'a': 'āáǎà', 'A': 'ĀÁǍÀ',
+    'e': 'ēéěè', 'E': 'ĒÉĚÈ',
+    'i': 'īíǐì', 'I': 'ĪÍǏÌ',
+    'o': 'ōóǒò', 'O': 'ŌÓǑÒ',
+    'u': 'ūúǔù', 'U': 'ŪÚǓÙ',
+    'v': 'ǖǘǚǜ', 'V': 'ǕǗǙǛ',
+}
+
+# Lookup tables from (vowel, tone number) to marked vowel, and from marked vowels back again
+_MARKED = {(vowel, str(tone + 1)): marks[tone] for (vowel, marks) in VOWELS.items() for tone in range(4)}
+_UNMARKED = dict([(marks[tone], vowel) for (vowel, marks) in VOWELS.items() for tone in range(4)] +
+                 [('ü', 'v'), ('Ü', 'V')])
+
+_PART_REGEX = re.compile('[^0-9]*[0-9]|[^0-9]+$')
+_SYLLABLE_REGEX = re.compile('([a-zA-Z]+)([1-4])$')
+_NON_LETTERS_REGEX = re.compile('[^a-z]')
+
+def split_text(text):
+    """Split text into parts, each ending with a digit apart from possibly the last one"""
+    return _PART_REGEX.findall(text)
+
+def pick_vowel(syllable):
+    """
+    Index of the vowel in a syllable which takes the tone mark: the first vowel other than i,
+    or failing that the first i, or -1 if there are no vowels
+    """
+    first_i = -1
+    for (i, c) in enumerate(syllable):
+        if c in 'aeouvAEOUV':
+            return i
+        if c in 'iI' and first_i < 0:
+            first_i = i
+    return first_i
+
+@functools.lru_cache(maxsize=4096)
+def convert_part(part):
+    """Replace the tone number at the end of a part of text with a tone mark, if it follows a syllable"""
+    match = _SYLLABLE_REGEX.search(part)
+    if not match:
+        return part
+    (syllable, tone) = match.groups()
+    vowel_index = pick_vowel(syllable)
+    if vowel_index < 0:
+        return part
+    return (part[:match.start()] + syllable[:vowel_index] + _MARKED[(syllable[vowel_index], tone)] +
+            syllable[vowel_index + 1:])
+
+def to_marks(text):
+    """Convert text written in pinyin with tone numbers to use tone marks instead"""
+    return ''.join([convert_part(part) for part in split_text(text)])
+
+def to_plain(text):
+    """
+    Lower-case toneless form of some pinyin, written with either tone numbers or tone marks,
+    without spaces or punctuation (e.g. 'nihao' for 'Ni3hao3' or 'Nǐ hǎo')
+    """
+    text = ''.join([_UNMARKED.get(c, c) for c in text]).lower().replace('u:', 'v')
+    return _NON_LETTERS_REGEX.sub('', text)
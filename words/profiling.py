@@ -0,0 +1,116 @@
+"""
+Opt-in per-request profiling: the number of SQL queries, total time spent in the database and
+in WordSerializer, and the size of the response, reported in a Server-Timing header (shown in
+browser developer tools) and as one JSON log line per request on the 'words.profiling' logger.
+
+Queries whose SQL has the same shape (the same statement, ignoring parameter values and the
+length of IN lists) more than WORDS_PROFILING_REPEAT_THRESHOLD times in one request are logged
+as a warning, since they usually mean something is being loaded one row at a time (N+1 queries).
+
+Enable it with WORDS_PROFILING = True in settings; otherwise the middleware removes itself
+and timed() does nothing.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+DEFAULT_REPEAT_THRESHOLD = 10
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST_REGEX = re.compile(r'\bIN \(\s*%s(?:\s*,\s*%s)*\s*\)', re.IGNORECASE)
+_WHITESPACE_REGEX = re.compile(r'\s+')
+
+_local = threading.local()
+
+def sql_shape(sql):
+    """SQL with the placeholders in IN lists, and whitespace, collapsed"""
+    return _WHITESPACE_REGEX.sub(' ', _IN_LIST_REGEX.sub('IN (...)', sql)).strip()
+
+class RequestProfile:
+    """Counters for a single request"""
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.timings = Counter()
+        self.shapes = Counter()
+        self._timing_depth = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        """Database execute wrapper which counts and times queries"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """List of (SQL shape, count) for shapes run more than threshold times, most often first"""
+        return [(shape, count) for (shape, count) in self.shapes.most_common() if count > threshold]
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in a block (or, used as a decorator, a function) to a named timing for
+    the current request, if it is being profiled; nested blocks with the same name count once
+    """
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield
+        return
+    profile._timing_depth[name] += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile._timing_depth[name] -= 1
+        if not profile._timing_depth[name]:
+            profile.timings[name] += time.perf_counter() - start
+
+class ProfilingMiddleware:
+    """Middleware recording a RequestProfile for each request"""
+    def __init__(self, get_response):
+        if not getattr(settings, 'WORDS_PROFILING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'WORDS_PROFILING_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        _local.profile = profile
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+        total_time = time.perf_counter() - start
+
+        size = None if response.streaming else len(response.content)
+        timings = [('db', profile.db_time, '{0} queries'.format(profile.queries))]
+        timings.extend([(name, profile.timings[name], None) for name in sorted(profile.timings)])
+        timings.append(('total', total_time, None))
+        response['Server-Timing'] = ', '.join([
+            '{0};dur={1:.1f}'.format(name, duration * 1000) + (';desc="{0}"'.format(desc) if desc else '')
+            for (name, duration, desc) in timings])
+
+        repeated = profile.repeated(self.threshold)
+        record = {'method': request.method, 'path': request.path, 'status': response.status_code,
+                  'queries': profile.queries, 'size': size,
+                  'repeated': [{'sql': shape, 'count': count} for (shape, count) in repeated]}
+        record.update({name + '_ms': round(duration * 1000, 3) for (name, duration, _) in timings})
+        logger.info(json.dumps(record))
+        if repeated:
+            logger.warning("Possible N+1 queries in %s %s: %s", request.method, request.path,
+                           '; '.join(['{0} x {1}'.format(count, shape) for (shape, count) in repeated]))
+        return response
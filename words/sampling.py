@@ -0,0 +1,182 @@
+"""
+In-process indexes for weighted random flashcard selection.
+
+Building an index costs one pass over the (id, confidence) pairs of the matching words;
+after that, each draw and each confidence change costs O(log n). Indexes are kept per
+user and per tag, and are checked against the latest modification time of the matching
+words before every draw, so they are rebuilt whenever anything changes behind their back
+(e.g. in another process, or through the admin).
+"""
+from collections import OrderedDict
+import random
+import threading
+
+from django.db.models import Max
+
+from .models import Word
+
+# Upper bound on the number of (user, tag) indexes kept in memory at once
+MAX_INDEXES = 100
+
+class FenwickTree:
+    """
+    Binary indexed tree over a list of non-negative weights, supporting O(log n)
+    weight updates, prefix sums and searches.
+    """
+    def __init__(self, weights):
+        self._size = len(weights)
+        self._tree = [0.0] + [float(w) for w in weights]
+        for i in range(1, self._size + 1):
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return self._size
+
+    def add(self, position, delta):
+        """Add delta to the weight at a (zero-based) position"""
+        i = position + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        """Sum of all weights"""
+        result = 0.0
+        i = self._size
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        return result
+
+    def find(self, value):
+        """
+        Return the (zero-based) position of the first weight at which the running total
+        of weights exceeds value.
+        """
+        position = 0
+        step = 1 << self._size.bit_length()
+        while step:
+            candidate = position + step
+            if candidate <= self._size and self._tree[candidate] <= value:
+                position = candidate
+                value -= self._tree[candidate]
+            step >>= 1
+        # Guard against floating-point rounding when value is very close to the total
+        return min(position, self._size - 1)
+
+class WeightedIndex:
+    """
+    Cumulative-weight index over a set of words, giving each word the weight
+    decay ** (reference - confidence) as in views.weights_for_words.
+
+    The reference point is fixed when the index is built: it only affects the scale of
+    the weights, not the probabilities they imply.
+    """
+    def __init__(self, rows, decay):
+        """Build the index from (word id, confidence) pairs"""
+        rows = list(rows)
+        self.decay = decay
+        self.ids = [word_id for (word_id, _) in rows]
+        self.confidences = [confidence for (_, confidence) in rows]
+        self.positions = {word_id: i for (i, word_id) in enumerate(self.ids)}
+        self.reference = max(self.confidences) if rows else 0
+        self.tree = FenwickTree([self.weight(c) for c in self.confidences])
+        self.last_modified = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def weight(self, confidence):
+        """Weight of a word with a particular confidence score"""
+        return pow(self.decay, self.reference - confidence)
+
+    def choose(self, r=random):
+        """
+        Return a random word ID, weighted by confidence.
+
+        The optional argument r is to allow deterministic tests to be written.
+        """
+        return self.ids[self.tree.find(r.uniform(0, self.tree.total()))]
+
+    def update(self, word_id, confidence):
+        """
+        Change the confidence of a word in the index.
+        Return whether the word was present in the index.
+        """
+        position = self.positions.get(word_id)
+        if position is None:
+            return False
+        old_confidence = self.confidences[position]
+        self.confidences[position] = confidence
+        self.tree.add(position, self.weight(confidence) - self.weight(old_confidence))
+        return True
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def _current_index(words, key, decay):
+    """Get an up-to-date index for a word query set, building it if necessary"""
+    last_modified = words.aggregate(Max('last_modified'))['last_modified__max']
+    if last_modified is None:
+        return None
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None and index.last_modified == last_modified:
+            _indexes.move_to_end(key)
+            return index
+    index = WeightedIndex(words.order_by().values_list('id', 'confidence'), decay)
+    index.last_modified = last_modified
+    with _lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def choose_word(words, user_id, tag_name, decay, r=random):
+    """
+    Return a random word from a query set of a user's words (optionally restricted to a
+    tag), weighted by confidence, or None if there are no such words.
+    """
+    key = (user_id, tag_name)
+    # If the chosen word has gone (e.g. it was deleted or lost the tag), rebuild and retry
+    for _ in range(2):
+        index = _current_index(words, key, decay)
+        if index is None:
+            return None
+        word = words.filter(pk=index.choose(r)).first()
+        if word is not None:
+            return word
+        with _lock:
+            _indexes.pop(key, None)
+    return None
+
+def word_updated(word):
+    """Apply a newly-saved confidence score for a word to any indexes containing it"""
+    words_updated(word.user_id, [word])
+
+def words_updated(user_id, words):
+    """
+    Apply newly-saved confidence scores for some of a user's words to any indexes containing
+    them, so that they do not need to be rebuilt. An index is only marked as up to date with
+    the words if none of its other words have changed since it was built (e.g. in another
+    process), so that otherwise it is still rebuilt before the next draw.
+    """
+    with _lock:
+        updates = [(key, [word for word in words if word.id in index.positions])
+                   for (key, index) in _indexes.items() if key[0] == user_id]
+    for ((_, tag_name), present) in updates:
+        if not present:
+            continue
+        others = Word.objects.filter(user=user_id).exclude(pk__in=[word.id for word in present])
+        if tag_name:
+            others = others.filter(tags__tag=tag_name)
+        others_modified = others.aggregate(Max('last_modified'))['last_modified__max']
+        with _lock:
+            index = _indexes.get((user_id, tag_name))
+            if index is None:
+                continue
+            updated = [word for word in present if index.update(word.id, word.confidence)]
+            if updated and (others_modified is None or others_modified <= index.last_modified):
+                index.last_modified = max([index.last_modified] + [word.last_modified for word in updated])
@@ -0,0 +1,68 @@
+"""
+Spaced repetition scheduling of flashcard reviews, using the SM-2 algorithm.
+
+Each review is graded from 0 (complete blackout) to 5 (perfect recall). Grades of 3 and above
+count as recalled, and the interval until the word is next due grows by the word's ease factor
+each time; lower grades start the word again from a one day interval. The ease factor itself
+goes up after easy reviews and down after hard ones, to a minimum of 1.3.
+
+A word's state lives in its ReviewState row, so the next due words are simply the first rows
+of the (user, due_at) index, and recording a review is a single UPDATE.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import ReviewState, Word
+
+MIN_GRADE = 0
+MAX_GRADE = 5
+PASSING_GRADE = 3
+MIN_EASE = 1.3
+# Intervals in days after the first and second successful reviews in a row
+FIRST_INTERVAL = 1
+SECOND_INTERVAL = 6
+
+Schedule = namedtuple('Schedule', ['repetitions', 'interval', 'ease'])
+
+def schedule(repetitions, interval, ease, grade):
+    """New Schedule for a word after a review, given its current state and the grade"""
+    if not MIN_GRADE <= grade <= MAX_GRADE:
+        raise ValueError("Grade must be between {0} and {1}, found {2}".format(MIN_GRADE, MAX_GRADE, grade))
+    ease = max(MIN_EASE, ease + 0.1 - (MAX_GRADE - grade) * (0.08 + (MAX_GRADE - grade) * 0.02))
+    if grade < PASSING_GRADE:
+        return Schedule(0, FIRST_INTERVAL, ease)
+    if repetitions == 0:
+        interval = FIRST_INTERVAL
+    elif repetitions == 1:
+        interval = SECOND_INTERVAL
+    else:
+        interval = interval * ease
+    return Schedule(repetitions + 1, interval, ease)
+
+def record_review(state, grade, now=None):
+    """
+    Update a word's ReviewState for a review with a grade, in one write, and return it.
+    Raises ValueError for invalid grades.
+    """
+    now = now or timezone.now()
+    (state.repetitions, state.interval, state.ease) = schedule(state.repetitions, state.interval,
+                                                               state.ease, grade)
+    state.due_at = now + timedelta(days=state.interval)
+    state.last_reviewed = now
+    state.save(update_fields=['repetitions', 'interval', 'ease', 'due_at', 'last_reviewed'])
+    return state
+
+def due_words(user_id, tag_name=None, limit=1):
+    """
+    Up to limit of a user's words (optionally only those with a tag) which are due for review
+    soonest, in due order. Words which are not due yet come after the overdue ones, so there
+    is always something to review.
+    """
+    states = ReviewState.objects.filter(user=user_id)
+    if tag_name:
+        states = states.filter(word__tags__tag=tag_name)
+    word_ids = list(states.order_by('due_at', 'word').values_list('word', flat=True)[:limit])
+    words = Word.objects.in_bulk(word_ids)
+    return [words[word_id] for word_id in word_ids]
@@ -0,0 +1,148 @@
+"""
+Search over a user's words, by hanzi (exact, prefix or substring of the word or its example
+sentences), by pinyin with or without tones (so that 'ni3hao3', 'nihao' and 'nǐ hǎo' all find
+你好), and by English words in definitions and example sentence translations.
+
+Hanzi substrings are found using the character n-gram index (see HanziGram), and pinyin
+using the toneless pinyin stored with each word. On PostgreSQL, English matching uses full-text
+search expression indexes, and pinyin matching also finds misspellings and example sentences
+using trigram indexes (see migrations 0004 and 0006). Other databases use SearchTerm, a simple
+inverted index of English terms, which must be updated whenever words change (see index_words).
+"""
+from collections import defaultdict
+import re
+
+from django.db import connection
+
+from .models import Definition, ExampleSentence, SearchTerm, Word, filter_containing
+from .pinyin import to_plain
+
+MAX_RESULTS = 50
+
+# Results are ordered by the total score of all the ways in which they match
+EXACT_WORD_SCORE = 100
+WORD_PREFIX_SCORE = 50
+WORD_SUBSTRING_SCORE = 20
+SENTENCE_SUBSTRING_SCORE = 5
+EXACT_PINYIN_SCORE = 40
+PINYIN_PREFIX_SCORE = 10
+ENGLISH_SCORES = {SearchTerm.DEFINITION: 5, SearchTerm.TRANSLATION: 1}
+
+HANZI_REGEX = re.compile('[㐀-䶿一-鿿豈-﫿]')
+
+ENGLISH_STOP_WORDS = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from',
+                                'in', 'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+                                'was', 'with'])
+
+def english_terms(text):
+    """Set of the English words in some text which are worth indexing"""
+    field_length = SearchTerm._meta.get_field('term').max_length
+    return set([t[:field_length] for t in re.findall('[a-z0-9]+', text.lower())
+                if len(t) > 1 and t not in ENGLISH_STOP_WORDS])
+
+def word_terms(definitions, translations):
+    """Set of (SearchTerm field, term) pairs to index for a word's definitions and sentences"""
+    terms = set()
+    for definition in definitions:
+        terms.update([(SearchTerm.DEFINITION, t) for t in english_terms(definition)])
+    for translation in translations:
+        terms.update([(SearchTerm.TRANSLATION, t) for t in english_terms(translation)])
+    return terms
+
+def uses_database_search():
+    """Whether the database has the full-text and trigram search this module needs"""
+    return connection.vendor == 'postgresql'
+
+def index_words(word_ids):
+    """Bring the search index up to date for some words, after they have been changed"""
+    if uses_database_search():
+        return
+    word_ids = list(word_ids)
+    SearchTerm.objects.filter(word__in=word_ids).delete()
+    words = Word.objects.filter(id__in=word_ids).prefetch_related('definitions__example_sentences')
+    SearchTerm.objects.bulk_create([
+        SearchTerm(user_id=word.user_id, word_id=word.id, field=field, term=term)
+        for word in words
+        for (field, term) in word_terms([d.definition for d in word.definitions.all()],
+                                        [s.translation for d in word.definitions.all()
+                                         for s in d.example_sentences.all()])])
+
+def _prefix_range(field, prefix):
+    """
+    Filter arguments for values starting with a prefix, written as a range so that it can
+    use an index (SQLite's case-insensitive LIKE cannot use ordinary indexes)
+    """
+    return {field + '__gte': prefix, field + '__lt': prefix + '￿'}
+
+def _score_hanzi(scores, user_id, query, limit):
+    words = Word.objects.filter(user=user_id)
+    for word_id in words.filter(word=query).values_list('id', flat=True)[:limit]:
+        scores[word_id] += EXACT_WORD_SCORE
+    prefixed = words.filter(**_prefix_range('word', query)).exclude(word=query)
+    for word_id in prefixed.values_list('id', flat=True)[:limit]:
+        scores[word_id] += WORD_PREFIX_SCORE
+    containing = filter_containing(words, query, user_id).exclude(**_prefix_range('word', query))
+    for word_id in containing.values_list('id', flat=True)[:limit]:
+        scores[word_id] += WORD_SUBSTRING_SCORE
+    sentences = filter_containing(ExampleSentence.objects.filter(definition__word__user=user_id), query, user_id)
+    for word_id in set(sentences.values_list('definition__word', flat=True)[:limit]):
+        scores[word_id] += SENTENCE_SUBSTRING_SCORE
+
+def _score_pinyin(scores, user_id, plain_pinyin, limit):
+    words = Word.objects.filter(user=user_id)
+    for word_id in words.filter(pinyin_plain=plain_pinyin).values_list('id', flat=True)[:limit]:
+        scores[word_id] += EXACT_PINYIN_SCORE
+    prefixed = words.filter(**_prefix_range('pinyin_plain', plain_pinyin)).exclude(pinyin_plain=plain_pinyin)
+    for word_id in prefixed.values_list('id', flat=True)[:limit]:
+        scores[word_id] += PINYIN_PREFIX_SCORE
+
+def _score_english_terms(scores, user_id, query):
+    terms = SearchTerm.objects.filter(user=user_id, field__in=list(ENGLISH_SCORES),
+                                      term__in=english_terms(query))
+    for (word_id, field) in terms.values_list('word', 'field'):
+        scores[word_id] += ENGLISH_SCORES[field]
+
+def _score_pinyin_postgres(scores, user_id, plain_pinyin, limit):
+    # Trigram similarity finds misspellings, which are not prefixes of the word's pinyin
+    words = Word.objects.filter(user=user_id).exclude(**_prefix_range('pinyin_plain', plain_pinyin)).extra(
+        select={'similarity': "similarity(words_word.pinyin_plain, %s)"}, select_params=[plain_pinyin],
+        where=["words_word.pinyin_plain %% %s"], params=[plain_pinyin])
+    for (word_id, similarity) in words.order_by('-similarity').values_list('id', 'similarity')[:limit]:
+        scores[word_id] += PINYIN_PREFIX_SCORE * similarity
+    # Plain pinyin is only letters, so needs no escaping for LIKE
+    sentences = ExampleSentence.objects.filter(definition__word__user=user_id).extra(
+        where=["words_examplesentence.pinyin_plain LIKE %s"], params=['%' + plain_pinyin + '%'])
+    for word_id in set(sentences.values_list('definition__word', flat=True)[:limit]):
+        scores[word_id] += SENTENCE_SUBSTRING_SCORE
+
+def _score_english_postgres(scores, user_id, query, limit):
+    searches = [(Definition.objects.filter(word__user=user_id), 'word',
+                 'words_definition.definition', ENGLISH_SCORES[SearchTerm.DEFINITION]),
+                (ExampleSentence.objects.filter(definition__word__user=user_id), 'definition__word',
+                 'words_examplesentence.translation', ENGLISH_SCORES[SearchTerm.TRANSLATION])]
+    for (rows, word_field, column, score) in searches:
+        # Must match the expression indexes created by migration 0004
+        vector = "to_tsvector('english', {0})".format(column)
+        rows = rows.extra(select={'rank': "ts_rank({0}, plainto_tsquery('english', %s))".format(vector)},
+                          select_params=[query],
+                          where=["{0} @@ plainto_tsquery('english', %s)".format(vector)],
+                          params=[query])
+        for (word_id, rank) in rows.order_by('-rank').values_list(word_field, 'rank')[:limit]:
+            scores[word_id] += score * (1 + rank)
+
+def search(user_id, query, limit=MAX_RESULTS):
+    """Return the IDs of a user's words which match a search query, best matches first"""
+    query = query.strip()
+    scores = defaultdict(float)
+    if HANZI_REGEX.search(query):
+        _score_hanzi(scores, user_id, query, limit)
+    plain_pinyin = to_plain(query)
+    if plain_pinyin:
+        _score_pinyin(scores, user_id, plain_pinyin, limit)
+        if uses_database_search():
+            _score_pinyin_postgres(scores, user_id, plain_pinyin, limit)
+            _score_english_postgres(scores, user_id, query, limit)
+        else:
+            _score_english_terms(scores, user_id, query)
+    ranked = sorted(scores.items(), key=lambda s: (-s[1], s[0]))
+    return [word_id for (word_id, _) in ranked[:limit]]
@@ -1,27 +1,47 @@
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from rest_framework import serializers
 
-from .models import Definition, ExampleSentence, Tag, Word
+from . import cache, profiling, sampling, search, suggest
+from .models import (PINYIN_FORM_FIELDS, Definition, ExampleSentence, ReviewEvent, Tag, Word, bulk_create_with_ids,
+                     delete_unused_tags, get_or_create_tags, index_grams, log_review_events, set_pinyin_forms)
+
+# Everything WordSerializer.serialize reads from related tables
+WORD_PREFETCHES = ('user', 'definitions__example_sentences', 'tags', 'related_words')
+
+# Fields which can be changed through WordSerializer
+DEFINITION_FIELDS = ['definition', 'part_of_speech']
+SENTENCE_FIELDS = ['sentence', 'pinyin', 'translation']
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ('tag',)
 
+class TagCountSerializer(serializers.ModelSerializer):
+    """Tag along with the number of words which have it, for use with an annotated query set"""
+    count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Tag
+        fields = ('tag', 'count')
+
 class RelatedWordSerializer(serializers.ModelSerializer):
     class Meta:
         model = Word
-        fields = ('id', 'word', 'pinyin')
+        fields = ('id', 'word', 'pinyin', 'pinyin_marks')
 
 class ExampleSentenceSerializer(serializers.ModelSerializer):
     class Meta:
         model = ExampleSentence
-        exclude = ('definition',)
+        exclude = ('definition', 'pinyin_plain')
 
 class DefinitionSerializer(serializers.ModelSerializer):
     example_sentences = ExampleSentenceSerializer(many=True, required=False)
@@ -30,31 +50,6 @@ class DefinitionSerializer(serializers.ModelSerializer):
         model = Definition
         exclude = ('word',)
 
-    def update(self, instance, validated_data):
-        """
-        Override as this involves nested writes.
-        This wasn't necessary in DRF 2.4 as there was an allow_add_remove option you could put on ExampleSentenceSerializer.
-        There's a hint in the docs that this might get added back again in the future, which would be nice...
-        http://www.django-rest-framework.org/api-guide/serializers/#customizing-multiple-update
-        """
-        for (attr, value) in validated_data.items():
-            if attr == 'example_sentences':
-                existing = instance.example_sentences.all()
-                existing_map = dict(zip([s.sentence for s in existing], existing))
-                updated_map = dict(zip([s['sentence'] for s in value], value))
-                sentence_serializer = ExampleSentenceSerializer()
-                for sentence_text, sentence_map in updated_map.items():
-                    sentence = existing_map[sentence_text] if sentence_text in existing_map else instance.example_sentences.create()
-                    sentence_serializer.update(sentence, sentence_map)
-                    sentence.save()
-                for sentence_text, sentence in existing_map.items():
-                    if sentence_text not in updated_map:
-                        sentence.delete()
-            else:
-                setattr(instance, attr, value)
-        instance.save()
-        return instance
-
 class WordSerializer:
     """
     It would be great to use ModelSerializer for words, but unfortunately there are too many
@@ -63,8 +58,16 @@ class WordSerializer:
 
     Once these are fixed, this code can be significantly simplified.
     """
+    @profiling.timed('serializer')
     def serialize_many(self, words):
-        """Serialize multiple words fit for JSON output"""
+        """
+        Serialize multiple words fit for JSON output.
+
+        All the related objects are loaded in bulk before serializing, so the number of
+        queries issued does not depend on the number of words.
+        """
+        words = list(words)
+        prefetch_related_objects(words, *WORD_PREFETCHES)
         return [self.serialize(word) for word in words]
 
     def serialize(self, word):
@@ -75,6 +78,7 @@ class WordSerializer:
         return {'id': word.id,
                 'word': word.word,
                 'pinyin': word.pinyin,
+                'pinyin_marks': word.pinyin_marks,
                 'definitions': definitions,
                 'notes': word.notes,
                 'user': word.user.username,
@@ -84,6 +88,7 @@ class WordSerializer:
                 'confidence': word.confidence,
                 'related_words': related_words}
 
+    @profiling.timed('serializer')
     def deserialize_and_update(self, obj, user_id, pk=None):
         """
         Given an incoming dictionary parsed from JSON, convert it into a model object,
@@ -92,32 +97,45 @@ class WordSerializer:
         Errors (e.g. object not found, validation errors) are signalled by raising exceptions
         out of this method, so callers should be prepared to handle those.
         """
-        if pk:
-            word = get_object_or_404(Word, pk=pk, user=user_id)
-        elif 'id' in obj:
-            word = get_object_or_404(Word, pk=obj['id'], user=user_id)
-        else:
-            word = Word.objects.create(user=get_object_or_404(User, pk=user_id))
+        with transaction.atomic():
+            if pk:
+                word = get_object_or_404(Word, pk=pk, user=user_id)
+            elif 'id' in obj:
+                word = get_object_or_404(Word, pk=obj['id'], user=user_id)
+            else:
+                word = Word.objects.create(user=get_object_or_404(User, pk=user_id))
+            previous_confidence = word.confidence
 
-        word.word = obj.get('word', word.word)
-        word.pinyin = obj.get('pinyin', word.pinyin)
-        word.notes = obj.get('notes', word.notes)
-        # Don't allow updates to user or date_added, and ignore any user-provided last_modified
-        word.last_modified = datetime.now()
-        word.confidence = obj.get('confidence', word.confidence)
+            word.word = obj.get('word', word.word)
+            word.pinyin = obj.get('pinyin', word.pinyin)
+            word.notes = obj.get('notes', word.notes)
+            # Don't allow updates to user or date_added, and ignore any user-provided last_modified
+            word.last_modified = datetime.now()
+            word.confidence = obj.get('confidence', word.confidence)
+            if word.confidence != previous_confidence:
+                word.confidence_changed_at = timezone.now()
 
-        word.full_clean()
-        word.save()
+            word.full_clean()
+            word.save()
+            if word.confidence != previous_confidence:
+                log_review_events(ReviewEvent.CONFIDENCE,
+                                  [(user_id, word.id, word.confidence, previous_confidence, None)])
 
-        if 'definitions' in obj:
-            self._update_definitions(word, obj['definitions'], user_id)
+            if 'definitions' in obj:
+                self._update_definitions(word, obj['definitions'])
 
-        if 'tags' in obj:
-            self._update_tags(word, obj['tags'])
+            if 'tags' in obj:
+                self._update_tags(word, obj['tags'])
 
-        if 'related_words' in obj:
-            self._update_related_words(word, obj['related_words'], user_id)
+            created_words = []
+            if 'related_words' in obj:
+                created_words = self._update_related_words(word, obj['related_words'], user_id)
 
+            search.index_words([word.id])
+
+        sampling.word_updated(word)
+        cache.invalidate_user(user_id)
+        suggest.words_updated(user_id, [word] + created_words)
         return word
 
     def _update_tags(self, word, tag_maps):
@@ -127,65 +145,123 @@ class WordSerializer:
         any associated words.
         """
         tags = self._get_tags(set([t['tag'].lower() for t in tag_maps if t['tag'].strip() != '']))
-        removed_tags = [t for t in word.tags.all() if not t in tags]
-        word.tags.clear()
-        word.tags.add(*tags)
-        for tag in removed_tags:
-            if not len(tag.word_set.all()):
-                tag.delete()
+        new_ids = set([t.id for t in tags])
+        old_ids = set(word.tags.values_list('id', flat=True))
+        removed_ids = old_ids - new_ids
+        if removed_ids:
+            word.tags.remove(*removed_ids)
+        if new_ids - old_ids:
+            word.tags.add(*(new_ids - old_ids))
+        delete_unused_tags(removed_ids)
 
     def _get_tags(self, tags):
         """
-        Given a list of tag names, load them from the database if they exist,
+        Given a set of tag names, load them from the database if they exist,
         and create them otherwise
         """
-        result = []
         for tag in tags:
-            db_tags = Tag.objects.filter(tag=tag)
-            if db_tags:
-                result.append(db_tags[0]) # Guaranteed unique
-            else:
-                db_tag = Tag(tag=tag)
-                db_tag.full_clean()
-                db_tag.save()
-                result.append(db_tag)
-        return result
+            Tag(tag=tag).full_clean(validate_unique=False)
+        return list(get_or_create_tags(tags).values())
 
-    def _update_definitions(self, word, def_maps, user_id):
+    def _update_definitions(self, word, def_maps):
         """
         Update the list of definitions for a word (create any new ones, delete any old ones,
-        and update any existing ones).
+        and update any existing ones), along with their example sentences.
+
+        Everything is validated and checked against the word's existing definitions and
+        sentences before anything is written, and the changes are then applied in bulk,
+        so the number of queries does not depend on the number of definitions or sentences.
         """
-        new_def_ids = [d['id'] for d in def_maps if 'id' in d]
-        removed_defs = [d for d in word.definitions.all() if d.id not in new_def_ids]
+        # Serializers drop the read-only IDs from validated data, so pair them up again here
+        updates = []
         for def_map in def_maps:
-            if 'id' in def_map:
-                existing_def = get_object_or_404(Definition, pk=def_map['id'])
-                if existing_def.word.user.id != user_id:
-                    raise Http404
-            else:
-                existing_def = word.definitions.create()
-            # Test that people can't sneakily try to update each other's sentences
-            if 'example_sentences' in def_map:
-                for sentence in def_map['example_sentences']:
-                    if 'id' in sentence:
-                        existing_sentence = get_object_or_404(ExampleSentence, pk=sentence['id'])
-                        if existing_sentence.definition.word.user.id != user_id:
-                            raise Http404
-            def_serializer = DefinitionSerializer(existing_def, data=def_map)
+            def_serializer = DefinitionSerializer(data=def_map)
             if not def_serializer.is_valid():
                 raise serializers.ValidationError("Invalid definitions: {0}".format(def_serializer.errors))
-            def_serializer.save()
+            data = def_serializer.validated_data
+            sentences = None
+            if 'example_sentences' in data:
+                sentences = list(zip([s.get('id') for s in def_map['example_sentences']],
+                                     data['example_sentences']))
+            updates.append((def_map.get('id'), data, sentences))
+
+        # Test that people can't sneakily try to update each other's definitions or sentences
+        existing_defs = {d.id: d for d in word.definitions.all()}
+        existing_sentences = {s.id: s for s in ExampleSentence.objects.filter(definition__word=word)}
+        if any(def_id is not None and def_id not in existing_defs for (def_id, _, _) in updates):
+            raise Http404
+        if any(sentence_id is not None and sentence_id not in existing_sentences
+               for (_, _, sentences) in updates for (sentence_id, _) in sentences or []):
+            raise Http404
+
+        new_defs = []
+        changed_defs = []
+        for (def_id, data, _) in updates:
+            if def_id is None:
+                new_defs.append(Definition(word=word, definition=data['definition'],
+                                           part_of_speech=data['part_of_speech']))
+            elif self._set_fields(existing_defs[def_id], data, DEFINITION_FIELDS):
+                changed_defs.append(existing_defs[def_id])
+        bulk_create_with_ids(Definition, new_defs)
+        Definition.objects.bulk_update(changed_defs, DEFINITION_FIELDS)
+        kept_def_ids = set([def_id for (def_id, _, _) in updates])
+
+        new_sentences = []
+        changed_sentences = []
+        removed_sentence_ids = []
+        new_def_iter = iter(new_defs)
+        for (def_id, _, sentences) in updates:
+            definition = existing_defs[def_id] if def_id is not None else next(new_def_iter)
+            if sentences is None:
+                continue
+            remaining = [s for s in existing_sentences.values() if s.definition_id == def_id]
+            # Match sentences by ID where given, and otherwise by their text
+            matches = [next((s for s in remaining if s.id == sentence_id), None)
+                       for (sentence_id, _) in sentences]
+            remaining = [s for s in remaining if s not in matches]
+            for (i, (_, data)) in enumerate(sentences):
+                if matches[i] is None:
+                    matches[i] = next((s for s in remaining if s.sentence == data['sentence']), None)
+                    if matches[i] is not None:
+                        remaining.remove(matches[i])
+            for (sentence, (_, data)) in zip(matches, sentences):
+                if sentence is None:
+                    new_sentences.append(ExampleSentence(definition=definition, **data))
+                elif self._set_fields(sentence, data, SENTENCE_FIELDS):
+                    changed_sentences.append(sentence)
+            removed_sentence_ids.extend([s.id for s in remaining])
+        # Bulk writes bypass save(), which would otherwise fill in the derived pinyin
+        for sentence in new_sentences + changed_sentences:
+            set_pinyin_forms(sentence)
+        ExampleSentence.objects.bulk_create(new_sentences)
+        ExampleSentence.objects.bulk_update(changed_sentences, SENTENCE_FIELDS + PINYIN_FORM_FIELDS)
+        if new_sentences or changed_sentences:
+            # Likewise the signals which keep the n-gram index up to date
+            index_grams(ExampleSentence.objects.filter(definition__word=word))
+
+        removed_def_ids = set(existing_defs) - kept_def_ids
+        if removed_sentence_ids:
+            ExampleSentence.objects.filter(id__in=removed_sentence_ids).delete()
+        if removed_def_ids:
+            Definition.objects.filter(id__in=removed_def_ids).delete()
 
-        for definition in removed_defs:
-            definition.delete()
+    def _set_fields(self, instance, data, fields):
+        """Copy fields from validated data onto a model object, returning whether any changed"""
+        changed = False
+        for field in fields:
+            if field in data and getattr(instance, field) != data[field]:
+                setattr(instance, field, data[field])
+                changed = True
+        return changed
 
     def _update_related_words(self, word, related_word_maps, user_id):
         """
-        Update the list of related words for a word
+        Update the list of related words for a word, returning any placeholder words created
+        for related words which did not exist yet
         """
         word.related_words.clear()
         related_words = []
+        created_words = []
         for word_map in related_word_maps:
             if 'id' in word_map:
                 related_word = get_object_or_404(Word, pk=word_map['id'], user=user_id)
@@ -200,5 +276,7 @@ class WordSerializer:
                     # Create a new word to act as a placeholder
                     related_word = Word.objects.create(word=word_map['word'],
                                                        user=get_object_or_404(User, pk=user_id))
+                    created_words.append(related_word)
             related_words.append(related_word)
         word.related_words.add(*related_words)
+        return created_words
@@ -0,0 +1,36 @@
+"""
+Vocabulary statistics: how many words each user has per tag, per confidence level and added
+per week. Each histogram is one GROUP BY query however many words or users there are, and
+the tag counts come straight from TagUsage rather than the words themselves.
+"""
+from django.db.models import Count
+from django.db.models.functions import TruncWeek
+
+from .models import TagUsage, Word
+
+def _empty_stats():
+    return {'words': 0, 'tags': [], 'confidence': [], 'added_per_week': []}
+
+def _collect(**user_filter):
+    """Map from user ID to statistics, for the users matching a filter on user"""
+    stats = {}
+    words = Word.objects.filter(**user_filter).order_by()
+    for row in words.values('user', 'confidence').annotate(count=Count('id')).order_by('user', 'confidence'):
+        user_stats = stats.setdefault(row['user'], _empty_stats())
+        user_stats['words'] += row['count']
+        user_stats['confidence'].append({'confidence': row['confidence'], 'count': row['count']})
+    weeks = words.annotate(week=TruncWeek('date_added')).values('user', 'week').annotate(count=Count('id'))
+    for row in weeks.order_by('user', 'week'):
+        stats[row['user']]['added_per_week'].append({'week': row['week'].date().isoformat(), 'count': row['count']})
+    usage = TagUsage.objects.filter(count__gt=0, **user_filter).order_by('user', '-count', 'tag__tag')
+    for (user_id, tag, count) in usage.values_list('user', 'tag__tag', 'count'):
+        stats.setdefault(user_id, _empty_stats())['tags'].append({'tag': tag, 'count': count})
+    return stats
+
+def user_stats(user_id):
+    """Statistics for one user's words"""
+    return _collect(user=user_id).get(user_id, _empty_stats())
+
+def all_user_stats():
+    """Map from user ID to statistics, for every user with any words"""
+    return _collect()
@@ -0,0 +1,137 @@
+"""
+In-process prefix indexes for search-as-you-type suggestions.
+
+Each user's index holds their words sorted by the word itself and by its toneless pinyin
+(see pinyin.to_plain), so finding the words with a given prefix is a binary search
+followed by a short scan. Changes to words made through the API are applied to the index
+directly; each index also records the number of the user's words and their latest
+modification time, which are checked with one aggregate query before every search, so
+that it is rebuilt if the words have changed in any other way (e.g. in another process,
+through the admin or by an import).
+"""
+from bisect import bisect_left, insort
+from collections import OrderedDict
+import threading
+
+from django.db.models import Count, Max, Q
+
+from .models import Word
+from .pinyin import to_plain
+from .search import HANZI_REGEX
+
+MAX_SUGGESTIONS = 10
+
+# Upper bound on the number of users' indexes kept in memory at once
+MAX_INDEXES = 100
+
+class PrefixIndex:
+    """Sorted arrays of a user's words, by word and by toneless pinyin, for prefix searches"""
+    def __init__(self, rows):
+        """Build the index from (word id, word, pinyin, toneless pinyin) tuples"""
+        self.entries = {word_id: (word, pinyin, plain) for (word_id, word, pinyin, plain) in rows}
+        self.by_word = sorted([(word, word_id) for (word_id, (word, _, _)) in self.entries.items()])
+        self.by_pinyin = sorted([(plain, word_id) for (word_id, (_, _, plain)) in self.entries.items()
+                                 if plain])
+        self.state = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, word_id, word, pinyin, plain):
+        """Add a word to the index, or replace it if it is already there"""
+        old = self.entries.get(word_id)
+        if old is not None:
+            if old == (word, pinyin, plain):
+                return
+            self.by_word.pop(bisect_left(self.by_word, (old[0], word_id)))
+            if old[2]:
+                self.by_pinyin.pop(bisect_left(self.by_pinyin, (old[2], word_id)))
+        self.entries[word_id] = (word, pinyin, plain)
+        insort(self.by_word, (word, word_id))
+        if plain:
+            insort(self.by_pinyin, (plain, word_id))
+
+    def _starting_with(self, keys, prefix, limit):
+        """IDs for up to limit keys starting with a prefix, from a sorted list of (key, ID)"""
+        start = bisect_left(keys, (prefix,))
+        result = []
+        for (key, word_id) in keys[start:start + limit]:
+            if not key.startswith(prefix):
+                break
+            result.append(word_id)
+        return result
+
+    def complete(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        IDs of up to limit words starting with a prefix, either as hanzi or as pinyin with
+        or without tones: matches on the word itself come first, each in sorted order.
+        """
+        result = []
+        if HANZI_REGEX.search(prefix):
+            result = self._starting_with(self.by_word, prefix, limit)
+        plain = to_plain(prefix)
+        if plain:
+            result.extend([word_id for word_id in self._starting_with(self.by_pinyin, plain, limit)
+                           if word_id not in result])
+        return result[:limit]
+
+    def suggestion(self, word_id):
+        """Map describing a word, for the suggestions API"""
+        (word, pinyin, _) = self.entries[word_id]
+        return {'id': word_id, 'word': word, 'pinyin': pinyin}
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def _word_state(user_id):
+    """Number of a user's words and their latest modification time"""
+    return Word.objects.filter(user=user_id).aggregate(count=Count('id'), last_modified=Max('last_modified'))
+
+def _current_index(user_id):
+    """Get an up-to-date index for a user, building it if necessary"""
+    # Read the state before the words, so that if they change while the index is being
+    # built, the next request sees a new state and builds it again
+    state = _word_state(user_id)
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is not None and index.state == state:
+            _indexes.move_to_end(user_id)
+            return index
+    index = PrefixIndex(Word.objects.filter(user=user_id).values_list('id', 'word', 'pinyin', 'pinyin_plain'))
+    index.state = state
+    with _lock:
+        _indexes[user_id] = index
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def suggest(user_id, prefix, limit=MAX_SUGGESTIONS):
+    """List of suggestion maps for a user's words which start with a prefix, as for complete"""
+    index = _current_index(user_id)
+    with _lock:
+        return [index.suggestion(word_id) for word_id in index.complete(prefix.strip(), limit)]
+
+def words_updated(user_id, words):
+    """
+    Apply newly-saved words to the user's index, if there is one. If those were the only
+    changes since the index was built, it stays current; otherwise it is rebuilt the next
+    time it is used.
+    """
+    with _lock:
+        if user_id not in _indexes:
+            return
+    words = list(words)
+    others = Q(user=user_id) & ~Q(id__in=[word.id for word in words]) if words else Q(user=user_id)
+    state = Word.objects.filter(user=user_id).aggregate(
+        count=Count('id'), last_modified=Max('last_modified'),
+        others_modified=Max('last_modified', filter=others))
+    others_modified = state.pop('others_modified')
+    with _lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            return
+        for word in words:
+            index.update(word.id, word.word, word.pinyin, word.pinyin_plain)
+        if (index.state is not None and state['count'] == len(index) and
+                (others_modified is None or others_modified <= index.state['last_modified'])):
+            index.state = state
@@ -1,12 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import copy
+from datetime import timedelta
+import io
 import json
+import os
+import tempfile
 import unittest
+from unittest import mock
 
-from django.test import TestCase
+from django.contrib import admin
+from django.core.cache import cache as django_cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-from . import models, serializers, views
+from . import (benchmarks, bulk, cache, graph, history, models, pinyin, profiling, sampling, scheduling, search,
+               serializers, stats, suggest, views)
 
 USER = 'user'
 PASSWORD = 'password'
@@ -18,6 +31,8 @@ class LoggedInJsonTest(TestCase):
     fixtures = ['testdata.json']
 
     def setUp(self):
+        # The database is reset for each test, but the cache is not
+        django_cache.clear()
         self.assertTrue(self.client.login(username=USER, password=PASSWORD))
 
     def assert_successful_json(self, response):
@@ -47,6 +62,23 @@ class MiscJsonApiTest(LoggedInJsonTest):
         json_response = self.assert_successful_json(response)
         self.assertEqual(sorted(["awesome", "funny", "awesome2", "awesome3", "awesome4", "awesome5"]), sorted([t['tag'] for t in json_response]))
 
+    def test_tag_counts(self):
+        response = self.client.get('/words/tags/')
+        counts = {t['tag']: t['count'] for t in self.assert_successful_json(response)}
+        user_words = models.Word.objects.filter(user__username=USER)
+        self.assertEqual({t.tag: user_words.filter(tags=t).count() for t in models.Tag.objects.filter(word__in=user_words)},
+                         counts)
+
+        response = self.client.get('/words/tags/?prefix=AWESOME')
+        self.assertEqual(['awesome', 'awesome2', 'awesome3', 'awesome4', 'awesome5'],
+                         [t['tag'] for t in self.assert_successful_json(response)])
+
+        response = self.client.get('/words/tags/?prefix=awesome&page_size=2&page=2')
+        json_response = self.assert_successful_json(response)
+        self.assertEqual(5, json_response['count'])
+        self.assertEqual(['awesome3', 'awesome4'], [t['tag'] for t in json_response['results']])
+        self.assertIn('page=3', json_response['next'])
+
     def test_common_tags(self):
         """Test common tag functionality"""
         response = self.client.get('/words/commontags/')
@@ -67,10 +99,83 @@ class MiscJsonApiTest(LoggedInJsonTest):
         response = self.client.get('/words/flashcard/awesome', follow=True)
         self.assert_successful_json(response)
 
+    def test_flashcard_database_mode(self):
+        response = self.client.get('/words/flashcard/?mode=database')
+        self.assert_successful_json(response)
+        # Make word 1 overwhelmingly likely
+        self.assertEqual(200, self.post_json('/words/confidence/1', {"new": -40}).status_code)
+        for url in ['/words/flashcard/?mode=database', '/words/flashcard/awesome?mode=database']:
+            for _ in range(5):
+                response = self.client.get(url, follow=True)
+                self.assertEqual(1, self.assert_successful_json(response)['id'])
+
+    def test_flashcard_database_mode_deleted(self):
+        """A word deleted after the words are counted should not stop a word being chosen"""
+        words = models.Word.objects.filter(user__username=USER)
+        words.update(confidence=0)
+
+        class DeletingRandom:
+            deleted = False
+
+            def uniform(self, a, b):
+                return a
+
+            def randrange(self, n):
+                # The first time, delete the last word and then pick it
+                if not self.deleted:
+                    words.order_by('-id').first().delete()
+                    self.deleted = True
+                return n - 1
+
+        word = views.choose_word_in_database(words, DeletingRandom())
+        self.assertIsNotNone(word)
+        self.assertTrue(models.Word.objects.filter(id=word.id).exists())
+
+    def test_flashcard_batch_deleted(self):
+        """Words deleted after being drawn should be left out rather than cause an error"""
+        sample_by_weight = views.sample_by_weight
+
+        def sample_then_delete(choices, n, replace=True):
+            chosen = sample_by_weight(choices, n, replace)
+            models.Word.objects.filter(pk=chosen[0]).delete()
+            return chosen
+
+        with mock.patch.object(views, 'sample_by_weight', sample_then_delete):
+            response = self.client.get('/words/flashcard/batch/?n=4&replace=false')
+        cards = self.assert_successful_json(response)
+        self.assertEqual(sorted(models.Word.objects.filter(user__username=USER).values_list('id', flat=True)),
+                         sorted([w['id'] for w in cards]))
+
+    def test_flashcard_batch(self):
+        response = self.client.get('/words/flashcard/batch/?n=50')
+        json_response = self.assert_successful_json(response)
+        self.assertEqual(50, len(json_response))
+        self.assertTrue(set([w['id'] for w in json_response]) <= set([1, 2, 3, 4]))
+
+        response = self.client.get('/words/flashcard/batch/?n=50&replace=false')
+        json_response = self.assert_successful_json(response)
+        self.assertEqual([1, 2, 3, 4], sorted([w['id'] for w in json_response]))
+
+        response = self.client.get('/words/flashcard/batch/awesome?n=1&replace=false', follow=True)
+        json_response = self.assert_successful_json(response)
+        self.assertEqual(1, len(json_response))
+        self.assertTrue(json_response[0]['id'] in [1, 2])
+
+        for bad_size in [0, -3, 1000]:
+            response = self.client.get('/words/flashcard/batch/?n={0}'.format(bad_size))
+            self.assertEqual(400, response.status_code)
+        response = self.client.get('/words/flashcard/batch/blah', follow=True)
+        self.assertEqual(404, response.status_code)
+
     def test_flashcard_errors(self):
         # Non-existent tag
         response = self.client.get('/words/flashcard/blah', follow=True)
         self.assertEqual(404, response.status_code)
+        response = self.client.get('/words/flashcard/blah?mode=database', follow=True)
+        self.assertEqual(404, response.status_code)
+        # Unknown selection mode
+        response = self.client.get('/words/flashcard/?mode=wibble')
+        self.assertEqual(400, response.status_code)
         # Read-only API point
         response = self.post_json('/words/flashcard/', {"word": "blah"})
         self.assertEqual(405, response.status_code)
@@ -109,6 +214,82 @@ class MiscJsonApiTest(LoggedInJsonTest):
         self.assertEqual(400, response.status_code)
         self.assertEqual(orig_confidence, get_confidence())
 
+    def test_confidence_batch(self):
+        """Test applying a batch of confidence changes"""
+        url = '/words/reviews/batch/'
+        etag = self.client.get('/words/words/1/')['ETag']
+        events = [{'id': 1, 'new': 3, 'timestamp': '2020-01-01T10:00:00Z'},
+                  {'id': 2, 'new': 7, 'timestamp': '2020-01-01T10:05:00+08:00'},
+                  {'id': 1, 'new': 5, 'timestamp': '2020-01-01T09:00:00Z'},
+                  {'id': 2, 'new': 6, 'timestamp': '2020-01-01T10:05:00+08:00'}]
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_json(url, events)
+        self.assertEqual([{'id': 1, 'confidence': 3}, {'id': 2, 'confidence': 6}],
+                         self.assert_successful_json(response))
+        # Session, user, the words, their update and the review log, within a transaction on SQLite
+        self.assertEqual(5, len([q for q in context.captured_queries if 'SAVEPOINT' not in q['sql']]))
+        self.assertNotEqual(etag, self.client.get('/words/words/1/')['ETag'])
+
+        # Changes older than the current confidence are ignored, whatever else has changed since
+        models.Word.objects.get(pk=1).save()
+        response = self.post_json(url, [{'id': 1, 'new': 4, 'timestamp': '2020-01-01T11:00:00Z'}])
+        self.assertEqual([{'id': 1, 'confidence': 4}], self.assert_successful_json(response))
+        response = self.post_json(url, [{'id': 1, 'new': 8, 'timestamp': '2020-01-01T10:30:00Z'}])
+        self.assertEqual([{'id': 1, 'confidence': 4}], self.assert_successful_json(response))
+        self.assertEqual(200, self.post_json('/words/confidence/1', {'new': 3}).status_code)
+        response = self.post_json(url, [{'id': 1, 'new': 9, 'timestamp': '2020-01-02T10:00:00Z'}])
+        self.assertEqual([{'id': 1, 'confidence': 3}], self.assert_successful_json(response))
+        future = '2100-01-01T00:00:00Z'
+        response = self.post_json(url, [{'id': 1, 'new': 9, 'timestamp': future}])
+        self.assertEqual([{'id': 1, 'confidence': 9}], self.assert_successful_json(response))
+        self.assertLess(models.Word.objects.get(pk=1).last_modified.year, 2100)
+
+        # Words must all belong to the user, and changes must be valid
+        self.assertEqual(404, self.post_json(url, [{'id': 5, 'new': 1, 'timestamp': future}]).status_code)
+        for bad in [{'id': 1}, [{'id': 1, 'new': 1}], [{'id': 1, 'new': 'x', 'timestamp': future}],
+                    [{'id': 1, 'new': 1, 'timestamp': '2020-01-01T10:00:00'}],
+                    [{'id': 'x', 'new': 1, 'timestamp': future}]]:
+            self.assertEqual(400, self.post_json(url, bad).status_code, msg=bad)
+        self.assertEqual(9, models.Word.objects.get(pk=1).confidence)
+
+        # A change older than the user's newest word still changes the word list's validators
+        list_etag = self.client.get('/words/words/')['ETag']
+        response = self.post_json(url, [{'id': 3, 'new': 42, 'timestamp': '2014-07-21T00:00:00Z'}])
+        self.assertEqual([{'id': 3, 'confidence': 42}], self.assert_successful_json(response))
+        self.assertEqual(200, self.client.get('/words/words/', HTTP_IF_NONE_MATCH=list_etag).status_code)
+        self.assertGreater(models.Word.objects.get(pk=3).last_modified.year, 2014)
+
+    def test_confidence_batch_devices(self):
+        """Changes from several devices should apply in the order they were made, not synced"""
+        url = '/words/reviews/batch/'
+        now = timezone.now()
+        response = self.post_json(url, [{'id': 1, 'new': 1, 'timestamp': (now - timedelta(minutes=2)).isoformat()}])
+        self.assertEqual([{'id': 1, 'confidence': 1}], self.assert_successful_json(response))
+        response = self.post_json(url, [{'id': 1, 'new': 5, 'timestamp': (now - timedelta(minutes=1)).isoformat()}])
+        self.assertEqual([{'id': 1, 'confidence': 5}], self.assert_successful_json(response))
+
+    def test_flashcard_index_other_process(self):
+        """A local confidence change should not hide changes made by other processes from the index"""
+        self.assert_successful_json(self.client.get('/words/flashcard/', follow=True))
+        # As if changed through another process, then change another word here
+        models.Word.objects.filter(pk=4).update(confidence=-50, last_modified=timezone.now())
+        self.assertEqual(200, self.post_json('/words/confidence/1', {"new": 100}).status_code)
+        for _ in range(5):
+            self.assertEqual(4, self.assert_successful_json(self.client.get('/words/flashcard/', follow=True))['id'])
+
+    def test_flashcard_index_tracks_changes(self):
+        """Flashcards should follow confidence and tag changes made after the first draw"""
+        word_url = '/words/words/2/'
+        self.assert_successful_json(self.client.get('/words/flashcard/awesome', follow=True))
+        # Make word 1 overwhelmingly likely, then remove word 2 from the tag
+        self.assertEqual(200, self.post_json('/words/confidence/1', {"new": -40}).status_code)
+        word_map = self.assert_successful_json(self.client.get(word_url))
+        word_map['tags'] = [t for t in word_map['tags'] if t['tag'] != 'awesome']
+        self.assert_successful_json(self.put_json(word_url, word_map))
+        for _ in range(5):
+            response = self.client.get('/words/flashcard/awesome', follow=True)
+            self.assertEqual(1, self.assert_successful_json(response)['id'])
+
     def test_search_exact(self):
         """Test searching for exact word"""
         response = self.client.get('/words/searchexact/你好', follow=True)
@@ -136,8 +317,10 @@ class WordsApiTest(LoggedInJsonTest):
                           'last_modified': '2014-06-14T14:29:15.857000+00:00',
                           'notes': '',
                           'pinyin': 'ni3hao3',
+                          'pinyin_marks': 'n\u01d0h\u01ceo',
                           'related_words': [{'id': 3,
                                              'pinyin': 'wu1long2qiu2',
+                                             'pinyin_marks': 'w\u016bl\u00f3ngqi\u00fa',
                                              'word': '\u4e4c\u9f99\u7403'}],
                           'tags': [{'tag': 'awesome'}],
                           'user': 'user',
@@ -221,6 +404,75 @@ class WordsApiTest(LoggedInJsonTest):
         response = self.client.get('/words/words/?order=rufriblath')
         self.assertEqual(400, response.status_code)
 
+    def test_pinyin_forms(self):
+        """Test that pinyin is stored and served with tone marks, and sorted ignoring tones and case"""
+        user = models.User.objects.get(username=USER)
+        for (word, word_pinyin) in [('八', 'Ba1'), ('啊', 'a1'), ('安', 'an1')]:
+            models.Word.objects.create(word=word, pinyin=word_pinyin, user=user)
+        response = self.client.get('/words/words/?order=pinyin&page_size=20')
+        words = [w['word'] for w in self.assert_successful_json(response)['results']]
+        self.assertEqual(['啊', '安', '八', '蛋白质', '妇女', '你好', '乌龙球'], words)
+
+        word_map = self.assert_successful_json(self.client.get(self.word_url))
+        word_map['pinyin'] = 'Ni3hao3'
+        word_map['definitions'][0]['example_sentences'] = [
+            {'sentence': '你好吗？', 'pinyin': 'Ni3hao3 ma5?', 'translation': 'How are you?'}]
+        word_map = self.assert_successful_json(self.put_json(self.word_url, word_map))
+        self.assertEqual('Nǐhǎo', word_map['pinyin_marks'])
+        sentence_map = word_map['definitions'][0]['example_sentences'][0]
+        self.assertEqual('Nǐhǎo ma5?', sentence_map['pinyin_marks'])
+        self.assertFalse('pinyin_plain' in sentence_map)
+        self.assertEqual('nihao', self.latest_word().pinyin_plain)
+        self.assertEqual('nihaoma', models.ExampleSentence.objects.get(pk=sentence_map['id']).pinyin_plain)
+
+    def test_get_words_cursor_pagination(self):
+        user = models.User.objects.get(username=USER)
+        for i in range(4):
+            models.Word.objects.create(word='词{0}'.format(i), pinyin='ci2', user=user)
+        for (sort, is_reverse) in [("word", False), ("pinyin", False), ("confidence", False),
+                                   ("date_added", True), ("last_modified", True)]:
+            expected_order = sorted(models.Word.objects.filter(user=user),
+                                    key=lambda w, sort=sort: (getattr(w, sort), w.id), reverse=is_reverse)
+            expected_ids = [w.id for w in expected_order]
+
+            response = self.client.get('/words/words/?page_size=3&cursor=&order={0}'.format(sort))
+            json_response = self.assert_successful_json(response)
+            self.assertFalse('count' in json_response)
+            self.assertFalse('previous' in json_response)
+            pages = [[w['id'] for w in json_response['results']]]
+            while 'next' in json_response:
+                json_response = self.assert_successful_json(self.client.get(json_response['next']))
+                pages.append([w['id'] for w in json_response['results']])
+            self.assertEqual([3, 3, 2], [len(p) for p in pages])
+            self.assertEqual(expected_ids, sum(pages, []))
+
+            # Page back to the start again
+            pages.pop()
+            while 'previous' in json_response:
+                json_response = self.assert_successful_json(self.client.get(json_response['previous']))
+                self.assertEqual(pages.pop(), [w['id'] for w in json_response['results']])
+                self.assertTrue('next' in json_response)
+            self.assertEqual([], pages)
+
+        response = self.client.get('/words/wordsbytag/awesome?cursor=&page_size=1&count=true', follow=True)
+        json_response = self.assert_successful_json(response)
+        self.assertEqual(2, json_response['count'])
+        self.assertEqual([2], [w['id'] for w in json_response['results']])
+        json_response = self.assert_successful_json(self.client.get(json_response['next']))
+        self.assertEqual([1], [w['id'] for w in json_response['results']])
+        self.assertFalse('next' in json_response)
+
+        for cursor in ['wibble', 'e30=', '%00']:
+            response = self.client.get('/words/words/?cursor={0}'.format(cursor))
+            self.assertEqual(400, response.status_code)
+        # Cursors whose values do not have the types of the ordering's fields
+        for (sort, values) in [('word', [[1, 2], 1]), ('word', ['你好', '1']), ('word', ['你好', True]),
+                               ('confidence', ['10', 1]), ('confidence', [1.5, 1]), ('date_added', [0, 1]),
+                               ('pinyin', ['nihao', None, 1])]:
+            cursor = base64.urlsafe_b64encode(json.dumps({'v': values, 'b': False}).encode('utf-8')).decode('ascii')
+            response = self.client.get('/words/words/?order={0}&cursor={1}'.format(sort, cursor))
+            self.assertEqual(400, response.status_code)
+
     def test_get_word(self):
         response = self.client.get(self.word_url, follow=True)
         word = self.assert_successful_json(response)
@@ -313,6 +565,28 @@ class WordsApiTest(LoggedInJsonTest):
         json_response = self.assert_successful_json(response)
         check_sentences()
 
+    def test_edit_sentence_by_id(self):
+        """Sentences with IDs should be edited in place, even if their text changes"""
+        new_word = copy.deepcopy(self.orig_word)
+        new_word['definitions'][0]['example_sentences'].append(
+            {'sentence': '你好小猫', 'pinyin': 'ni3hao3 xiao3mao1', 'translation': 'Hello kitty!'})
+        new_word = self.assert_successful_json(self.put_json(self.word_url, new_word))
+        sentence = new_word['definitions'][0]['example_sentences'][0]
+        sentence['sentence'] = '你好,小猫!'
+        json_response = self.assert_successful_json(self.put_json(self.word_url, new_word))
+        self.assertEqual([(sentence['id'], '你好,小猫!')],
+                         [(s['id'], s['sentence']) for s in json_response['definitions'][0]['example_sentences']])
+        self.assertEqual('你好,小猫!', models.ExampleSentence.objects.get(pk=sentence['id']).sentence)
+
+    def test_invalid_definition_not_saved(self):
+        """Nothing should be written if any definition is invalid"""
+        new_word = copy.deepcopy(self.orig_word)
+        new_word['word'] = '你是谁'
+        new_word['definitions'].append({'definition': 'Hi there!', 'part_of_speech': 'WIBBLE'})
+        self.assertEqual(400, self.put_json(self.word_url, new_word).status_code)
+        self.assertEqual(self.orig_word['word'], self.latest_word().word)
+        self.assertEqual(len(self.orig_word['definitions']), len(self.latest_word().definitions.all()))
+
     def add_tag_helper(self, new_tag):
         """Test addition of new tag"""
         new_word = copy.deepcopy(self.orig_word)
@@ -421,6 +695,798 @@ class WordsApiTest(LoggedInJsonTest):
             self.assertEqual(400, response.status_code)
 
 
+class QueryCountTest(LoggedInJsonTest):
+    """
+    Check that the number of database queries needed to serve a request does not grow
+    with the number of words involved
+    """
+    def setUp(self):
+        super().setUp()
+        user = models.User.objects.get(username=USER)
+        tag = models.Tag.objects.get(tag='awesome')
+        previous = None
+        for i in range(20):
+            word = models.Word.objects.create(word='词{0}'.format(i), pinyin='ci2', user=user)
+            definition = word.definitions.create(definition='word {0}'.format(i), part_of_speech='N')
+            definition.example_sentences.create(sentence='这是词。', pinyin='Zhe4 shi4 ci2.',
+                                                translation='This is a word.')
+            word.tags.add(tag)
+            if previous:
+                word.related_words.add(previous)
+            previous = word
+
+    def count_queries(self, url):
+        """Count the queries needed to successfully serve a GET request"""
+        with CaptureQueriesContext(connection) as context:
+            self.assert_successful_json(self.client.get(url, follow=True))
+        return len(context.captured_queries)
+
+    def test_words_page_queries(self):
+        small_page = self.count_queries('/words/words/?page_size=2')
+        self.assertEqual(small_page, self.count_queries('/words/words/?page_size=20'))
+        small_page = self.count_queries('/words/wordsbytag/awesome?page_size=2')
+        self.assertEqual(small_page, self.count_queries('/words/wordsbytag/awesome?page_size=20'))
+
+    def test_search_exact_queries(self):
+        single_word = self.count_queries('/words/searchexact/词1')
+        user = models.User.objects.get(username=USER)
+        for _ in range(5):
+            models.Word.objects.create(word='词1', pinyin='ci2', user=user)
+        self.assertEqual(single_word, self.count_queries('/words/searchexact/词1'))
+
+    def test_update_tags_queries(self):
+        """Changing a word's tags should not cost more queries for more tags"""
+        word_url = '/words/words/1/'
+        word_map = self.assert_successful_json(self.client.get(word_url))
+
+        def count_update_queries(tag_names):
+            word_map['tags'] = [{'tag': t} for t in tag_names]
+            with CaptureQueriesContext(connection) as context:
+                self.assert_successful_json(self.put_json(word_url, word_map))
+            self.assertEqual(sorted(tag_names), sorted([t.tag for t in models.Word.objects.get(pk=1).tags.all()]))
+            return len(context.captured_queries)
+
+        # Each update adds new tags, and removes the previous ones so they become unused
+        count_update_queries(['new0'])
+        few_tags = count_update_queries(['new1'])
+        self.assertEqual(few_tags, count_update_queries(['new{0}'.format(i) for i in range(2, 12)]))
+        self.assertEqual(few_tags, count_update_queries(['funny'] + ['new{0}'.format(i) for i in range(12, 17)]))
+        self.assertFalse(models.Tag.objects.filter(tag__startswith='new').exclude(word=1).exists())
+        self.assertTrue(models.Tag.objects.filter(tag='awesome').exists())
+
+    def test_update_definitions_queries(self):
+        """Changing a word's definitions should not cost more queries for more definitions"""
+        word_url = '/words/words/1/'
+        word_map = self.assert_successful_json(self.client.get(word_url))
+
+        def count_update_queries(num_definitions, num_sentences):
+            # Update the existing definitions and sentences, delete one of each, and add new ones
+            definitions = word_map['definitions'][1:]
+            for definition in definitions:
+                definition['definition'] += '!'
+                for sentence in definition['example_sentences'][1:]:
+                    sentence['translation'] += '!'
+                definition['example_sentences'] = definition['example_sentences'][1:] + [
+                    {'sentence': '句子{0}'.format(i), 'pinyin': 'ju4zi', 'translation': 'sentence'}
+                    for i in range(num_sentences)]
+            definitions.extend([{'definition': 'definition {0}'.format(i), 'part_of_speech': 'N',
+                                 'example_sentences': [{'sentence': '句子{0}'.format(j), 'pinyin': 'ju4zi',
+                                                        'translation': 'sentence'}
+                                                       for j in range(num_sentences)]}
+                                for i in range(num_definitions)])
+            word_map['definitions'] = definitions
+            with CaptureQueriesContext(connection) as context:
+                word_map.update(self.assert_successful_json(self.put_json(word_url, word_map)))
+            return len(context.captured_queries)
+
+        count_update_queries(2, 2)
+        few = count_update_queries(2, 2)
+        self.assertEqual(few, count_update_queries(10, 5))
+        self.assertEqual(12, len(word_map['definitions']))
+        self.assertEqual(sorted([s['id'] for d in word_map['definitions'] for s in d['example_sentences']]),
+                         sorted(models.ExampleSentence.objects.filter(definition__word=1).values_list('id', flat=True)))
+
+
+class BulkImportTest(LoggedInJsonTest):
+    """Test importing many words at once"""
+    def import_lines(self, lines, content_type="application/x-ndjson"):
+        response = self.client.post('/words/import/', content_type=content_type, data='\n'.join(lines))
+        return self.assert_successful_json(response)
+
+    def test_import_json_lines(self):
+        words = [{'word': '小猪', 'pinyin': 'xiao3zhu1', 'confidence': 3,
+                  'definitions': [{'definition': 'piglet', 'part_of_speech': 'N',
+                                   'example_sentences': [{'sentence': '这是一只小猪。',
+                                                          'pinyin': 'Zhe4 shi4 yi1zhi1 xiao3zhu1.',
+                                                          'translation': 'This is a piglet.'}]}],
+                  'tags': [{'tag': 'Awesome'}, {'tag': 'hsk1'}],
+                  'related_words': [{'word': '你好'}, {'word': '猪肉'}]},
+                 {'word': '大象', 'pinyin': 'da4xiang4', 'tags': [{'tag': 'hsk1'}]}]
+        lines = [json.dumps(words[0]), '{"word": ', '', json.dumps(words[1]),
+                 json.dumps({'word': '坏', 'pinyin': 'huai4', 'tags': [{'tag': 'not_ok'}]}),
+                 json.dumps({'pinyin': 'wu2'})]
+        result = self.import_lines(lines)
+        self.assertEqual(2, result['created'])
+        self.assertEqual([2, 5, 6], [e['line'] for e in result['errors']])
+
+        piglet = models.Word.objects.get(word='小猪')
+        self.assertEqual(USER, piglet.user.username)
+        self.assertEqual(3, piglet.confidence)
+        self.assertEqual(['awesome', 'hsk1'], sorted([t.tag for t in piglet.tags.all()]))
+        self.assertEqual(['This is a piglet.'],
+                         [s.translation for s in piglet.definitions.get().example_sentences.all()])
+        self.assertEqual(['你好', '猪肉'], sorted([w.word for w in piglet.related_words.all()]))
+        self.assertEqual(['小猪'], [w.word for w in models.Word.objects.get(word='猪肉').related_words.all()])
+        self.assertTrue(piglet in models.Word.objects.get(pk=1).related_words.all())
+        self.assertEqual(['大象', '小猪'], sorted([w.word for w in models.Tag.objects.get(tag='hsk1').word_set.all()]))
+        self.assertFalse(models.Word.objects.filter(word='坏').exists())
+        self.assertEqual(['大象', '小猪', '猪肉'],
+                         sorted(models.ReviewState.objects.filter(word__id__gt=5).values_list('word__word', flat=True)))
+
+    def test_import_csv(self):
+        lines = ['word,pinyin,definition,part_of_speech,tags,sentence,sentence_pinyin,translation',
+                 '小猪,xiao3zhu1,piglet,N,hsk1 animals,这是一只小猪。,Zhe4 shi4 yi1zhi1 xiao3zhu1.,This is a piglet.',
+                 '大象,da4xiang4,elephant,,hsk1,,,',
+                 ',wu2,nothing,,,,,']
+        result = self.import_lines(lines, content_type="text/csv")
+        self.assertEqual(2, result['created'])
+        self.assertEqual([4], [e['line'] for e in result['errors']])
+        elephant = models.Word.objects.get(word='大象')
+        self.assertEqual([('elephant', ' ')],
+                         [(d.definition, d.part_of_speech) for d in elephant.definitions.all()])
+        self.assertEqual(['animals', 'hsk1'],
+                         sorted([t.tag for t in models.Word.objects.get(word='小猪').tags.all()]))
+
+        result = self.import_lines(['word,wibble', '小猪,1'], content_type="text/csv")
+        self.assertEqual(0, result['created'])
+        self.assertEqual(1, len(result['errors']))
+
+    def test_import_queries(self):
+        """The number of queries should not depend on the number of words imported"""
+        user = models.User.objects.get(username=USER)
+
+        def count_queries(num_words):
+            word_maps = [(i, {'word': '词{0}'.format(i), 'pinyin': 'ci2', 'tags': [{'tag': 'tag{0}'.format(i)}],
+                              'definitions': [{'definition': 'word', 'part_of_speech': 'N',
+                                               'example_sentences': [{'sentence': '词', 'pinyin': 'ci2',
+                                                                      'translation': 'word'}]}],
+                              'related_words': [{'word': '你好'}, {'word': '新{0}'.format(i)}]})
+                         for i in range(num_words)]
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(num_words, bulk.import_words(user, word_maps)['created'])
+            return len(context.captured_queries)
+
+        self.assertEqual(count_queries(3), count_queries(30))
+
+    def test_import_related_across_chunks(self):
+        """Words related to words later in the import should link to them rather than placeholders"""
+        user = models.User.objects.get(username=USER)
+        word_maps = [(1, {'word': '甲', 'pinyin': 'jia3', 'related_words': [{'word': '丙'}]}),
+                     (2, {'word': '丙', 'pinyin': 'bing3', 'related_words': [{'word': '甲'}]})]
+        self.assertEqual(2, bulk.import_words(user, word_maps, chunk_size=1)['created'])
+        bing = models.Word.objects.get(user=user, word='丙')
+        self.assertEqual('bing3', bing.pinyin)
+        self.assertEqual(['甲'], [w.word for w in bing.related_words.all()])
+        self.assertEqual(['丙'], [w.word for w in models.Word.objects.get(user=user, word='甲').related_words.all()])
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('\ufeffword,pinyin\n小猪,xiao3zhu1\n')
+        try:
+            call_command('import_words', USER, f.name, stdout=io.StringIO())
+        finally:
+            os.remove(f.name)
+        self.assertEqual('xiao3zhu1', models.Word.objects.get(word='小猪').pinyin)
+        self.assertEqual('xiǎozhū', models.Word.objects.get(word='小猪').pinyin_marks)
+
+    def export_words(self):
+        response = self.client.get('/words/export/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response['Content-Type'])
+        return b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    def test_export_round_trip(self):
+        def strip(word_map):
+            """Remove the parts of a word which are not preserved by export and import"""
+            word_map = {k: v for (k, v) in word_map.items()
+                        if k not in ('id', 'user', 'date_added', 'last_modified')}
+            for definition in word_map['definitions']:
+                del definition['id']
+                for sentence in definition['example_sentences']:
+                    del sentence['id']
+            word_map['related_words'] = [w['word'] for w in word_map['related_words']]
+            return word_map
+
+        lines = self.export_words()
+        self.assertEqual(['你好', '蛋白质', '乌龙球', '妇女'], [json.loads(l)['word'] for l in lines])
+        models.Word.objects.filter(user__username=USER).delete()
+        self.assertEqual([], self.export_words())
+
+        self.assertEqual(4, self.import_lines(lines)['created'])
+        self.assertEqual([strip(json.loads(l)) for l in lines],
+                         [strip(json.loads(l)) for l in self.export_words()])
+
+    def test_export_queries(self):
+        """Related objects should be loaded a chunk at a time rather than a word at a time"""
+        user = models.User.objects.get(username=USER)
+        words = models.Word.objects.filter(user=user)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(4, len(list(bulk.export_words(words, chunk_size=10))))
+        single_chunk = len(context.captured_queries)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(4, len(list(bulk.export_words(words, chunk_size=2))))
+        self.assertEqual(2 * single_chunk - 1, len(context.captured_queries))
+
+
+class TagUsageTest(LoggedInJsonTest):
+    """Test that the tag usage counts stay in line with the words' tags"""
+    def assert_usage_consistent(self):
+        expected = {}
+        for (user_id, tag_id) in models.Word.tags.through.objects.values_list('word__user', 'tag'):
+            expected[(user_id, tag_id)] = expected.get((user_id, tag_id), 0) + 1
+        actual = {(u.user_id, u.tag_id): u.count for u in models.TagUsage.objects.filter(count__gt=0)}
+        self.assertEqual(expected, actual)
+        self.assertFalse(models.TagUsage.objects.filter(count__lt=0).exists())
+
+    def test_usage_counts(self):
+        self.assert_usage_consistent()
+        word_map = self.assert_successful_json(self.client.get('/words/words/2/'))
+        word_map['tags'] = [{'tag': 'awesome'}, {'tag': 'funny'}, {'tag': 'brandnew'}]
+        self.assert_successful_json(self.put_json('/words/words/2/', word_map))
+        self.assert_usage_consistent()
+
+        self.client.post('/words/import/', content_type="text/csv",
+                         data='word,pinyin,tags\n小猪,xiao3zhu1,funny hsk1\n大象,da4xiang4,hsk1')
+        self.assert_usage_consistent()
+
+        funny = models.Tag.objects.get(tag='funny')
+        funny.word_set.add(*models.Word.objects.filter(word__in=['你好', '妇女']))
+        funny.word_set.remove(models.Word.objects.get(word='小猪'))
+        self.assert_usage_consistent()
+        models.Word.objects.get(pk=1).tags.clear()
+        self.assert_usage_consistent()
+
+        models.Word.objects.filter(word__in=['蛋白质', '大象']).delete()
+        self.assert_usage_consistent()
+        self.assertEqual(['funny', 'hsk1'],
+                         [t['tag'] for t in self.assert_successful_json(self.client.get('/words/commontags/'))])
+
+    def test_unused_tags_deleted(self):
+        word_map = self.assert_successful_json(self.client.get('/words/words/2/'))
+        word_map['tags'] = []
+        self.assert_successful_json(self.put_json('/words/words/2/', word_map))
+        # Still used by word 1
+        self.assertTrue(models.Tag.objects.filter(tag='awesome').exists())
+        self.assertFalse(models.Tag.objects.filter(tag='awesome5').exists())
+        self.assert_usage_consistent()
+
+
+class CacheTest(LoggedInJsonTest):
+    """Test caching of tag lists and word pages"""
+    def tag_names(self, url):
+        return sorted([t['tag'] for t in self.assert_successful_json(self.client.get(url))])
+
+    def test_tags_cached_until_word_changes(self):
+        tags = self.tag_names('/words/tags/')
+        common_tags = self.tag_names('/words/commontags/')
+        # Changes which bypass the API are not seen...
+        models.Word.objects.get(pk=3).tags.add(models.Tag.objects.create(tag='wibble'))
+        self.assertEqual(tags, self.tag_names('/words/tags/'))
+        self.assertEqual(common_tags, self.tag_names('/words/commontags/'))
+        # ...until the user changes a word through the API
+        word_map = self.assert_successful_json(self.client.get('/words/words/1/'))
+        self.assert_successful_json(self.put_json('/words/words/1/', word_map))
+        self.assertEqual(sorted(tags + ['wibble']), self.tag_names('/words/tags/'))
+
+    def test_words_cached_until_confidence_changes(self):
+        def confidences():
+            response = self.client.get('/words/words/?order=confidence', follow=True)
+            return [w['confidence'] for w in self.assert_successful_json(response)['results']]
+        orig_confidences = confidences()
+        models.Word.objects.filter(pk=1).update(confidence=-5)
+        self.assertEqual(orig_confidences, confidences())
+        self.assert_successful_json(self.post_json('/words/confidence/2/', {'new': 100}))
+        self.assertEqual(-5, confidences()[0])
+        self.assertEqual(100, confidences()[-1])
+
+    def test_separate_users(self):
+        self.assertEqual('one', cache.get_or_set(1, 'tags', lambda: 'one'))
+        self.assertEqual('two', cache.get_or_set(2, 'tags', lambda: 'two'))
+        self.assertEqual('one', cache.get_or_set(1, 'tags', lambda: 'three'))
+        cache.invalidate_user(2)
+        self.assertEqual('one', cache.get_or_set(1, 'tags', lambda: 'three'))
+        self.assertEqual('four', cache.get_or_set(2, 'tags', lambda: 'four'))
+        cache.invalidate_all()
+        self.assertEqual('five', cache.get_or_set(1, 'tags', lambda: 'five'))
+
+    def test_admin_invalidates(self):
+        self.assertEqual('one', cache.get_or_set(1, 'tags', lambda: 'one'))
+        admin.site._registry[models.Word].delete_model(None, models.Word.objects.get(pk=4))
+        self.assertEqual('two', cache.get_or_set(1, 'tags', lambda: 'two'))
+        admin.site._registry[models.Definition].delete_queryset(None, models.Definition.objects.filter(word=1))
+        self.assertEqual('three', cache.get_or_set(1, 'tags', lambda: 'three'))
+
+
+class ConditionalGetTest(LoggedInJsonTest):
+    """Test ETag and Last-Modified support"""
+    def check_not_modified(self, url):
+        """Check that a URL gives 304 when its ETag is sent back, and return the ETag"""
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.content)
+        self.assertEqual(etag, response['ETag'])
+        return etag
+
+    def test_not_modified(self):
+        for url in ['/words/words/1/', '/words/words/?page_size=2', '/words/wordsbytag/awesome',
+                    '/words/tags/', '/words/commontags/']:
+            self.check_not_modified(url)
+        # Different pages of the same words must have different ETags
+        self.assertNotEqual(self.check_not_modified('/words/words/?page=1&page_size=2'),
+                            self.check_not_modified('/words/words/?page=2&page_size=2'))
+
+    def test_not_modified_skips_serializer(self):
+        etag = self.client.get('/words/words/?page_size=4')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/words/words/?page_size=4', HTTP_IF_NONE_MATCH=etag)
+        # Session, user and the validators themselves
+        self.assertEqual(3, len(context.captured_queries))
+
+    def test_modified(self):
+        word_etag = self.check_not_modified('/words/words/1/')
+        list_etag = self.check_not_modified('/words/words/')
+        self.assert_successful_json(self.post_json('/words/confidence/2/', {'new': 3}))
+        # Word 2 is not related to word 1
+        self.assertEqual(304, self.client.get('/words/words/1/', HTTP_IF_NONE_MATCH=word_etag).status_code)
+        self.assertEqual(200, self.client.get('/words/words/', HTTP_IF_NONE_MATCH=list_etag).status_code)
+
+        # Relating word 2 to word 1 only updates word 2, but changes both
+        word_map = self.assert_successful_json(self.client.get('/words/words/2/'))
+        word_map['related_words'].append({'id': 1})
+        self.assert_successful_json(self.put_json('/words/words/2/', word_map))
+        response = self.client.get('/words/words/1/', HTTP_IF_NONE_MATCH=word_etag)
+        self.assertEqual(200, response.status_code)
+        self.assertIn('蛋白质', [w['word'] for w in json.loads(response.content.decode('utf-8'))['related_words']])
+
+    def test_admin_changes_modify_word(self):
+        etag = self.check_not_modified('/words/words/1/')
+        definition = models.Definition.objects.filter(word=1).first()
+        admin.site._registry[models.Definition].delete_model(None, definition)
+        self.assertEqual(200, self.client.get('/words/words/1/', HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_changes_in_other_processes(self):
+        """Changes which this process's cache has not seen should not be served under the new ETag"""
+        def confidences(response):
+            return {w['id']: w['confidence'] for w in json.loads(response.content.decode('utf-8'))['results']}
+        etag = self.check_not_modified('/words/words/')
+        # As if saved through another process, which bumps the version in its own cache
+        models.Word.objects.filter(pk=1).update(confidence=7, last_modified=timezone.now())
+        response = self.client.get('/words/words/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(7, confidences(response)[1])
+        self.assertEqual(304, self.client.get('/words/words/', HTTP_IF_NONE_MATCH=response['ETag']).status_code)
+
+    def test_admin_tag_changes_modify_words(self):
+        etags = {url: self.check_not_modified(url) for url in ['/words/tags/', '/words/words/1/']}
+        tag = models.Tag.objects.get(tag='awesome')
+        tag.tag = 'splendid'
+        admin.site._registry[models.Tag].save_model(None, tag, None, True)
+        for (url, etag) in etags.items():
+            self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+        self.assertIn('splendid', [t['tag'] for t in self.assert_successful_json(self.client.get('/words/tags/'))])
+
+    def test_admin_affected_words_queries(self):
+        definitions = models.Definition.objects.all()
+        with self.assertNumQueries(1):
+            affected = admin.site._registry[models.Definition].affected_words(definitions)
+        self.assertEqual(sorted([(d.word_id, d.word.user_id) for d in definitions]), sorted(affected))
+
+
+class SearchTest(LoggedInJsonTest):
+    """Test searching by hanzi, pinyin and English"""
+    def setUp(self):
+        super().setUp()
+        # Fixtures are loaded without going through the code which maintains the indexes
+        call_command('rebuild_search_index', stdout=io.StringIO())
+
+    def search_words(self, query):
+        response = self.client.get('/words/search/' + query, follow=True)
+        return [w['word'] for w in self.assert_successful_json(response)]
+
+    def test_hanzi(self):
+        self.assertEqual(['你好'], self.search_words('你好'))
+        self.assertEqual(['你好'], self.search_words('你'))
+        self.assertEqual(['你好'], self.search_words('好'))
+        self.assertEqual([], self.search_words('加油'))
+        # Also words whose example sentences contain the text
+        self.assertEqual(['乌龙球'], self.search_words('踢'))
+        self.assertEqual(['蛋白质', '乌龙球', '妇女'], self.search_words('一个'))
+
+    def test_filter_containing(self):
+        def sentences(text):
+            return sorted(models.filter_containing(models.ExampleSentence.objects.all(), text)
+                          .values_list('sentence', flat=True))
+        self.assertEqual(sorted(['他踢了一个乌龙球！', '这是一个蛋白质。', '她是一个妇女。']), sentences('一个'))
+        self.assertEqual(['不要踢乌龙球！'], sentences('踢乌龙'))
+        self.assertEqual(['加油! 加油!'], sentences('油! 加'))
+        self.assertEqual([], sentences('一乌'))
+
+        group = models.ComparisonGroup.objects.create(name='好')
+        example = models.ComparisonExample.objects.create(comparison_group=group, word_id=1,
+                                                          example='好人，人好', explanation='')
+        examples = models.ComparisonExample.objects.all()
+        self.assertEqual([example], list(models.filter_containing(examples, '人，人', user_id=1)))
+        self.assertEqual([], list(models.filter_containing(examples, '人，人', user_id=2)))
+        # Contains both pairs of characters, but not together
+        self.assertEqual([], list(models.filter_containing(examples, '好人好')))
+
+        example.example = '好人好事'
+        example.save()
+        self.assertEqual([example], list(models.filter_containing(examples, '好人好')))
+        models.Word.objects.get(pk=1).delete()
+        self.assertFalse(models.HanziGram.objects.filter(comparison_example__isnull=False).exists())
+        self.assertFalse(models.HanziGram.objects.filter(user=1).exclude(word=None).filter(gram='你').exists())
+
+    def test_pinyin(self):
+        for query in ['nihao', 'ni3hao3', 'Nǐ hǎo', 'ni', 'ni3 ']:
+            self.assertEqual(['你好'], self.search_words(query), msg=query)
+        self.assertEqual([], self.search_words('jiayou'))
+
+    def test_english(self):
+        self.assertEqual(['蛋白质'], self.search_words('Protein'))
+        # Definitions count for more than example sentences
+        self.assertEqual(['妇女', '乌龙球'], self.search_words('woman scored'))
+        self.assertEqual(['乌龙球'], self.search_words('the goal'))
+        self.assertEqual([], self.search_words('come on'))
+
+    def test_index_updated(self):
+        word_map = self.assert_successful_json(self.client.get('/words/words/2/'))
+        word_map['definitions'][0]['definition'] = 'Albumen'
+        self.assert_successful_json(self.put_json('/words/words/2/', word_map))
+        self.assertEqual(['蛋白质'], self.search_words('albumen'))
+        self.assertEqual(['蛋白质'], self.search_words('protein'))  # Still in the example sentence
+
+        self.client.post('/words/import/', content_type="text/csv",
+                         data='word,pinyin,definition\n小猪,xiao3zhu1,piglet')
+        self.assertEqual(['小猪'], self.search_words('piglet'))
+        self.assertEqual(['小猪'], self.search_words('xiaozhu'))
+
+        admin.site._registry[models.Definition].delete_queryset(None, models.Definition.objects.filter(word=2))
+        self.assertEqual([], self.search_words('albumen'))
+
+    def test_grams_only_reindexed_for_new_text(self):
+        def gram_queries(make_change):
+            with CaptureQueriesContext(connection) as context:
+                make_change()
+            return [q['sql'] for q in context.captured_queries if 'words_hanzigram' in q['sql']]
+
+        self.assertEqual([], gram_queries(lambda: self.post_json('/words/confidence/1', {'new': 3})))
+        word = models.Word.objects.get(pk=1)
+        word.notes = 'Hello'
+        self.assertEqual([], gram_queries(word.save))
+        word.word = '您好'
+        self.assertTrue(gram_queries(word.save))
+        self.assertEqual([1], list(models.filter_containing(models.Word.objects.all(), '您')
+                                   .values_list('id', flat=True)))
+        self.assertEqual([], gram_queries(word.save))
+
+    def test_rebuild(self):
+        models.SearchTerm.objects.all().delete()
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(['你好'], self.search_words('nihao'))
+
+
+class SuggestTest(LoggedInJsonTest):
+    """Test search-as-you-type suggestions"""
+    def suggest_words(self, query, **params):
+        response = self.client.get('/words/suggest/', dict(q=query, **params))
+        return [w['word'] for w in self.assert_successful_json(response)]
+
+    def test_suggest(self):
+        for query in ['你', '你好', 'ni', 'Nǐ h', 'ni3hao3']:
+            self.assertEqual(['你好'], self.suggest_words(query), msg=query)
+        self.assertEqual(['乌龙球'], self.suggest_words('乌龙'))
+        self.assertEqual([], self.suggest_words('加'))
+        self.assertEqual([], self.suggest_words(''))
+        response = self.client.get('/words/suggest/', {'q': 'wu', 'limit': 1})
+        self.assertEqual([{'id': 3, 'word': '乌龙球', 'pinyin': 'wu1long2qiu2'}],
+                         self.assert_successful_json(response))
+        self.assertEqual(400, self.client.get('/words/suggest/', {'q': 'ni', 'limit': 0}).status_code)
+        self.assertEqual(400, self.client.get('/words/suggest/', {'q': 'ni', 'limit': 'x'}).status_code)
+
+    def test_updated_incrementally(self):
+        self.assertEqual(['你好'], self.suggest_words('ni'))
+        word_map = self.assert_successful_json(self.client.get('/words/words/1/'))
+        word_map['word'] = '您好'
+        word_map['pinyin'] = 'nin2hao3'
+        word_map['related_words'] = [{'word': '你们'}]
+        self.assert_successful_json(self.put_json('/words/words/1/', word_map))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(['你们', '您好'], self.suggest_words('你') + self.suggest_words('nin'))
+        # Only the session, user and the check of the words' state for each request
+        self.assertEqual(6, len(context.captured_queries))
+
+        # Changes from elsewhere (e.g. another process) are seen, as are deletions
+        models.Word.objects.filter(pk=1).update(word='你好', last_modified=timezone.now())
+        self.assertEqual(['你们', '你好'], self.suggest_words('你'))
+        models.Word.objects.filter(word='你们').delete()
+        self.assertEqual(['你好'], self.suggest_words('你'))
+
+    def test_other_changes_not_hidden(self):
+        """A change through the API should not hide earlier changes made elsewhere"""
+        self.assertEqual(['你好'], self.suggest_words('ni'))
+        models.Word.objects.filter(pk=2).update(word='你们', last_modified=timezone.now())
+        self.assert_successful_json(self.post_json('/words/confidence/1', {'new': 3}))
+        self.assertEqual(['你们', '你好'], self.suggest_words('你'))
+
+
+class ReviewTest(LoggedInJsonTest):
+    """Test spaced repetition reviews and the due flashcard mode"""
+    def due_words(self, url='/words/flashcard/batch/?mode=due'):
+        return [w['word'] for w in self.assert_successful_json(self.client.get(url))]
+
+    def test_due_order(self):
+        self.assertEqual(['你好', '蛋白质', '乌龙球', '妇女'], self.due_words())
+        self.assertEqual(['你好', '蛋白质'], self.due_words('/words/flashcard/batch/?mode=due&n=2'))
+        self.assertEqual(['你好', '蛋白质'], self.due_words('/words/flashcard/batch/awesome?mode=due'))
+        response = self.client.get('/words/flashcard/?mode=due')
+        self.assertEqual('你好', self.assert_successful_json(response)['word'])
+        self.assertEqual(404, self.client.get('/words/flashcard/blah?mode=due').status_code)
+        self.assertEqual(404, self.client.get('/words/flashcard/batch/blah?mode=due').status_code)
+
+    def test_review(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_json('/words/review/1', {'grade': 4})
+        # The session, the user, the review state, its update and the review log
+        self.assertEqual(5, len(context.captured_queries))
+        result = self.assert_successful_json(response)
+        self.assertEqual([1, 1, 2.5], [result[k] for k in ['repetitions', 'interval', 'ease']])
+        self.assertEqual(['蛋白质', '乌龙球', '妇女', '你好'], self.due_words())
+
+        # Forgetting a word makes it due again the next day, and harder
+        self.assert_successful_json(self.post_json('/words/review/1', {'grade': 5}))
+        result = self.assert_successful_json(self.post_json('/words/review/1', {'grade': 1}))
+        self.assertEqual([0, 1], [result[k] for k in ['repetitions', 'interval']])
+        self.assertLess(result['ease'], 2.5)
+
+        self.assertEqual(400, self.post_json('/words/review/1', {}).status_code)
+        self.assertEqual(400, self.post_json('/words/review/1', {'grade': 6}).status_code)
+        self.assertEqual(400, self.post_json('/words/review/1', {'grade': 'x'}).status_code)
+        for grade in [None, [1], {'a': 1}]:
+            self.assertEqual(400, self.post_json('/words/review/1', {'grade': grade}).status_code, msg=grade)
+        self.assertEqual(400, self.post_json('/words/review/1', [1]).status_code)
+        self.assertEqual(404, self.post_json('/words/review/5', {'grade': 3}).status_code)
+
+    def test_new_words(self):
+        word = self.assert_successful_json(self.post_json('/words/words/', {
+            'word': '新', 'pinyin': 'xin1', 'related_words': [{'word': '旧'}]}))
+        self.assertTrue(models.ReviewState.objects.filter(word=word['id']).exists())
+        self.assertEqual(['你好', '蛋白质', '乌龙球', '妇女', '新', '旧'], self.due_words())
+
+class ReviewLogTest(LoggedInJsonTest):
+    """Test the review log and its daily rollups"""
+    def review_days(self, days=30):
+        return self.assert_successful_json(self.client.get('/words/reviews/days/', {'days': days}))
+
+    def test_logged(self):
+        self.assertEqual(200, self.post_json('/words/confidence/1', {'new': 3}).status_code)
+        self.assert_successful_json(self.post_json('/words/reviews/batch/', [
+            {'id': 2, 'new': 4, 'timestamp': '2030-01-01T00:00:00Z'}]))
+        self.assert_successful_json(self.post_json('/words/review/3', {'grade': 4}))
+        word_map = self.assert_successful_json(self.client.get('/words/words/4/'))
+        self.assert_successful_json(self.put_json('/words/words/4/', dict(word_map, notes='x')))
+        self.assert_successful_json(self.put_json('/words/words/4/', dict(word_map, confidence=-2)))
+        events = models.ReviewEvent.objects.order_by('id').values_list('word', 'kind', 'value', 'previous')
+        self.assertEqual([(1, models.ReviewEvent.CONFIDENCE, 3, 10), (2, models.ReviewEvent.CONFIDENCE, 4, 0),
+                          (3, models.ReviewEvent.REVIEW, 4, None), (4, models.ReviewEvent.CONFIDENCE, -2, 0)],
+                         list(events))
+
+        self.assertEqual([], self.review_days())
+        call_command('rollup_reviews', stdout=io.StringIO())
+        self.assertEqual([{'day': timezone.now().date().isoformat(), 'events': 4, 'words': 4,
+                           'increases': 1, 'decreases': 2, 'reviews': 1}], self.review_days())
+        self.assertEqual(400, self.client.get('/words/reviews/days/', {'days': 0}).status_code)
+        self.assertEqual(400, self.client.get('/words/reviews/days/', {'days': 'x'}).status_code)
+
+    def test_rollup(self):
+        now = timezone.now()
+        for days_ago in [10, 10, 3]:
+            time = now - timedelta(days=days_ago)
+            models.log_review_events(models.ReviewEvent.CONFIDENCE, [(1, 1, 1, 2, time), (2, 5, 1, 0, time)])
+        self.assertEqual(4, history.rollup_reviews())
+        self.assertEqual([(2, 0, 2), (1, 0, 1)],
+                         [(d['events'], d['increases'], d['decreases']) for d in self.review_days()])
+        self.assertEqual([], self.review_days(days=2))
+        self.assertEqual(0, history.rollup_reviews())
+
+        # Only the days of new events are recomputed, so old events are not read again, and
+        # changes made offline count on the day they were made rather than when they were synced
+        models.ReviewEvent.objects.filter(time__lt=(now - timedelta(days=5)).timestamp()).delete()
+        models.log_review_events(models.ReviewEvent.REVIEW, [(1, 1, 5, None, None)])
+        self.assert_successful_json(self.post_json('/words/reviews/batch/', [
+            {'id': 2, 'new': 4, 'timestamp': (now - timedelta(days=3)).isoformat()}]))
+        self.assertEqual(2, history.rollup_reviews())
+        self.assertEqual([(2, 0, 0), (2, 1, 0), (1, 0, 1)],
+                         [(d['events'], d['increases'], d['reviews']) for d in self.review_days()])
+
+    def test_rollup_late_commit(self):
+        """Events committed after events with higher IDs have been rolled up should still count"""
+        time = int(timezone.now().timestamp())
+        models.ReviewEvent.objects.create(id=1000, user_id=1, word_id=1, kind=models.ReviewEvent.REVIEW,
+                                          value=5, time=time)
+        self.assertEqual(1, history.rollup_reviews())
+        models.ReviewEvent.objects.create(id=500, user_id=1, word_id=2, kind=models.ReviewEvent.REVIEW,
+                                          value=5, time=time)
+        self.assertEqual(1, history.rollup_reviews())
+        self.assertEqual([(2, 2)], [(d['events'], d['words']) for d in self.review_days()])
+
+    def test_rollup_after_2038(self):
+        time = timezone.now().replace(year=2040)
+        models.log_review_events(models.ReviewEvent.REVIEW, [(1, 1, 5, None, time)])
+        self.assertEqual(1, history.rollup_reviews())
+        self.assertEqual([(1, 1)], [(d['events'], d['reviews'])
+                                    for d in history.review_days(1, 1, today=time.date())])
+
+    def test_tag_confidence(self):
+        url = '/words/reviews/tags/'
+        self.assertEqual([], self.assert_successful_json(self.client.get(url)))
+        call_command('rollup_reviews', stdout=io.StringIO())
+        with CaptureQueriesContext(connection) as context:
+            result = self.assert_successful_json(self.client.get(url))
+        # The session, the user and the rollup
+        self.assertEqual(3, len(context.captured_queries))
+        awesome = models.Word.objects.filter(user=1, tags__tag='awesome')
+        self.assertEqual('awesome', result[0]['tag'])
+        self.assertEqual(sorted([w.confidence for w in awesome]), [c['confidence'] for c in result[0]['confidence']])
+        self.assertEqual(len(awesome), sum([c['count'] for c in result[0]['confidence']]))
+        self.assertEqual(sorted(set(models.Tag.objects.filter(word__user=1).values_list('tag', flat=True))),
+                         [t['tag'] for t in result])
+
+    def test_rollup_many_days(self):
+        models.ReviewEvent.objects.bulk_create([
+            models.ReviewEvent(user_id=1, word_id=1, kind=models.ReviewEvent.REVIEW, value=5,
+                               time=day * history.SECONDS_PER_DAY) for day in range(1500)])
+        self.assertEqual(1500, history.rollup_reviews())
+        self.assertEqual(1500, models.ReviewDay.objects.filter(user=1, events=1).count())
+
+class StatsTest(LoggedInJsonTest):
+    """Test vocabulary statistics"""
+    def test_stats(self):
+        with CaptureQueriesContext(connection) as context:
+            result = self.assert_successful_json(self.client.get('/words/stats/'))
+        self.assertEqual(4, result['words'])
+        self.assertEqual(4, sum([c['count'] for c in result['confidence']]))
+        self.assertEqual(sorted([c['confidence'] for c in result['confidence']]),
+                         [c['confidence'] for c in result['confidence']])
+        self.assertEqual([{'tag': 'awesome', 'count': 2}], result['tags'][:1])
+        self.assertEqual(['2014-06-09', '2014-06-30', '2014-07-21'], [w['week'] for w in result['added_per_week']])
+        self.assertEqual([2, 1, 1], [w['count'] for w in result['added_per_week']])
+        # The session, the user, the cache version and three histograms
+        self.assertEqual(5, len(context.captured_queries))
+
+        # Cached until the words change
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(result, self.assert_successful_json(self.client.get('/words/stats/')))
+        self.assertEqual(2, len(context.captured_queries))
+        self.assertEqual(200, self.post_json('/words/confidence/1', {'new': 77}).status_code)
+        result = self.assert_successful_json(self.client.get('/words/stats/'))
+        self.assertIn({'confidence': 77, 'count': 1}, result['confidence'])
+
+    def test_command(self):
+        output = io.StringIO()
+        call_command('vocabulary_stats', stdout=output)
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([('dummy', 1), (USER, 4)], [(line['user'], line['words']) for line in lines])
+        self.assertEqual([{'tag': 'awesome3', 'count': 1}, {'tag': 'cool', 'count': 1}], lines[0]['tags'])
+        output = io.StringIO()
+        call_command('vocabulary_stats', 'dummy', stdout=output)
+        self.assertEqual(1, len(output.getvalue().splitlines()))
+        self.assertEqual(stats.user_stats(2), {k: v for (k, v) in lines[0].items() if k != 'user'})
+        with self.assertRaises(CommandError):
+            call_command('vocabulary_stats', 'nobody')
+
+class GraphTest(LoggedInJsonTest):
+    """Test the related words graph"""
+    def setUp(self):
+        super().setUp()
+        # 1 - 2 - 3 - 4, plus 1 - 3
+        for (from_id, to_id) in [(1, 2), (2, 3), (3, 4), (1, 3)]:
+            models.Word.objects.get(pk=from_id).related_words.add(to_id)
+
+    def graph(self, word_id, depth):
+        return self.assert_successful_json(self.client.get('/words/words/{0}/graph/'.format(word_id),
+                                                           {'depth': depth}))
+
+    def test_graph(self):
+        result = self.graph(1, 0)
+        self.assertEqual([(1, 0)], [(n['id'], n['depth']) for n in result['nodes']])
+        self.assertEqual([], result['edges'])
+        with CaptureQueriesContext(connection) as context:
+            result = self.graph(1, 1)
+        # Session, user, the word, one level of links, links within the last level, and the words
+        self.assertEqual(6, len(context.captured_queries))
+        self.assertEqual([(1, 0), (2, 1), (3, 1)], [(n['id'], n['depth']) for n in result['nodes']])
+        self.assertEqual([[1, 2], [1, 3], [2, 3]], result['edges'])
+        self.assertEqual({'id': 3, 'word': '乌龙球', 'pinyin': 'wu1long2qiu2', 'pinyin_marks': 'wūlóngqiú',
+                          'depth': 1}, result['nodes'][2])
+        result = self.graph(4, 5)
+        self.assertEqual([(4, 0), (3, 1), (1, 2), (2, 2)], [(n['id'], n['depth']) for n in result['nodes']])
+        self.assertEqual([[1, 2], [1, 3], [2, 3], [3, 4]], result['edges'])
+        self.assertFalse(result['truncated'])
+
+        result = graph.related_graph(models.Word.objects.get(pk=4), 2, max_nodes=3)
+        self.assertEqual([4, 3, 1], [n['id'] for n in result['nodes']])
+        self.assertEqual([(1, 3), (3, 4)], result['edges'])
+        self.assertTrue(result['truncated'])
+
+        for depth in [-1, 6, 'x']:
+            self.assertEqual(400, self.client.get('/words/words/1/graph/', {'depth': depth}).status_code)
+        self.assertEqual(404, self.client.get('/words/words/5/graph/').status_code)
+
+class ProfilingTest(LoggedInJsonTest):
+    """Test the per-request profiling middleware"""
+    def profiled_client(self):
+        """New test client, so that the middleware is loaded with the current settings"""
+        client = Client()
+        self.assertTrue(client.login(username=USER, password=PASSWORD))
+        return client
+
+    def test_profiling(self):
+        expected = self.client.get('/words/words/')
+        self.assertFalse(expected.has_header('Server-Timing'))
+        django_cache.clear()
+        with self.settings(WORDS_PROFILING=True):
+            client = self.profiled_client()
+            with self.assertLogs('words.profiling', 'INFO') as logs:
+                response = client.get('/words/words/')
+        self.assertEqual(expected.content, response.content)
+        self.assertRegex(response['Server-Timing'],
+                         r'^db;dur=[0-9.]+;desc="[0-9]+ queries", serializer;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertEqual(1, len(logs.records))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(['GET', '/words/words/', 200, len(response.content), []],
+                         [record[k] for k in ['method', 'path', 'status', 'size', 'repeated']])
+        self.assertGreater(record['queries'], 0)
+        self.assertGreaterEqual(record['total_ms'], record['serializer_ms'])
+
+    def test_repeated_queries(self):
+        with self.settings(WORDS_PROFILING=True, WORDS_PROFILING_REPEAT_THRESHOLD=0):
+            client = self.profiled_client()
+            with self.assertLogs('words.profiling', 'INFO') as logs:
+                client.get('/words/words/1/')
+        self.assertEqual(['INFO', 'WARNING'], [r.levelname for r in logs.records])
+        self.assertIn('Possible N+1 queries in GET /words/words/1/', logs.records[1].getMessage())
+        self.assertTrue(json.loads(logs.records[0].getMessage())['repeated'])
+
+class BenchmarkTest(TestCase):
+    """Test the synthetic data and API benchmarks"""
+    def test_seed_words(self):
+        users = benchmarks.seed_words(2, 20, tags_per_user=5)
+        words = models.Word.objects.filter(user__in=users)
+        self.assertEqual(40, words.count())
+        self.assertTrue(models.ExampleSentence.objects.filter(definition__word__in=words).exists())
+        self.assertTrue(all([w.pinyin_plain for w in words]))
+        related = set(models.Word.related_words.through.objects.values_list('from_word__user', 'to_word__user',
+                                                                             'from_word', 'to_word'))
+        self.assertTrue(related)
+        for (from_user, to_user, from_word, to_word) in related:
+            self.assertEqual(from_user, to_user)
+            self.assertIn((to_user, from_user, to_word, from_word), related)
+
+    def test_benchmark_api(self):
+        output = io.StringIO()
+        call_command('benchmark_api', users=1, words=20, repeat=3, scenario=['list', 'save', 'search'],
+                     stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(['list', 'save', 'search'], [line.split()[0] for line in lines[-3:]])
+        self.assertFalse(models.Word.objects.filter(user__username__startswith='bench').exists())
+
+
 class AuthorizationTest(LoggedInJsonTest):
     """
     Check that users cannot read or manipulate entities which don't belong to them
@@ -544,6 +1610,110 @@ class MiscUnitTests(unittest.TestCase):
         expected_results = {'a': 1, 'b': 2, 'c': 3, 'd': 4}
         self.assertEqual(expected_results, results)
 
+    def test_search_terms(self):
+        self.assertEqual(set(['don', 'score', 'own', 'goal']), search.english_terms("Don't score an own goal!"))
+        self.assertEqual(set([(models.SearchTerm.DEFINITION, 'hello'), (models.SearchTerm.TRANSLATION, 'hello'),
+                              (models.SearchTerm.TRANSLATION, 'world')]),
+                         search.word_terms(['Hello!'], ['Hello, world']))
+
+    def test_pinyin_marks(self):
+        """Test conversion to tone marks, as for the pinyin filter in pinyin.js"""
+        self.assertEqual('nǐhǎo', pinyin.to_marks('ni3hao3'))
+        self.assertEqual('bǎobèi', pinyin.to_marks('bao3bei4'))
+        self.assertEqual('Shùaigē', pinyin.to_marks('Shuai4ge1'))
+        self.assertEqual('CHŪINIÚ', pinyin.to_marks('CHUI1NIU2'))
+        self.assertEqual('měinǚ', pinyin.to_marks('mei3nv3'))
+        self.assertEqual('MĚINǙ', pinyin.to_marks('MEI3NV3'))
+        self.assertEqual('nǐhǎo bǎobèi!', pinyin.to_marks('ni3hao3 bao3bei4!'))
+        self.assertEqual('nz3hǎo', pinyin.to_marks('nz3hao3'))
+        self.assertEqual('nǐhao5', pinyin.to_marks('ni3hao5'))
+        self.assertEqual('', pinyin.to_marks(''))
+
+    def test_pinyin_plain(self):
+        for text in ['ni3hao3', 'Nǐ hǎo', 'NI HAO', 'nǐ-hǎo']:
+            self.assertEqual('nihao', pinyin.to_plain(text))
+        self.assertEqual('lv', pinyin.to_plain('lǜ'))
+        self.assertEqual('lv', pinyin.to_plain('lu:4'))
+        self.assertEqual('meinv', pinyin.to_plain(pinyin.to_marks('mei3nv3')))
+
+    def test_percentile(self):
+        self.assertEqual(5, benchmarks.percentile(range(1, 11), 0.5))
+        self.assertEqual(10, benchmarks.percentile(range(10, 0, -1), 0.99))
+        self.assertEqual(7, benchmarks.percentile([7], 0.5))
+
+    def test_sql_shape(self):
+        self.assertEqual('SELECT "id" FROM "t" WHERE "id" IN (...) AND "x" = %s',
+                         profiling.sql_shape('SELECT "id" FROM "t"\n WHERE "id" IN (%s, %s,%s) AND "x" = %s'))
+        profile = profiling.RequestProfile()
+        for sql in ['SELECT 1', 'SELECT %s IN (%s)', 'SELECT %s IN (%s, %s)']:
+            profile(lambda *args: None, sql, [], False, {})
+        self.assertEqual(3, profile.queries)
+        self.assertEqual([('SELECT %s IN (...)', 2)], profile.repeated(1))
+
+    def test_schedule(self):
+        schedule = scheduling.schedule(0, 0, 2.5, 5)
+        self.assertEqual((1, 1), schedule[:2])
+        self.assertAlmostEqual(2.6, schedule.ease)
+        schedule = scheduling.schedule(*schedule, 3)
+        self.assertEqual((2, 6), schedule[:2])
+        self.assertAlmostEqual(2.46, schedule.ease)
+        schedule = scheduling.schedule(*schedule, 4)
+        self.assertEqual(3, schedule.repetitions)
+        self.assertAlmostEqual(6 * 2.46, schedule.interval)
+        self.assertEqual((0, 1, 1.3), scheduling.schedule(5, 30, 1.3, 0))
+        with self.assertRaises(ValueError):
+            scheduling.schedule(0, 0, 2.5, -1)
+
+    def test_prefix_index(self):
+        index = suggest.PrefixIndex([(1, '你好', 'ni3hao3', 'nihao'), (2, '你', 'ni3', 'ni'), (3, '女', 'nv3', 'nv')])
+        self.assertEqual([2, 1, 3], index.complete('n'))
+        self.assertEqual([2, 1], index.complete('你'))
+        self.assertEqual([2], index.complete('你', limit=1))
+        index.update(2, '您', 'nin2', 'nin')
+        index.update(4, '哪', 'na3', 'na')
+        self.assertEqual([4, 1, 2, 3], index.complete('n'))
+        self.assertEqual([1], index.complete('你'))
+        self.assertEqual({'id': 2, 'word': '您', 'pinyin': 'nin2'}, index.suggestion(2))
+
+    def test_sample_by_weight(self):
+        """Test drawing several weighted choices at once"""
+        choices = [('a', 1), ('b', 2), ('c', 0), ('d', 4)]
+        self.assertEqual(10, len(views.sample_by_weight(choices, 10)))
+        self.assertFalse('c' in views.sample_by_weight(choices, 10))
+        distinct = views.sample_by_weight(choices, 10, replace=False)
+        self.assertEqual(['a', 'b', 'd'], sorted(distinct))
+        self.assertEqual(2, len(set(views.sample_by_weight(choices, 2, replace=False))))
+        self.assertEqual([], views.sample_by_weight([], 3))
+        with self.assertRaises(ArithmeticError):
+            views.sample_by_weight([('a', -1)], 1)
+
+    def test_weighted_index(self):
+        """
+        Test that the flashcard index weights things like weights_for_words, and keeps
+        doing so after confidence changes
+        """
+        class Random:
+            """Deterministic source of 'randomness' to control the test"""
+            def __init__(self, answer):
+                self.answer = answer
+            def uniform(self, a, b):
+                return min(max(self.answer, a), b)
+
+        def draw_counts(index, step):
+            """Draw once from the middle of each interval of the given width"""
+            results = {}
+            for i in range(int(index.tree.total() / step)):
+                choice = index.choose(Random((i + 0.5) * step))
+                results[choice] = results.get(choice, 0) + 1
+            return results
+
+        index = sampling.WeightedIndex([('a', 2), ('b', 1), ('c', 0), ('d', 0)], 2.0)
+        self.assertEqual({'a': 1, 'b': 2, 'c': 4, 'd': 4}, draw_counts(index, 1))
+        self.assertTrue(index.update('c', 3))
+        self.assertFalse(index.update('e', 3))
+        # Confidences are now 2, 1, 3, 0 so relative weights are 2, 4, 1, 8
+        self.assertEqual({'a': 2, 'b': 4, 'c': 1, 'd': 8}, draw_counts(index, 0.5))
+
     def test_flashcard_weights(self):
         """
         Test flashcard weight generator for words
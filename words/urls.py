@@ -10,9 +10,19 @@ router.register(r'commontags', views.CommonTagsViewSet, basename=models.Tag._met
 urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^flashcard/$', views.flashcard_word),
+    url(r'^flashcard/batch/$', views.flashcard_batch),
+    url(r'^flashcard/batch/({0})'.format(models.TAG_REGEX), views.flashcard_batch),
     url(r'^flashcard/({0})'.format(models.TAG_REGEX), views.flashcard_word),
     url(r'^wordsbytag/({0})'.format(models.TAG_REGEX), views.words_by_tag),
     url(r'^confidence/([0-9]+)', views.confidence),
+    url(r'^review/([0-9]+)', views.review),
+    url(r'^reviews/batch/$', views.confidence_batch),
+    url(r'^reviews/days/$', views.review_days),
+    url(r'^reviews/tags/$', views.tag_confidence),
+    url(r'^stats/$', views.word_stats),
     url(r'^searchexact/(.+)', views.search_exact),
-    url(r'^search/(.+)', views.search_exact),
+    url(r'^search/(.+)', views.search_words),
+    url(r'^suggest/$', views.suggest_words),
+    url(r'^import/$', views.import_words),
+    url(r'^export/$', views.export_words),
 ]
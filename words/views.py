@@ -1,27 +1,68 @@
+import base64
+import binascii
+from datetime import datetime
+import functools
+import hashlib
+import heapq
+import json
+import operator
 import random
 
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, InvalidPage
+from django.db import models, transaction
+from django.db.models import F, Max, Q
 from django.db.models.aggregates import Count
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
 
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.templatetags.rest_framework import replace_query_param
 
-from words.models import Word, Tag
-from .serializers import WordSerializer, TagSerializer
+from words.models import ReviewEvent, ReviewState, Word, Tag, TagUsage, log_review_events
+from . import bulk, cache, graph, history, sampling, scheduling, search, stats, suggest
+from .serializers import WordSerializer, TagCountSerializer, TagSerializer
+
+class TagPagination(PageNumberPagination):
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Unpaginated unless asked, as the tag picker usually wants all of a user's tags
+        if not any(p in request.query_params for p in [self.page_query_param, self.page_size_query_param]):
+            return None
+        return super().paginate_queryset(queryset, request, view)
 
 class TagsViewSet(viewsets.ReadOnlyModelViewSet):
-    """Tags are only updated via words, so this is a read-only view set"""
+    """
+    Tags are only updated via words, so this is a read-only view set.
+
+    Each tag comes with the number of the user's words which have it. The list can be
+    filtered with prefix=, and is paginated if page= or page_size= is given.
+    """
     model = Tag
-    serializer_class = TagSerializer
+    serializer_class = TagCountSerializer
+    pagination_class = TagPagination
 
     def get_queryset(self):
         # Only return tags which the user has actually used
-        return list(set(Tag.objects.filter(word__user=self.request.user.id)))
+        tags = Tag.objects.filter(tagusage__user=self.request.user.id, tagusage__count__gt=0)
+        prefix = self.request.query_params.get('prefix', '').strip().lower()
+        if prefix:
+            tags = tags.filter(tag__startswith=prefix)
+        return tags.annotate(count=F('tagusage__count')).order_by('tag')
+
+    def list(self, request, *args, **kwargs):
+        list_tags = super().list
+        return conditional_response(request, Word.objects.filter(user=request.user.id), lambda etag: Response(
+            cache.get_or_set(request.user.id, 'tags:' + etag, lambda: list_tags(request, *args, **kwargs).data)))
 
 class CommonTagsViewSet(viewsets.ReadOnlyModelViewSet):
     """View set for the most common tags"""
@@ -29,12 +70,45 @@ class CommonTagsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = TagSerializer
 
     def get_queryset(self):
-        words = Word.objects.filter(user=self.request.user.id)
-        aggregate = words.values('tags').annotate(Count('id')).order_by('-id__count')
-        common_tag_ids = [t['tags'] for t in aggregate if t['tags']][:5]
-        common_tags = Tag.objects.in_bulk(common_tag_ids)
-        return [common_tags[id] for id in common_tag_ids]
+        usage = TagUsage.objects.filter(user=self.request.user.id, count__gt=0)
+        return [u.tag for u in usage.select_related('tag').order_by('-count', 'tag_id')[:5]]
 
+    def list(self, request, *args, **kwargs):
+        list_tags = super().list
+        return conditional_response(request, Word.objects.filter(user=request.user.id), lambda etag: Response(
+            cache.get_or_set(request.user.id, 'commontags:' + etag,
+                             lambda: list(list_tags(request, *args, **kwargs).data))))
+
+
+def conditional_response(request, words, make_response):
+    """
+    Respond to a GET request for data derived from a set of words, using the latest
+    modification time and the number of the words to make validators (ETag and Last-Modified).
+    If the client already has the current version, make_response is not called at all,
+    and it gets an empty 304 response instead.
+
+    Otherwise make_response is called with the ETag, which should be part of the cache key
+    of any cached data in the response: each process has its own cache when using a local
+    memory backend, so the cache may not have seen changes made through other processes,
+    but the ETag comes from the database and so always has.
+    """
+    state = words.order_by().aggregate(last_modified=Max('last_modified'), count=Count('id', distinct=True))
+    latest = state['last_modified']
+    # The same URL gives different data for different users and formats
+    version = [request.user.id, request.build_absolute_uri(), request.accepted_renderer.format,
+               latest.isoformat() if latest else None, state['count']]
+    etag = quote_etag(hashlib.sha1(json.dumps(version).encode('utf-8')).hexdigest())
+    last_modified = int(latest.timestamp()) if latest else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = make_response(etag)
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Browsers must check back every time rather than assuming the data is still fresh
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 def load_words(request, tag_name, ordering=None):
     """Retrieve matching words for a particular HTTP request"""
@@ -67,7 +141,10 @@ def _get_ordering(request):
     # Reverse orderings
     if ordering_text in ["date_added", "last_modified"]:
         return ["-{0}".format(ordering_text)]
-    if ordering_text in ["word", "pinyin", "confidence"]:
+    # Pinyin is sorted alphabetically ignoring tones and case, and then by tone
+    if ordering_text == "pinyin":
+        return ["pinyin_plain", "pinyin"]
+    if ordering_text in ["word", "confidence"]:
         return [ordering_text]
     raise ValueError("Unsupported ordering '{0}'".format(ordering_text))
 
@@ -90,16 +167,117 @@ def paginate_words(words, request):
         response['next'] = replace_query_param(request_url, 'page', page.next_page_number())
     return Response(response)
 
-def words_response(request, tag_name=None):
-    """Generate response to a given request for words."""
+def _keyset_ordering(ordering):
+    """Add a final tie-break on ID to an ordering, in the same direction as its first field"""
+    return ordering + ["-id" if ordering[0].startswith("-") else "id"]
+
+def _reverse_ordering(ordering):
+    """Reverse the direction of every field in an ordering"""
+    return [f[1:] if f.startswith("-") else "-{0}".format(f) for f in ordering]
+
+def _encode_cursor(word, ordering, backwards):
+    """Make an opaque cursor pointing at a word's position in an ordering"""
+    values = [getattr(word, f.lstrip("-")) for f in ordering]
+    # Keep full precision for timestamps, or words could be skipped or repeated
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    cursor_json = json.dumps({'v': values, 'b': backwards})
+    return base64.urlsafe_b64encode(cursor_json.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor, ordering):
+    """
+    Decode a cursor made by _encode_cursor for the same ordering.
+    Return the list of field values and whether the cursor is for paging backwards.
+    """
     try:
+        cursor_map = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        values = cursor_map['v']
+        backwards = bool(cursor_map['b'])
+    except (binascii.Error, UnicodeError, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor '{0}'".format(cursor))
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError("Invalid cursor '{0}'".format(cursor))
+    for (i, field) in enumerate(ordering):
+        model_field = Word._meta.get_field(field.lstrip("-"))
+        if isinstance(model_field, models.DateTimeField):
+            values[i] = parse_datetime(values[i]) if isinstance(values[i], str) else None
+            valid = values[i] is not None
+        elif isinstance(model_field, (models.AutoField, models.IntegerField)):
+            valid = isinstance(values[i], int) and not isinstance(values[i], bool)
+        else:
+            valid = isinstance(values[i], str)
+        if not valid:
+            raise ValueError("Invalid cursor '{0}'".format(cursor))
+    return (values, backwards)
+
+def _keyset_filter(ordering, values):
+    """
+    Build a filter for the words strictly after a position in an ordering, where
+    the position is given by the values of each of the ordering's fields.
+    """
+    alternatives = []
+    equal_so_far = Q()
+    for (field, value) in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "{0}__{1}".format(name, "lt" if field.startswith("-") else "gt")
+        alternatives.append(equal_so_far & Q(**{lookup: value}))
+        equal_so_far &= Q(**{name: value})
+    return functools.reduce(operator.or_, alternatives)
+
+def paginate_words_by_cursor(words, ordering, request):
+    """
+    Generate paginated output from a word query set using opaque cursors rather than page
+    numbers, so that each page is found through the ordering's index instead of by
+    skipping over all the previous pages.
+
+    The total count is only calculated if count=true is given.
+    """
+    page_size = _get_page_size(request)
+    ordering = _keyset_ordering(ordering)
+    cursor = request.query_params.get('cursor', None)
+    (values, backwards) = _decode_cursor(cursor, ordering) if cursor else (None, False)
+    query_ordering = _reverse_ordering(ordering) if backwards else ordering
+    paged_words = words.filter(_keyset_filter(query_ordering, values)) if cursor else words
+    page = list(paged_words.order_by(*query_ordering)[:page_size + 1])
+    has_more = len(page) > page_size
+    page = page[:page_size]
+    if backwards:
+        page.reverse()
+
+    serializer = WordSerializer()
+    response = {'results': serializer.serialize_many(page)}
+    if request.query_params.get('count', 'false').lower() in ['true', '1']:
+        response['count'] = words.count()
+    request_url = request.build_absolute_uri()
+    if page and (has_more if backwards else cursor):
+        response['previous'] = replace_query_param(request_url, 'cursor',
+                                                   _encode_cursor(page[0], ordering, True))
+    if page and (cursor if backwards else has_more):
+        response['next'] = replace_query_param(request_url, 'cursor',
+                                               _encode_cursor(page[-1], ordering, False))
+    return Response(response)
+
+def words_response(request, tag_name=None):
+    """
+    Generate response to a given request for words.
+    Requests with a cursor parameter (which may be empty for the first page) get cursor-based
+    pagination; otherwise pages are numbered.
+    """
+    def page():
         ordering = _get_ordering(request)
-        words = load_words(request, tag_name, ordering)
-        return paginate_words(words, request)
-    except ValueError as e:
-        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-    except InvalidPage as e:
-        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if 'cursor' in request.query_params:
+            return paginate_words_by_cursor(load_words(request, tag_name), ordering, request).data
+        return paginate_words(load_words(request, tag_name, ordering), request).data
+
+    def respond(etag):
+        try:
+            return Response(cache.get_or_set(request.user.id, 'words:' + etag, page))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except InvalidPage as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Pages include related words, which need not have the same tag, so use all the user's words
+    return conditional_response(request, Word.objects.filter(user=request.user.id), respond)
 
 
 class WordsViewSet(viewsets.ViewSet):
@@ -117,7 +295,9 @@ class WordsViewSet(viewsets.ViewSet):
     def retrieve(self, request, pk=None):
         word = get_object_or_404(Word, pk=pk, user=request.user.id)
         serializer = WordSerializer()
-        return Response(serializer.serialize(word))
+        # Relating two words only updates one of them, so check the related words as well
+        words = Word.objects.filter(Q(pk=word.id) | Q(related_words=word.id), user=request.user.id)
+        return conditional_response(request, words, lambda etag: Response(serializer.serialize_many([word])[0]))
 
     def create(self, request):
         serializer = WordSerializer()
@@ -125,7 +305,7 @@ class WordsViewSet(viewsets.ViewSet):
             word = serializer.deserialize_and_update(request.data, request.user.id)
         except ValidationError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.serialize(word))
+        return Response(serializer.serialize_many([word])[0])
 
     def update(self, request, pk=None):
         serializer = WordSerializer()
@@ -133,7 +313,17 @@ class WordsViewSet(viewsets.ViewSet):
             word = serializer.deserialize_and_update(request.data, request.user.id, pk)
         except ValidationError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        return Response(serializer.serialize(word))
+        return Response(serializer.serialize_many([word])[0])
+
+    @action(detail=True)
+    def graph(self, request, pk=None):
+        """Words related to this one, and related to those and so on, up to ?depth=N links away"""
+        word = get_object_or_404(Word, pk=pk, user=request.user.id)
+        try:
+            result = graph.related_graph(word, int(request.query_params.get('depth', 1)))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
     def destroy(self, request, pk=None):
         #TODO
@@ -163,6 +353,28 @@ def random_choice_by_weight(choices, r=random):
             return choice
     raise ArithmeticError("Weight selection algorithm failed")
 
+def sample_by_weight(choices, n, replace=True, r=random):
+    """
+    Given a list of 2-tuples (choice, weight), return a list of n random choices, each
+    weighted in the same way as random_choice_by_weight.
+
+    With replacement, every choice is an independent draw. Without replacement, the
+    choices are distinct, and the result is shorter than n if there are not enough of them.
+    Either way, all the choices are made in a single pass over the list.
+
+    The optional argument r is to allow deterministic tests to be written.
+    """
+    if [w for (_, w) in choices if w < 0]:
+        raise ArithmeticError("Negative weights are not allowed!")
+    if not choices:
+        return []
+    if replace:
+        return r.choices([c for (c, _) in choices], weights=[w for (_, w) in choices], k=n)
+    # Weighted sampling without replacement (Efraimidis & Spirakis): give each choice the
+    # key u^(1/w) for u uniform on (0, 1], and keep the n largest keys.
+    keyed = [(pow(1.0 - r.random(), 1.0 / weight), i) for (i, (_, weight)) in enumerate(choices) if weight > 0]
+    return [choices[i][0] for (_, i) in heapq.nlargest(n, keyed)]
+
 WEIGHT_DECAY = 2.0
 
 def weights_for_words(words):
@@ -176,16 +388,105 @@ def weights_for_words(words):
     weights = [pow(WEIGHT_DECAY, log_shift - c) for c in confidences]
     return weights
 
+def choose_word_in_database(words, r=random):
+    """
+    Choose a random word from a query set with the same probabilities as weights_for_words,
+    letting the database do the work so that only the chosen word is loaded.
+
+    Words with the same confidence have the same weight, so the database groups the words
+    by confidence; one of these groups is chosen according to its total weight, and then
+    the database picks a word from within that group uniformly at random.
+    Returns None if there are no words to choose from.
+
+    Words deleted between counting and picking can leave the offset past the end of its
+    group, in which case the choice is made again with fresh counts.
+    """
+    for _ in range(2):
+        counts = list(words.order_by().values_list('confidence').annotate(Count('id')))
+        if not counts:
+            return None
+        max_confidence = max([c for (c, _) in counts])
+        choices = [((c, n), n * pow(WEIGHT_DECAY, max_confidence - c)) for (c, n) in counts]
+        (confidence, count) = random_choice_by_weight(choices, r)
+        offset = r.randrange(count)
+        chosen = list(words.filter(confidence=confidence).order_by('id')[offset:offset + 1])
+        if chosen:
+            return chosen[0]
+    return None
+
+FLASHCARD_MODES = ["index", "database", "due"]
+
+def _get_flashcard_mode(request):
+    """Get flashcard selection mode from an HTTP request, and apply some validations"""
+    mode = request.query_params.get('mode', FLASHCARD_MODES[0]).lower()
+    if mode not in FLASHCARD_MODES:
+        raise ValueError("Unsupported flashcard mode '{0}'".format(mode))
+    return mode
+
 @api_view(['GET'])
 def flashcard_word(request, tag_name=None):
     """View function to load random word for flashcard purposes"""
+    try:
+        mode = _get_flashcard_mode(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     words = load_words(request, tag_name)
+    if mode == "database":
+        word = choose_word_in_database(words)
+    elif mode == "due":
+        due = scheduling.due_words(request.user.id, tag_name)
+        word = due[0] if due else None
+    else:
+        word = sampling.choose_word(words, request.user.id, tag_name, WEIGHT_DECAY)
+    if word is None:
+        raise Http404
+    serializer = WordSerializer()
+    return Response(serializer.serialize_many([word])[0])
+
+MAX_FLASHCARD_BATCH = 200
+
+def _get_batch_size(request):
+    """Get number of flashcards to draw from an HTTP request, and apply some validations"""
+    batch_size = int(request.query_params.get('n', 20))
+    if batch_size > MAX_FLASHCARD_BATCH:
+        raise ValueError("{0} is above max batch size".format(batch_size))
+    if batch_size <= 0:
+        raise ValueError("Batch size must be positive, found {0}".format(batch_size))
+    return batch_size
+
+@api_view(['GET'])
+def flashcard_batch(request, tag_name=None):
+    """
+    View function to load a deck of random words for flashcard purposes in one go.
+
+    By default each card is drawn independently, exactly as with flashcard_word; pass
+    replace=false to get distinct words instead, or mode=due for the words due for review
+    soonest, in due order.
+    """
+    try:
+        batch_size = _get_batch_size(request)
+        mode = _get_flashcard_mode(request)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = WordSerializer()
+    if mode == "due":
+        due = scheduling.due_words(request.user.id, tag_name, batch_size)
+        if not due:
+            raise Http404
+        return Response(serializer.serialize_many(due))
+    replace = request.query_params.get('replace', 'true').lower() not in ['false', '0']
+    words = list(load_words(request, tag_name).only('id', 'confidence'))
     if not words:
         raise Http404
     weights = weights_for_words(words)
-    word = random_choice_by_weight(list(zip(words, weights)))
-    serializer = WordSerializer()
-    return Response(serializer.serialize(word))
+    chosen_ids = sample_by_weight([(w.id, weight) for (w, weight) in zip(words, weights)],
+                                  batch_size, replace)
+    serialized = {w['id']: w for w in serializer.serialize_many(Word.objects.filter(pk__in=set(chosen_ids)))}
+    # Words deleted since they were drawn are left out
+    cards = [serialized[word_id] for word_id in chosen_ids if word_id in serialized]
+    if not cards:
+        raise Http404
+    return Response(cards)
 
 @api_view(['POST'])
 def confidence(request, word_id):
@@ -198,17 +499,196 @@ def confidence(request, word_id):
     if isinstance(new_confidence, str) and not new_confidence.isdigit():
         return Response({"error": "New confidence value must be a number, not '{0}'".format(new_confidence)},
                         status=status.HTTP_400_BAD_REQUEST)
+    previous = word.confidence
     word.confidence = int(new_confidence)
+    word.confidence_changed_at = timezone.now()
     try:
         word.full_clean()
     except ValidationError as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-    word.save()
+    word.save(update_fields=['confidence', 'confidence_changed_at', 'last_modified'])
+    log_review_events(ReviewEvent.CONFIDENCE, [(word.user_id, word.id, word.confidence, previous, None)])
+    sampling.word_updated(word)
+    cache.invalidate_user(word.user_id)
+    suggest.words_updated(word.user_id, [word])
     return Response({"new": word.confidence})
 
+MAX_REVIEW_BATCH = 1000
+
+def _parse_confidence_events(data):
+    """
+    Validate a list of {"id", "new", "timestamp"} confidence change events, returning a map
+    from word ID to its latest (timestamp, new confidence), or raising ValueError
+    """
+    if not isinstance(data, list):
+        raise ValueError("Must supply a list of confidence changes")
+    if len(data) > MAX_REVIEW_BATCH:
+        raise ValueError("{0} changes is above the maximum of {1}".format(len(data), MAX_REVIEW_BATCH))
+    now = timezone.now()
+    latest = {}
+    for event in data:
+        if not isinstance(event, dict) or any(k not in event for k in ['id', 'new', 'timestamp']):
+            raise ValueError("Each change must specify 'id', 'new' and 'timestamp'")
+        if isinstance(event['new'], bool) or not isinstance(event['new'], int):
+            raise ValueError("New confidence value must be a number, not '{0}'".format(event['new']))
+        timestamp = parse_datetime(str(event['timestamp']))
+        if timestamp is None or timezone.is_naive(timestamp):
+            raise ValueError("Timestamp must be an ISO 8601 date and time with a time zone, not '{0}'"
+                             .format(event['timestamp']))
+        # A client whose clock is ahead must not be able to lock out later changes
+        timestamp = min(timestamp, now)
+        word_id = int(event['id'])
+        # Later events in the list win ties
+        if word_id not in latest or timestamp >= latest[word_id][0]:
+            latest[word_id] = (timestamp, event['new'])
+    return latest
+
+@api_view(['POST'])
+def confidence_batch(request):
+    """
+    View function to apply a batch of confidence changes at once, such as a whole study session
+    recorded offline: a list of {"id": word ID, "new": confidence, "timestamp": when it was made}.
+
+    Changes are last-write-wins: a change older than the word's current confidence (or than
+    a later change in the same batch) is ignored, while changes to anything else do not count. The response gives the resulting confidence
+    of each word.
+    """
+    try:
+        latest = _parse_confidence_events(request.data)
+    except (TypeError, ValueError) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        # Lock the words, so that concurrent syncs cannot both compare against the same old values
+        words = list(Word.objects.select_for_update().filter(user=request.user.id, pk__in=list(latest))
+                     .only('id', 'user', 'word', 'pinyin', 'pinyin_plain', 'confidence', 'confidence_changed_at',
+                           'last_modified'))
+        if len(words) != len(latest):
+            raise Http404
+        now = timezone.now()
+        changed = []
+        for word in words:
+            (timestamp, new_confidence) = latest[word.id]
+            if word.confidence_changed_at is None or timestamp > word.confidence_changed_at:
+                changed.append((word, new_confidence, word.confidence, timestamp))
+                word.confidence = new_confidence
+                word.confidence_changed_at = timestamp
+                # The time of the write rather than of the change, so that conditional GETs and
+                # the flashcard indexes in other processes see that the words have changed
+                word.last_modified = now
+        if changed:
+            Word.objects.bulk_update([word for (word, _, _, _) in changed],
+                                     ['confidence', 'confidence_changed_at', 'last_modified'])
+            # Logged as of when they were made, so that offline study counts on the right day
+            log_review_events(ReviewEvent.CONFIDENCE, [(word.user_id, word.id, new, previous, timestamp)
+                                                       for (word, new, previous, timestamp) in changed])
+    if changed:
+        sampling.words_updated(request.user.id, [word for (word, _, _, _) in changed])
+        cache.invalidate_user(request.user.id)
+        suggest.words_updated(request.user.id, [word for (word, _, _, _) in changed])
+    return Response([{"id": word.id, "confidence": word.confidence} for word in sorted(words, key=lambda w: w.id)])
+
+@api_view(['POST'])
+def review(request, word_id):
+    """View function to record the outcome of a spaced repetition review of a word"""
+    state = get_object_or_404(ReviewState, word=int(word_id), user=request.user.id)
+    try:
+        grade = int(request.data['grade'])
+    except (KeyError, TypeError, ValueError):
+        return Response({"error": "Must specify a number from {0} to {1} as the 'grade' for the review".format(
+                            scheduling.MIN_GRADE, scheduling.MAX_GRADE)},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        state = scheduling.record_review(state, grade)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    log_review_events(ReviewEvent.REVIEW, [(state.user_id, state.word_id, grade, None, None)])
+    return Response({"repetitions": state.repetitions, "interval": state.interval, "ease": state.ease,
+                     "due_at": state.due_at.isoformat()})
+
+@api_view(['GET'])
+def review_days(request):
+    """
+    View function for the number of reviews and confidence changes per day, as of the
+    last rollup of the review log (see the rollup_reviews management command)
+    """
+    try:
+        days = history.review_days(request.user.id, int(request.query_params.get('days', 30)))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(days)
+
+@api_view(['GET'])
+def tag_confidence(request):
+    """
+    View function for the number of the user's words at each confidence level per tag, as of
+    the last rollup (see the rollup_reviews management command)
+    """
+    return Response(history.tag_confidence(request.user.id))
+
+@api_view(['GET'])
+def word_stats(request):
+    """View function for histograms of the user's words by tag, confidence and week added"""
+    return Response(cache.get_or_set(request.user.id, 'stats', lambda: stats.user_stats(request.user.id)))
+
 @api_view(['GET'])
 def search_exact(request, word):
     """Search for an exact word"""
     words = Word.objects.filter(word=word, user=request.user.id)
     serializer = WordSerializer()
     return Response(serializer.serialize_many(words))
+
+@api_view(['GET'])
+def search_words(request, query):
+    """
+    Search for words by hanzi, by pinyin (with or without tones) or by English words
+    in definitions and example sentences, returning the best matches first
+    """
+    word_ids = search.search(request.user.id, query)
+    words = Word.objects.in_bulk(word_ids)
+    serializer = WordSerializer()
+    return Response(serializer.serialize_many([words[word_id] for word_id in word_ids if word_id in words]))
+
+MAX_SUGGESTIONS = 100
+
+@api_view(['GET'])
+def suggest_words(request):
+    """
+    View function for search-as-you-type: up to 'limit' of the user's words starting with 'q',
+    either as hanzi or as pinyin with or without tones
+    """
+    try:
+        limit = int(request.query_params.get('limit', suggest.MAX_SUGGESTIONS))
+        if limit <= 0 or limit > MAX_SUGGESTIONS:
+            raise ValueError("Limit must be between 1 and {0}, found {1}".format(MAX_SUGGESTIONS, limit))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(suggest.suggest(request.user.id, request.query_params.get('q', ''), limit))
+
+@api_view(['POST'])
+def import_words(request):
+    """
+    View function to import many words at once, either as JSON lines (one word per line,
+    in the same format as the words API) or as CSV if the content type is text/csv.
+    The response reports how many words were created, and any rows which were rejected.
+    """
+    lines = bulk.decode_lines(iter(request.stream.readline, b'')) if request.stream else []
+    if request.content_type.startswith('text/csv'):
+        word_maps = bulk.read_csv(lines)
+    else:
+        word_maps = bulk.read_json_lines(lines)
+    try:
+        result = bulk.import_words(request.user, word_maps)
+    except UnicodeDecodeError as e:
+        return Response({"error": "Input must be UTF-8: {0}".format(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result)
+
+@api_view(['GET'])
+def export_words(request):
+    """
+    View function to download all of a user's words at once, as JSON lines which can be
+    imported again through import_words
+    """
+    words = Word.objects.filter(user=request.user.id)
+    response = StreamingHttpResponse(bulk.export_words(words), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="words.jsonl"'
+    return response